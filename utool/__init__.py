@@ -55,6 +55,7 @@ IMPORT_TUPLES = [
     ('util_assert',    None),
     ('util_autogen',   None),
     ('util_cache',     ['global_cache_read', 'global_cache_write']),
+    ('util_cachestats', None),
     ('util_cplat',     ['cmd', 'view_directory',]),
     ('util_class',     None),
     ('util_const',     None),
@@ -139,6 +140,7 @@ if DOELSE:
     from utool import util_assert
     from utool import util_autogen
     from utool import util_cache
+    from utool import util_cachestats
     from utool import util_cplat
     from utool import util_class
     from utool import util_const
@@ -258,23 +260,43 @@ if DOELSE:
                                     print_auto_docstr,
                                     remove_codeblock_syntax_sentinals,
                                     write_modscript_alias,)
-    from utool.util_cache import (Cachable, CacheMissException, Cacher,
-                                  GlobalShelfContext, KeyedDefaultDict,
-                                  LRUDict, LazyDict, LazyList, ShelfCacher,
-                                  USE_CACHE, VERBOSE_CACHE, cached_func,
-                                  cachestr_repr, chain, consensed_cfgstr,
-                                  delete_global_cache, from_json,
-                                  get_cfgstr_from_args, get_default_appname,
+    from utool.util_cache import (CACHABLE_MANIFEST_FNAME,
+                                  CACHABLE_MANIFEST_LOG_FNAME,
+                                  CACHE_ACCESS_FNAME, CACHE_INDEX_FNAME,
+                                  Cachable, CachableManifest, CacheDirManager,
+                                  CacheFileLock, CacheMissException,
+                                  CacheWriteBehind, CacheWriteError, Cacher,
+                                  CheckpointLog, GlobalShelfContext,
+                                  ItemCacher, KeyedDefaultDict, LRUDict,
+                                  LazyDict, LazyList, MemoryCache, ShelfCacher,
+                                  SqliteKeyValueStore, USE_CACHE,
+                                  VERBOSE_CACHE, cache_dir_main, cached_func,
+                                  cachestr_repr, chain, checkpointed_generate,
+                                  consensed_cfgstr, delete_global_cache,
+                                  flush_cache_writes, from_json,
+                                  get_cachable_manifest, get_cache_dir_manager,
+                                  get_cache_writer, get_cfgstr_from_args,
+                                  get_default_appname,
                                   get_func_result_cachekey,
-                                  get_global_cache_dir, get_global_shelf_fpath,
-                                  get_lru_cache, global_cache_dump,
-                                  global_cache_read, global_cache_write,
-                                  load_cache, make_utool_json_encoder,
-                                  save_cache, shelf_open, text_dict_read,
-                                  text_dict_write, time_different_diskstores,
-                                  to_json, tryload_cache, tryload_cache_list,
+                                  get_global_cache_dir, get_global_kvstore,
+                                  get_global_kvstore_fpath,
+                                  get_global_shelf_fpath, get_lru_cache,
+                                  global_cache_dump, global_cache_read,
+                                  global_cache_read_many, global_cache_write,
+                                  global_cache_write_many, load_cache,
+                                  make_utool_json_encoder, save_cache,
+                                  set_cache_dir_budget, shelf_open,
+                                  text_dict_read, text_dict_write,
+                                  time_cfgstr_from_args,
+                                  time_different_diskstores,
+                                  time_memory_caches, to_json, tryload_cache,
+                                  tryload_cache_list,
                                   tryload_cache_list_with_compute,
                                   view_global_cache_dir,)
+    from utool.util_cachestats import (CacheCounter, dump_cache_stats,
+                                       enable_cache_stats, get_cache_counter,
+                                       get_cache_stats, print_cache_stats,
+                                       reset_cache_stats,)
     from utool.util_cplat import (COMPUTER_NAME, DARWIN, EXIT_FAILURE,
                                   EXIT_SUCCESS, LIB_DICT, LIB_EXT_LIST, LINUX,
                                   OS_TYPE, PYLIB_DICT, UNIX, WIN32,
@@ -530,15 +552,20 @@ if DOELSE:
                                   translate_graph, translate_graph_to_origin,
                                   traverse_path,)
     from utool.util_hash import (ALPHABET, ALPHABET_16, ALPHABET_27, BIGBASE,
-                                 DictProxyType, HASH_LEN, augment_uuid,
-                                 combine_uuids, convert_hexstr_to_bigbase,
-                                 deterministic_uuid, get_file_hash,
-                                 write_hash_file, write_hash_file_for_path,
-                                 get_file_uuid, get_zero_uuid,
-                                 hashable_to_uuid, hashstr, hashstr27,
-                                 hashstr_arr, hashstr_arr27, hashstr_md5,
-                                 hashstr_sha1, image_uuid, make_hash,
-                                 random_nonce, random_uuid, stringlike,)
+                                 DictProxyType, FileHashIndex, HASH_LEN,
+                                 augment_uuid, augment_uuids,
+                                 combine_uuid_groups, combine_uuids,
+                                 convert_hexstr_to_bigbase, deterministic_uuid,
+                                 find_duplicate_files, get_file_hash,
+                                 get_file_hash_index, get_file_hashes,
+                                 get_file_sample_hash, get_file_uuid,
+                                 get_zero_uuid, hash_array, hash_data,
+                                 hashable_to_uuid, hashables_to_uuids, hashstr,
+                                 hashstr27, hashstr_arr, hashstr_arr27,
+                                 hashstr_md5, hashstr_sha1, image_uuid,
+                                 iter_duplicate_files, make_hash, random_nonce,
+                                 random_uuid, stringlike, update_hasher,
+                                 write_hash_file, write_hash_file_for_path,)
     from utool.util_import import (check_module_installed,
                                    get_modpath_from_modname, import_modname,
                                    import_module_from_fpath, import_star,
@@ -723,11 +750,12 @@ if DOELSE:
                                  remove_broken_links, remove_dirs,
                                  remove_existing_fpaths, remove_file,
                                  remove_file_list, remove_files_in_dir,
-                                 remove_fpaths, sanitize_filename,
-                                 search_candidate_paths, search_in_dirs, sed,
-                                 sedfile, splitdrive, symlink, tail, testgrep,
-                                 touch, truepath, truepath_relative,
-                                 unexpanduser, unixjoin, win_shortcut,)
+                                 remove_fpaths, replace_file,
+                                 sanitize_filename, search_candidate_paths,
+                                 search_in_dirs, sed, sedfile, splitdrive,
+                                 symlink, tail, testgrep, touch, truepath,
+                                 truepath_relative, unexpanduser, unixjoin,
+                                 win_shortcut,)
     from utool.util_print import (Indenter, NO_INDENT, colorprint, cprint,
                                   dictprint, horiz_print, printNOTQUIET,
                                   printVERBOSE, printWARN, print_code,
@@ -754,20 +782,34 @@ if DOELSE:
                                     glob_projects, grep_projects,
                                     ibeis_user_profile, sed_projects,
                                     setup_repo,)
-    from utool.util_parallel import (BACKEND, FUTURE_ON, KillableProcess,
-                                     KillableThread, MIN_PARALLEL_TASKS,
-                                     USE_GLOBAL_POOL, VERBOSE_PARALLEL,
-                                     VERYVERBOSE_PARALLEL, bgfunc,
-                                     buffered_generator, close_pool,
+    from utool.util_parallel import (AUTO_PROBE_TASKS, AUTO_PROBE_TIME,
+                                     AUTO_SERIAL_TIME, AUTO_THREAD_CPU_RATIO,
+                                     BACKEND, BACKENDS, FUTURE_ON,
+                                     HAVE_SHARED_MEMORY, KillableProcess,
+                                     KillableThread, MIN_CHUNKS_PER_PROC,
+                                     MIN_PARALLEL_TASKS, Pipeline,
+                                     SHARED_MEMORY_MIN_BYTES, SharedArrayArena,
+                                     SharedArrayHandle, TARGET_CHUNK_TIME,
+                                     TaskBroker, TaskResult, TaskTimeoutError,
+                                     USE_GLOBAL_POOL, USE_PERSISTENT_POOL,
+                                     VERBOSE_PARALLEL, VERYVERBOSE_PARALLEL,
+                                     adaptive_chunksize, async_generate,
+                                     async_generate_sync, bgfunc,
+                                     buffered_generator, choose_backend,
+                                     close_persistent_pool, close_pool,
                                      ensure_pool, futures_generate,
                                      futures_map, generate,
                                      get_default_numprocs,
-                                     get_sys_thread_limit, in_main_process,
-                                     init_pool, init_worker, new_pool, process,
+                                     get_default_numthreads,
+                                     get_persistent_pool, get_sys_thread_limit,
+                                     in_main_process, init_pool, init_worker,
+                                     lpt_order, new_pool, process, run_worker,
                                      set_num_procs,
                                      spawn_background_daemon_thread,
                                      spawn_background_process,
-                                     spawn_background_thread,)
+                                     spawn_background_thread,
+                                     time_cost_scheduling,
+                                     time_generate_throughput,)
     from utool.util_resources import (available_memory, current_memory_usage,
                                       get_matching_process_ids,
                                       get_memstats_str,
@@ -975,6 +1017,7 @@ if DOELSE:
         get_rrr(util_assert)(verbose > 1)
         get_rrr(util_autogen)(verbose > 1)
         get_rrr(util_cache)(verbose > 1)
+        get_rrr(util_cachestats)(verbose > 1)
         get_rrr(util_cplat)(verbose > 1)
         get_rrr(util_class)(verbose > 1)
         get_rrr(util_const)(verbose > 1)
@@ -30,8 +30,8 @@ class SourceDir(ut.NiceRepr):
 
     def index(self):
         fpaths = self.fpaths()
-        prog =  ut.ProgIter(fpaths, length=len(self), label='building uuid')
-        self.uuids = self._md5(prog)
+        prog = ut.ProgIter(fpaths, length=len(self), label='building uuid')
+        self.uuids = list(self._md5(prog))
 
     def _nbytes(self, fpaths):
         return (ut.get_file_nBytes(fpath) for fpath in fpaths)
@@ -39,13 +39,16 @@ class SourceDir(ut.NiceRepr):
     def _full_path(self, fpaths):
         return fpaths
 
-    def _md5(self, fpaths):
-        import hashlib
-        return (ut.get_file_hash(fpath, hasher=hashlib.md5()) for fpath in fpaths)
+    def _md5(self, fpaths, chunksize=1024):
+        # unchanged files are looked up in the persistent index, not re-read.
+        # Chunks keep a progress iterator over fpaths moving.
+        for chunk in ut.ichunks(fpaths, chunksize):
+            for digest in ut.get_file_hashes(chunk, hash_name='md5'):
+                yield digest
 
     def _md5_stride(self, fpaths):
-        import hashlib
-        return (ut.get_file_hash(fpath, hasher=hashlib.md5(), stride=1024) for fpath in fpaths)
+        # sampled digest, independent of the read blocksize
+        return (ut.get_file_sample_hash(fpath, hash_name='md5') for fpath in fpaths)
 
     # def _sha1(self, fpaths):
     #     import hashlib
@@ -106,11 +109,17 @@ class SourceDir(ut.NiceRepr):
         data.print(ignore=['full_path', 'dname'])
 
     def find_internal_duplicates(self):
-        # First find which files take up the same amount of space
-        nbytes = self.get_prop('nbytes')
-        dups = ut.find_duplicate_items(nbytes)
-        # Now evaluate the hashes of these candidates
-        cand_idxs = ut.flatten(dups.values())
+        # Group by size, then by sampled digests, and fully hash only what
+        # still collides
+        fpaths = list(self._abs(self.rel_fpath_list))
+        fpath_to_idx = ut.make_index_lookup(fpaths)
+        info = ut.find_duplicate_files(fpaths, hash_name='md5')
+        print('reclaimable: %s' % (ut.byte_str2(info['reclaimable_bytes']),))
+        cand_idxs = []
+        hashes = []
+        for digest, dup_fpaths in zip(info['digests'], info['dup_sets']):
+            cand_idxs.extend(ut.take(fpath_to_idx, dup_fpaths))
+            hashes.extend([digest] * len(dup_fpaths))
 
         data = ut.ColumnLists({
             'idx': cand_idxs,
@@ -118,13 +127,9 @@ class SourceDir(ut.NiceRepr):
             'dname': self.get_prop('dname', cand_idxs),
             'full_path': self.get_prop('full_path', cand_idxs),
             'nbytes': self.get_prop('nbytes', cand_idxs),
+            'hash': hashes,
         })
-        # print(ut.repr4(ut.group_items(fpaths, nbytes)))
         data.ignore = ['full_path', 'dname']
-        data.print(ignore=['full_path', 'dname'])
-        data['hash'] = self.get_prop('md5', data['idx'])
-        data.print(ignore=['full_path', 'hash'])
-        data.print(ignore=['full_path', 'dname'])
 
         multis = data.get_multis('hash')
         multis.print(ignore=data.ignore)
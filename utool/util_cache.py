@@ -6,12 +6,21 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import shelve
 import six
 import uuid
+import copy
 import json
 import codecs
 import os
+import re
+import sys
+import time
+import atexit
+import weakref
+import threading
+import errno
+import socket
+import fnmatch
 #import lru
 #git+https://github.com/amitdev/lru-dict
-#import atexit
 #import inspect
 import contextlib
 import collections
@@ -20,6 +29,7 @@ from six.moves import range, zip
 from os.path import join, normpath, basename, exists
 from functools import partial
 from itertools import chain
+from timeit import default_timer
 import zipfile
 from utool import util_arg
 from utool import util_hash
@@ -34,6 +44,7 @@ from utool import util_class
 from utool import util_type
 from utool import util_decor
 from utool import util_dict
+from utool import util_cachestats
 from utool._internal import meta_util_constants
 print, rrr, profile = util_inject.inject2(__name__)
 
@@ -51,17 +62,269 @@ class CacheMissException(Exception):
     pass
 
 
+class SqliteKeyValueStore(object):
+    """
+    Persistent dictionary of pickled values backed by SQLite in WAL mode.
+
+    Unlike shelve, the store is safe to use from several processes at once:
+    WAL lets any number of readers proceed while one process writes. Each
+    thread (and each forked process) lazily opens and then keeps its own
+    connection, so repeated reads do not pay to reopen the file.
+
+    Args:
+        fpath (str): path to the sqlite database
+        timeout (float): seconds to wait on a locked database
+        verbose (bool):
+
+    CommandLine:
+        python -m utool.util_cache --test-SqliteKeyValueStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_sqlitekv')
+        >>> fpath = join(dpath, 'test.sqlite')
+        >>> self = SqliteKeyValueStore(fpath)
+        >>> self.clear()
+        >>> self['foo'] = [1, 2, 3]
+        >>> self.set_many([('bar', {'a': 1}), ('baz', None)])
+        >>> assert self['foo'] == [1, 2, 3]
+        >>> assert self.get('missing', 'default') == 'default'
+        >>> assert self.get_many(['bar', 'baz', 'missing']) == {'bar': {'a': 1}, 'baz': None}
+        >>> assert sorted(self.keys()) == ['bar', 'baz', 'foo']
+        >>> del self['foo']
+        >>> assert 'foo' not in self and len(self) == 2
+        >>> self.close()
+    """
+    # sqlite limits the number of host parameters in one statement
+    MAX_BATCH = 900
+
+    def __init__(self, fpath, timeout=30.0, verbose=False):
+        self.fpath = fpath
+        self.timeout = timeout
+        self.verbose = verbose
+        self._local = threading.local()
+        self._all_conns = []
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # never reuse a connection inherited from a parent process
+            import sqlite3
+            if self.verbose:
+                print('[sqlitekv] connecting to %r' % (self.fpath,))
+            conn = sqlite3.connect(self.fpath, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS kvstore '
+                         '(key TEXT PRIMARY KEY, value BLOB)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._all_conns.append(conn)
+        return conn
+
+    def _dumps(self, value):
+        import sqlite3
+        return sqlite3.Binary(pickle.dumps(value, protocol=2))
+
+    def _loads(self, blob):
+        return pickle.loads(bytes(blob))
+
+    def __getitem__(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM kvstore WHERE key=?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._loads(row[0])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_many(self, keys):
+        """
+        Returns:
+            dict: the found key/value pairs, read in as few queries as possible
+        """
+        keys = list(keys)
+        found = {}
+        conn = self.connection
+        for start in range(0, len(keys), self.MAX_BATCH):
+            chunk = keys[start:start + self.MAX_BATCH]
+            query = 'SELECT key, value FROM kvstore WHERE key IN (%s)' % (
+                ','.join(['?'] * len(chunk)),)
+            for key, blob in conn.execute(query, chunk):
+                found[key] = self._loads(blob)
+        return found
+
+    def __setitem__(self, key, value):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO kvstore (key, value) VALUES (?, ?)',
+            (key, self._dumps(value)))
+
+    def set_many(self, items):
+        """ writes all (key, value) pairs in a single transaction """
+        rows = [(key, self._dumps(value)) for key, value in items]
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO kvstore (key, value) VALUES (?, ?)',
+                rows)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def update(self, dict_):
+        self.set_many(six.iteritems(dict_))
+
+    def __delitem__(self, key):
+        cursor = self.connection.execute(
+            'DELETE FROM kvstore WHERE key=?', (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self.connection.execute('DELETE FROM kvstore WHERE key=?', (key,))
+        return value
+
+    def delete_many(self, keys):
+        """ removes all keys in a single transaction """
+        rows = [(key,) for key in keys]
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM kvstore WHERE key=?', rows)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def delete_prefix(self, prefix):
+        """ removes all keys starting with prefix """
+        self.connection.execute(
+            'DELETE FROM kvstore WHERE substr(key, 1, ?) = ?',
+            (len(prefix), prefix))
+
+    def __contains__(self, key):
+        row = self.connection.execute(
+            'SELECT 1 FROM kvstore WHERE key=?', (key,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM kvstore').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [row[0] for row in
+                self.connection.execute('SELECT key FROM kvstore')]
+
+    def items(self):
+        return [(key, self._loads(blob)) for key, blob in
+                self.connection.execute('SELECT key, value FROM kvstore')]
+
+    def iteritems(self, prefix=None):
+        """
+        Streams (key, value) pairs from a cursor instead of loading the whole
+        table, optionally only the keys starting with prefix.
+        """
+        if not prefix:
+            cursor = self.connection.execute('SELECT key, value FROM kvstore')
+        else:
+            # a key range, so the primary key index is used
+            upper = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+            cursor = self.connection.execute(
+                'SELECT key, value FROM kvstore WHERE key >= ? AND key < ?',
+                (prefix, upper))
+        for key, blob in cursor:
+            yield key, self._loads(blob)
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def clear(self):
+        self.connection.execute('DELETE FROM kvstore')
+
+    def sync(self):
+        """ for compatibility with shelve. writes are committed immediately """
+        pass
+
+    def close(self):
+        with self._lock:
+            for conn in self._all_conns:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._all_conns = []
+        self._local = threading.local()
+
+
 #class YACacher(object):
 # @six.add_metaclass(util_class.ReloadingMetaclass)
 @util_class.reloadable_class
 class ShelfCacher(object):
-    """ yet another cacher """
-    def __init__(self, fpath, enabled=True):
+    """
+    yet another cacher
+
+    Args:
+        fpath (str): path to the store
+        enabled (bool):
+        backend (str): 'shelve' (default) uses the shelve file format.
+            'sqlite' keeps a WAL-mode SqliteKeyValueStore open, which is safe
+            for concurrent readers in other processes. The two formats are
+            not compatible, so an existing store must be opened with the
+            backend that wrote it.
+    """
+    def __init__(self, fpath, enabled=True, backend='shelve'):
+        self.shelf = None
         self.verbose = True
         if self.verbose:
             print('[shelfcache] initializing()')
+        if backend not in ('sqlite', 'shelve'):
+            raise ValueError('unknown backend=%r' % (backend,))
         self.fpath = fpath
-        self.shelf = None if not enabled else shelve.open(fpath)
+        self.backend = backend
+        if enabled and backend == 'sqlite':
+            self._check_not_shelve(fpath)
+            self.shelf = SqliteKeyValueStore(fpath)
+        elif enabled:
+            self.shelf = shelve.open(fpath)
+
+    @staticmethod
+    def _check_not_shelve(fpath):
+        """ refuses to open a store written by the shelve backend as sqlite """
+        header = None
+        if exists(fpath):
+            with open(fpath, 'rb') as file_:
+                header = file_.read(16)
+        # dbm modules may add one of these extensions to a shelf path
+        shelf_exts = ['.db', '.dat', '.dir']
+        if ((header and header != b'SQLite format 3\x00') or
+                any(exists(fpath + ext) for ext in shelf_exts)):
+            raise ValueError(
+                'fpath=%r holds a shelve store. Open it with '
+                'backend=shelve' % (fpath,))
 
     def __del__(self):
         self.close()
@@ -75,25 +338,55 @@ class ShelfCacher(object):
     def keys(self):
         return self.shelf.keys()
 
+    def _encode_key(self, cachekey):
+        if self.backend == 'shelve' and six.PY2:
+            # python2 shelves need byte keys; python3 shelves encode str keys
+            return cachekey.encode('ascii')
+        return cachekey
+
     def load(self, cachekey):
         if self.verbose:
             print('[shelfcache] loading %s' % (cachekey,))
 
-        cachekey = cachekey.encode('ascii')
+        cachekey = self._encode_key(cachekey)
         if self.shelf is None or cachekey not in self.shelf:
             raise CacheMissException(
                 'Cache miss cachekey=%r self.fpath=%r' % (cachekey, self.fpath))
         else:
             return self.shelf[cachekey]
 
+    def load_many(self, cachekey_list):
+        """
+        Returns:
+            dict: the cached data for each key that is present
+        """
+        if self.shelf is None:
+            return {}
+        if self.backend == 'sqlite':
+            return self.shelf.get_many(cachekey_list)
+        return {cachekey: self.shelf[self._encode_key(cachekey)]
+                for cachekey in cachekey_list
+                if self._encode_key(cachekey) in self.shelf}
+
     def save(self, cachekey, data):
         if self.verbose:
             print('[shelfcache] saving %s' % (cachekey,))
 
-        cachekey = cachekey.encode('ascii')
+        cachekey = self._encode_key(cachekey)
         if self.shelf is not None:
             self.shelf[cachekey] = data
-        self.shelf.sync()
+            self.shelf.sync()
+
+    def save_many(self, items):
+        """ saves an iterable of (cachekey, data) pairs in one batch """
+        if self.shelf is None:
+            return
+        if self.backend == 'sqlite':
+            self.shelf.set_many(items)
+        else:
+            for cachekey, data in items:
+                self.shelf[self._encode_key(cachekey)] = data
+            self.shelf.sync()
 
     def clear(self):
         if self.verbose:
@@ -106,6 +399,7 @@ class ShelfCacher(object):
             print('[shelfcache] closing()')
         if self.shelf is not None:
             self.shelf.close()
+            self.shelf = None
 
 
 def get_default_appname():
@@ -207,12 +501,223 @@ def _args2_fpath(dpath, fname, cfgstr, ext):
     return fpath
 
 
-def save_cache(dpath, fname, cfgstr, data, ext='.cPkl', verbose=None):
+class CacheWriteError(Exception):
+    """ raised by flush_cache_writes when background cache writes failed """
+    pass
+
+
+class CacheWriteBehind(object):
+    """
+    Writes cache files on a background thread.
+
+    ``submit`` returns as soon as a snapshot of the data is queued: pickled
+    data is serialized right away and other formats are deep copied, so the
+    caller may go on mutating it. The queue is bounded, so a producer that
+    outpaces the disk blocks instead of accumulating unbounded memory. Data
+    waiting to be written is still visible to ``load_cache`` through
+    ``pending``. Failed writes are printed and kept until the next
+    ``flush``, which waits for the queue to drain and raises
+    CacheWriteError if anything failed.
+
+    Args:
+        maxsize (int): maximum number of queued writes (default = 64)
+
+    CommandLine:
+        python -m utool.util_cache --test-CacheWriteBehind
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_writebehind')
+        >>> writer = CacheWriteBehind(maxsize=2)
+        >>> fpath_list = [writer.submit(dpath, 'wb_', str(x), [x] * 10)
+        >>>               for x in range(5)]
+        >>> data = [1, 2]
+        >>> fpath = writer.submit(dpath, 'wb_', 'mutated', data)
+        >>> data.append(3)
+        >>> writer.flush()
+        >>> assert all(map(exists, fpath_list))
+        >>> assert load_cache(dpath, 'wb_', '3') == [3] * 10
+        >>> assert load_cache(dpath, 'wb_', 'mutated') == [1, 2]
+        >>> # data that cannot be pickled is rejected right away
+        >>> ut.assert_raises(Exception, writer.submit, dpath, 'wb_', 'bad',
+        >>>                  lambda: None)
+        >>> # write errors are reported at the flush barrier
+        >>> fpath = writer.submit(join(dpath, 'missing'), 'wb_', 'bad', [1])
+        >>> ut.assert_raises(CacheWriteError, writer.flush)
+        >>> writer.close()
+    """
+    def __init__(self, maxsize=64, verbose=None):
+        from six.moves import queue
+        self.verbose = VERBOSE_CACHE if verbose is None else verbose
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.pending = {}
+        self.errors = []
+        self.num_written = 0
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker,
+                                            name='CacheWriteBehind')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, dpath, fname, cfgstr, data, ext='.cPkl', verbose=None,
+               callback=None):
+        """
+        Queues a save_cache call. Blocks while the queue is full.
+
+        Args:
+            callback (func): called as ``callback(fpath, ok)`` on the writer
+                thread once the write succeeded or failed
+
+        Returns:
+            str: fpath that the data will be written to
+        """
+        fpath = _args2_fpath(dpath, fname, cfgstr, ext)
+        snapshot = _WriteSnapshot(data, ext)
+        with self._lock:
+            self.pending[fpath] = snapshot
+            self._ensure_thread()
+        self._queue.put((dpath, fname, cfgstr, snapshot, ext, verbose, fpath,
+                         callback))
+        return fpath
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                (dpath, fname, cfgstr, snapshot, ext, verbose, fpath,
+                 callback) = item
+                try:
+                    if snapshot.blob is not None:
+                        _write_cache_file(fpath, fname,
+                                          partial(_write_blob, snapshot.blob))
+                    else:
+                        save_cache(dpath, fname, cfgstr, snapshot.data, ext,
+                                   verbose=verbose)
+                except Exception as ex:
+                    print('[cache] background write of %r failed: %s: %s' % (
+                        fpath, type(ex).__name__, ex))
+                    with self._lock:
+                        self.errors.append((fpath, ex))
+                    ok = False
+                else:
+                    self.num_written += 1
+                    ok = True
+                with self._lock:
+                    # a newer submit of the same fpath stays pending
+                    if self.pending.get(fpath, None) is snapshot:
+                        del self.pending[fpath]
+                if callback is not None:
+                    callback(fpath, ok)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, raise_errors=True):
+        """
+        Blocks until every queued write has finished
+        """
+        self._queue.join()
+        with self._lock:
+            errors, self.errors = self.errors, []
+        if errors and raise_errors:
+            msg = '%d background cache writes failed. First: %r: %s' % (
+                len(errors), errors[0][0], errors[0][1])
+            raise CacheWriteError(msg)
+        return errors
+
+    def close(self):
+        """ flushes the queue and stops the worker thread """
+        errors = self.flush(raise_errors=False)
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+        return errors
+
+
+# extensions that util_io.save_data writes with pickle protocol 2
+_PICKLE_EXTS = ('.pickle', '.cPkl', '.pkl')
+
+
+class _WriteSnapshot(object):
+    """ copy of data taken when a background write is queued """
+    def __init__(self, data, ext):
+        if ext in _PICKLE_EXTS:
+            self.blob = pickle.dumps(data, protocol=2)
+            self.data = None
+        else:
+            self.blob = None
+            self.data = copy.deepcopy(data)
+
+    def load(self):
+        if self.blob is not None:
+            return pickle.loads(self.blob)
+        return self.data
+
+
+def _write_blob(blob, fpath):
+    with open(fpath, 'wb') as file_:
+        file_.write(blob)
+
+
+_CACHE_WRITER = None
+
+
+def get_cache_writer(maxsize=64):
+    """ returns the process-wide CacheWriteBehind used by save_cache """
+    global _CACHE_WRITER
+    if _CACHE_WRITER is None:
+        _CACHE_WRITER = CacheWriteBehind(maxsize=maxsize)
+    return _CACHE_WRITER
+
+
+def flush_cache_writes(raise_errors=True):
+    """
+    Barrier that waits for all background cache writes to reach the disk
+    """
+    if _CACHE_WRITER is not None:
+        return _CACHE_WRITER.flush(raise_errors=raise_errors)
+    return []
+
+
+def save_cache(dpath, fname, cfgstr, data, ext='.cPkl', verbose=None,
+               write_behind=False):
     """
     Saves data using util_io, but smartly constructs a filename
+
+    If write_behind is True the write is queued on the background
+    CacheWriteBehind thread. Call flush_cache_writes to wait for it.
     """
+    if write_behind:
+        return get_cache_writer().submit(dpath, fname, cfgstr, data, ext,
+                                         verbose=verbose)
     fpath = _args2_fpath(dpath, fname, cfgstr, ext)
-    util_io.save_data(fpath, data, verbose=verbose)
+    return _write_cache_file(fpath, fname, lambda tmp_fpath: util_io.save_data(
+        tmp_fpath, data, verbose=verbose))
+
+
+def _write_cache_file(fpath, fname, write_func):
+    """ calls write_func(tmp_fpath) and moves the result to fpath """
+    # Write to a temporary file and rename it into place so concurrent
+    # readers never see a partially written cache file.
+    base, ext_ = os.path.splitext(fpath)
+    tmp_fpath = '%s.%s.tmp%s' % (base, uuid.uuid4().hex[0:8], ext_)
+    try:
+        write_func(tmp_fpath)
+        util_path.replace_file(tmp_fpath, fpath)
+    except Exception:
+        if exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+    _record_cache_access(fpath, fname, is_write=True)
     return fpath
 
 
@@ -228,6 +733,13 @@ def load_cache(dpath, fname, cfgstr, ext='.cPkl', verbose=None, enabled=True):
                     (basename(dpath), cfgstr,))
         raise IOError(3, 'Cache Loading Is Disabled')
     fpath = _args2_fpath(dpath, fname, cfgstr, ext)
+    if _CACHE_WRITER is not None and _CACHE_WRITER.pending:
+        with _CACHE_WRITER._lock:
+            snapshot = _CACHE_WRITER.pending.get(fpath, None)
+        if snapshot is not None:
+            if verbose > 2:
+                print('[util_cache] ... cache hit (pending write)')
+            return snapshot.load()
     if not exists(fpath):
         if verbose > 0:
             print('[util_cache] ... cache does not exist: dpath=%r fname=%r cfgstr=%r' % (
@@ -257,6 +769,7 @@ def load_cache(dpath, fname, cfgstr, ext='.cPkl', verbose=None, enabled=True):
     else:
         if verbose > 2:
             print('[util_cache] ... cache hit')
+        _record_cache_access(fpath, fname)
     return data
 
 
@@ -317,14 +830,82 @@ def tryload_cache_list_with_compute(use_cache, dpath, fname, cfgstr_list, comput
 class Cacher(object):
     """
     old non inhertable version of cachable
+
+    Args:
+        mem_max_bytes (int): if specified, an in-process MemoryCache with this
+            byte budget is kept in front of the disk cache, so repeated loads
+            of the same cfgstr are dictionary lookups. (default = None)
+        write_mode (str): 'through' writes to disk on every save. 'back' only
+            writes to the memory tier and flushes to disk when the entry is
+            evicted, on ``flush()``, or at exit. Requires mem_max_bytes.
+        mem_validate (float): minimum number of seconds between checks that
+            the disk entry backing a memory entry has not changed. None
+            disables the check. (default = 1.0)
+        single_flight (bool): if True, a cache miss in ``ensure`` takes a
+            lock file next to the cache entry so only one process computes
+            it. Other processes wait for the lock and then load the result.
+            (default = False)
+        lock_timeout (float): seconds to wait for another process to finish
+            computing before giving up and computing locally. None waits
+            forever. (default = None)
+        write_behind (bool): if True disk writes are queued on a background
+            thread (see CacheWriteBehind) and ``save`` returns immediately.
+            ``flush`` waits for them. (default = False)
+
+    CommandLine:
+        python -m utool.util_cache --test-Cacher
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> cache_dir = ut.ensure_app_resource_dir('utool', 'test_cacher')
+        >>> self = Cacher('test_twotier', cfgstr='a', cache_dir=cache_dir,
+        >>>               mem_max_bytes=2 ** 20, mem_validate=0)
+        >>> self.save([1, 2, 3])
+        >>> assert self.load() == [1, 2, 3]
+        >>> # Modifying the disk entry invalidates the memory entry
+        >>> save_cache(self.dpath, self.fname, 'a', [4, 5, 6, 7])
+        >>> assert self.load() == [4, 5, 6, 7]
+        >>> ut.delete(self.get_fpath())
+        >>> assert self.tryload() is None
+        >>> # write-back mode defers the disk write until flush
+        >>> self2 = Cacher('test_twotier', cfgstr='b', cache_dir=cache_dir,
+        >>>                mem_max_bytes=2 ** 20, write_mode='back')
+        >>> self2.save('data')
+        >>> assert not exists(self2.get_fpath())
+        >>> assert self2.load() == 'data'
+        >>> self2.flush()
+        >>> assert exists(self2.get_fpath())
+        >>> ut.delete(self2.get_fpath())
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> cache_dir = ut.ensure_app_resource_dir('utool', 'test_cacher')
+        >>> self = Cacher('test_singleflight', cfgstr='a', cache_dir=cache_dir,
+        >>>               single_flight=True, lock_timeout=10)
+        >>> ut.delete(self.get_fpath())
+        >>> assert self.ensure(lambda x: [x] * 3, 'x') == ['x', 'x', 'x']
+        >>> assert self.ensure(lambda x: None, 'y') == ['x', 'x', 'x']
+        >>> assert not exists(self.get_fpath() + '.lock')
+        >>> ut.delete(self.get_fpath())
     """
     def __init__(self, fname, cfgstr=None, cache_dir='default',
                  appname='utool', ext='.cPkl', verbose=None,
-                 enabled=True):
+                 enabled=True, mem_max_bytes=None, write_mode='through',
+                 mem_validate=1.0, single_flight=False, lock_timeout=None,
+                 write_behind=False):
         if verbose is None:
             verbose = VERBOSE
         if cache_dir == 'default':
             cache_dir = util_cplat.get_app_resource_dir(appname)
+        if write_mode not in ('through', 'back'):
+            raise ValueError('write_mode=%r must be through or back' % (
+                write_mode,))
+        if write_mode == 'back' and mem_max_bytes is None:
+            raise ValueError('write_mode=back requires mem_max_bytes')
         util_path.ensuredir(cache_dir)
         self.dpath = cache_dir
         self.fname = fname
@@ -332,21 +913,130 @@ class Cacher(object):
         self.verbose = verbose
         self.ext = ext
         self.enabled = enabled
+        self.write_mode = write_mode
+        self.mem_validate = mem_validate
+        self.single_flight = single_flight
+        self.lock_timeout = lock_timeout
+        self.write_behind = write_behind
+        self.stats = util_cachestats.get_cache_counter('Cacher:' + fname)
+        if mem_max_bytes is None:
+            self.memcache = None
+        else:
+            self.memcache = MemoryCache(max_bytes=mem_max_bytes,
+                                        nbytes_func=_memtier_nbytes,
+                                        on_evict=self._on_mem_evict)
+            if write_mode == 'back':
+                _WRITEBACK_CACHERS.add(self)
 
     def get_fpath(self):
         fpath = _args2_fpath(self.dpath, self.fname, self.cfgstr, self.ext)
         return fpath
 
+    def _mem_load(self, cfgstr):
+        """ returns _MEM_MISS if the memory tier cannot provide cfgstr """
+        entry = self.memcache.get(cfgstr)
+        if entry is None:
+            return _MEM_MISS
+        data, fpath, stamp, checked, dirty = entry
+        if (not dirty and stamp is not _WRITE_PENDING and
+                self.mem_validate is not None):
+            now = default_timer()
+            if now - checked >= self.mem_validate:
+                if _disk_stamp(fpath) != stamp:
+                    if self.verbose > 1:
+                        print('[cache] ... %s memory entry is stale' % (
+                            self.fname,))
+                    self.memcache.pop(cfgstr, None)
+                    return _MEM_MISS
+                entry[3] = now
+        return data
+
+    def _mem_store(self, cfgstr, data, fpath, dirty, stamp=None):
+        if stamp is None and not dirty:
+            stamp = _disk_stamp(fpath)
+        entry = [data, fpath, stamp, default_timer(), dirty]
+        self.memcache[cfgstr] = entry
+        if dirty and cfgstr not in self.memcache:
+            # too large for the memory tier, write it through
+            save_cache(self.dpath, self.fname, cfgstr, data, self.ext)
+        return entry
+
+    def _submit_write(self, cfgstr, data, entry=None):
+        """
+        Queues a background write. The stamp of the memory entry is taken
+        once the file is on disk, because the file changes until then.
+        """
+        callback = None
+        if entry is not None:
+            entry[2] = _WRITE_PENDING
+            callback = partial(_on_entry_written, entry)
+        return get_cache_writer().submit(self.dpath, self.fname, cfgstr, data,
+                                         self.ext, verbose=self.verbose,
+                                         callback=callback)
+
+    def _on_mem_evict(self, cfgstr, entry):
+        if util_cachestats.ENABLED:
+            self.stats.evicted()
+        if entry[4]:
+            self._write_back(cfgstr, entry)
+
+    def _write_back(self, cfgstr, entry):
+        entry[3] = default_timer()
+        entry[4] = False
+        if self.write_behind:
+            self._submit_write(cfgstr, entry[0], entry)
+        else:
+            fpath = save_cache(self.dpath, self.fname, cfgstr, entry[0],
+                               self.ext)
+            entry[2] = _disk_stamp(fpath)
+
+    def flush(self):
+        """
+        Writes all entries held only in the memory tier to disk and waits
+        for any background writes to finish
+        """
+        if self.memcache is not None:
+            for cfgstr, entry in self.memcache.items():
+                if entry[4]:
+                    self._write_back(cfgstr, entry)
+        if self.write_behind:
+            flush_cache_writes()
+
     def load(self, cfgstr=None):
         cfgstr = self.cfgstr if cfgstr is None else cfgstr
         assert cfgstr is not None, 'must specify cfgstr in constructor or call'
         assert self.fname is not None, 'no fname'
         assert self.dpath is not None, 'no dpath'
+        use_memcache = (self.memcache is not None and self.enabled and
+                        USE_CACHE)
+        stats_on = util_cachestats.ENABLED
+        if stats_on:
+            start = default_timer()
+        if use_memcache:
+            data = self._mem_load(cfgstr)
+            if data is not _MEM_MISS:
+                if self.verbose > 1:
+                    print('[cache] ... ' + self.fname + ' Cacher memory hit')
+                if stats_on:
+                    self.stats.hit(default_timer() - start)
+                return data
         # TODO: use the computed fpath from this object instead
-        data = load_cache(self.dpath, self.fname, cfgstr, self.ext,
-                          verbose=self.verbose, enabled=self.enabled)
+        try:
+            data = load_cache(self.dpath, self.fname, cfgstr, self.ext,
+                              verbose=self.verbose, enabled=self.enabled)
+        except IOError:
+            if stats_on:
+                self.stats.miss(default_timer() - start)
+            raise
         if self.verbose > 1:
             print('[cache] ... ' + self.fname + ' Cacher hit')
+        fpath = _args2_fpath(self.dpath, self.fname, cfgstr, self.ext)
+        if stats_on:
+            stamp = _disk_stamp(fpath)
+            self.stats.hit(default_timer() - start,
+                           None if stamp is None else stamp[1])
+        if use_memcache:
+            self._mem_store(cfgstr, data, fpath, dirty=False)
         return data
 
     def tryload(self, cfgstr=None):
@@ -370,8 +1060,31 @@ class Cacher(object):
     def ensure(self, func, *args, **kwargs):
         data = self.tryload()
         if data is None:
-            data = func(*args, **kwargs)
-            self.save(data)
+            if self.single_flight:
+                data = self._compute_single_flight(self.cfgstr, func, args,
+                                                   kwargs)
+            else:
+                data = func(*args, **kwargs)
+                self.save(data)
+        return data
+
+    def _compute_single_flight(self, cfgstr, func, args, kwargs):
+        """
+        Computes and saves a missing entry while holding its lock file. If
+        another process held the lock, its result is loaded instead.
+        """
+        fpath = _args2_fpath(self.dpath, self.fname, cfgstr, self.ext)
+        with CacheFileLock(fpath + '.lock', timeout=self.lock_timeout,
+                           verbose=self.verbose) as have_lock:
+            if not have_lock and self.verbose > 0:
+                print('[cache] ... %s lock timed out. computing locally' % (
+                    self.fname,))
+            # The entry may have been written while we waited for the lock
+            data = self.tryload(cfgstr)
+            if data is None:
+                data = func(*args, **kwargs)
+                # Other processes can only see data that reached the disk
+                self._save_through(data, cfgstr, write_behind=False)
         return data
 
     def save(self, data, cfgstr=None):
@@ -381,9 +1094,674 @@ class Cacher(object):
         assert cfgstr is not None, 'must specify cfgstr in constructor or call'
         assert self.fname is not None, 'no fname'
         assert self.dpath is not None, 'no dpath'
+        if self.memcache is not None and self.write_mode == 'back':
+            if self.verbose > 1:
+                print('[cache] ... ' + self.fname + ' Cacher memory save')
+            fpath = _args2_fpath(self.dpath, self.fname, cfgstr, self.ext)
+            self._mem_store(cfgstr, data, fpath, dirty=True)
+            if util_cachestats.ENABLED:
+                self.stats.saved()
+            return
+        self._save_through(data, cfgstr)
+
+    def _save_through(self, data, cfgstr, write_behind=None):
+        if write_behind is None:
+            write_behind = self.write_behind
         if self.verbose > 0:
             print('[cache] ... ' + self.fname + ' Cacher save')
-        save_cache(self.dpath, self.fname, cfgstr, data, self.ext)
+        stats_on = util_cachestats.ENABLED
+        if stats_on:
+            start = default_timer()
+        if write_behind:
+            entry = None
+            if self.memcache is not None:
+                fpath = _args2_fpath(self.dpath, self.fname, cfgstr, self.ext)
+                entry = self._mem_store(cfgstr, data, fpath, dirty=False,
+                                        stamp=_WRITE_PENDING)
+            self._submit_write(cfgstr, data, entry)
+            if stats_on:
+                self.stats.saved(default_timer() - start, None)
+            return
+        fpath = save_cache(self.dpath, self.fname, cfgstr, data, self.ext)
+        if stats_on:
+            stamp = _disk_stamp(fpath)
+            self.stats.saved(default_timer() - start,
+                             None if stamp is None else stamp[1])
+        if self.memcache is not None:
+            self._mem_store(cfgstr, data, fpath, dirty=False)
+
+
+class ItemCacher(object):
+    """
+    Caches the results of a list-valued computation one item at a time.
+
+    All items live in a single SqliteKeyValueStore file per fname, so looking
+    up many keys is one bulk query instead of one file per key. ``ensure``
+    calls the compute function once with only the keys that are missing and
+    writes their results back in one transaction.
+
+    Args:
+        fname (str): name of the cache (also names the store file)
+        cfgstr (str): configuration the cached items depend on. Items cached
+            under different cfgstrs do not collide. (default = '')
+        cache_dir (str): (default = 'default')
+        appname (str): (default = 'utool')
+        enabled (bool): (default = True)
+
+    CommandLine:
+        python -m utool.util_cache --test-ItemCacher
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> cache_dir = ut.ensure_app_resource_dir('utool', 'test_itemcacher')
+        >>> self = ItemCacher('squares', cfgstr='v1', cache_dir=cache_dir)
+        >>> self.clear()
+        >>> computed = []
+        >>> def compute_squares(rowids):
+        ...     computed.append(list(rowids))
+        ...     return [rowid ** 2 for rowid in rowids]
+        >>> data1 = self.ensure(compute_squares, [1, 2, 3, 2])
+        >>> data2 = self.ensure(compute_squares, [3, 4, 1])
+        >>> # numpy scalars are the same keys as python scalars
+        >>> import numpy as np
+        >>> assert self.load([np.int64(4)]) == ([16], [False])
+        >>> # clearing a cfgstr leaves cfgstrs that extend it alone
+        >>> other = ItemCacher('squares', cfgstr='v1|x', cache_dir=cache_dir)
+        >>> other.save([1], ['other'])
+        >>> self.clear()
+        >>> assert other.load([1]) == (['other'], [False])
+        >>> other.clear()
+        >>> other.close()
+        >>> self.close()
+        >>> result = ('data1=%r, data2=%r, computed=%r' % (data1, data2, computed))
+        >>> print(result)
+        data1=[1, 4, 9, 4], data2=[9, 16, 1], computed=[[1, 2, 3], [4]]
+    """
+    def __init__(self, fname, cfgstr='', cache_dir='default', appname='utool',
+                 enabled=True, verbose=None):
+        if verbose is None:
+            verbose = VERBOSE_CACHE
+        if cache_dir == 'default':
+            cache_dir = util_cplat.get_app_resource_dir(appname)
+        util_path.ensuredir(cache_dir)
+        self.dpath = cache_dir
+        self.fname = fname
+        self.cfgstr = cfgstr
+        self.enabled = enabled
+        self.verbose = verbose
+        self._store = None
+
+    def get_fpath(self):
+        return _args2_fpath(self.dpath, self.fname, '_items', '.sqlite')
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = SqliteKeyValueStore(self.get_fpath())
+        return self._store
+
+    def _key_prefix(self):
+        # escaping makes "cfgstr|" a prefix only of keys under that cfgstr
+        return self.cfgstr.replace('\\', '\\\\').replace('|', '\\|') + '|'
+
+    def _encode_key(self, key):
+        if (type(key).__module__ == 'numpy' and
+                getattr(key, 'shape', None) == ()):
+            # numpy scalars are encoded like the python scalars they equal
+            key = key.item()
+        if isinstance(key, six.string_types):
+            keystr = 's' + key
+        elif isinstance(key, _CFGSTR_SCALAR_TYPES):
+            keystr = 'r' + repr(key)
+        else:
+            keystr = 'h' + util_hash.hash_data(key)
+        return self._key_prefix() + keystr
+
+    def load(self, key_list):
+        """
+        Returns:
+            tuple: (data_list, ismiss_list) where misses have data None
+        """
+        key_list = list(key_list)
+        if not self.enabled or not USE_CACHE:
+            return [None] * len(key_list), [True] * len(key_list)
+        enckey_list = [self._encode_key(key) for key in key_list]
+        found = self.store.get_many(util_list.unique_ordered(enckey_list))
+        ismiss_list = [enckey not in found for enckey in enckey_list]
+        data_list = [found.get(enckey, None) for enckey in enckey_list]
+        if found:
+            _record_cache_access(self.get_fpath(), self.fname)
+        return data_list, ismiss_list
+
+    def save(self, key_list, data_list):
+        """ writes all items in a single transaction """
+        if not self.enabled:
+            return
+        items = [(self._encode_key(key), data)
+                 for key, data in zip(key_list, data_list)]
+        self.store.set_many(items)
+        _record_cache_access(self.get_fpath(), self.fname, is_write=True)
+
+    def ensure(self, compute_fn, key_list, *args, **kwargs):
+        """
+        Loads cached items and computes the rest with a single call to
+        ``compute_fn(miss_keys, *args, **kwargs)``, which must return one
+        result per key.
+        """
+        key_list = list(key_list)
+        data_list, ismiss_list = self.load(key_list)
+        if any(ismiss_list):
+            # Compute each distinct missing key only once
+            enckey_to_data = {}
+            miss_keys = []
+            for key, ismiss in zip(key_list, ismiss_list):
+                if ismiss:
+                    enckey = self._encode_key(key)
+                    if enckey not in enckey_to_data:
+                        enckey_to_data[enckey] = None
+                        miss_keys.append(key)
+            newdata_list = list(compute_fn(miss_keys, *args, **kwargs))
+            assert len(newdata_list) == len(miss_keys), (
+                'compute_fn returned %d results for %d keys' % (
+                    len(newdata_list), len(miss_keys)))
+            self.save(miss_keys, newdata_list)
+            for key, newdata in zip(miss_keys, newdata_list):
+                enckey_to_data[self._encode_key(key)] = newdata
+            data_list = [enckey_to_data[self._encode_key(key)] if ismiss
+                         else data
+                         for key, data, ismiss in
+                         zip(key_list, data_list, ismiss_list)]
+        if self.verbose > 0:
+            num_hits = len(key_list) - sum(ismiss_list)
+            print('[cache] %d/%d item cache hits for %s' % (
+                num_hits, len(key_list), self.fname))
+        return data_list
+
+    def delete(self, key_list):
+        for key in key_list:
+            self.store.pop(self._encode_key(key), None)
+
+    def clear(self):
+        """ removes every item cached under this cfgstr """
+        self.store.delete_prefix(self._key_prefix())
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+class CheckpointLog(object):
+    """
+    Append-only file of pickled (key, result) records.
+
+    Records are appended with one pickle.dump each and the file is fsynced
+    at most every ``sync_every`` seconds. A record torn by a crash is cut off
+    the next time the log is loaded. ``load_offsets`` only keeps the file
+    offset of each record, so results can be read back one at a time with
+    ``read``.
+
+    Args:
+        fpath (str): path of the log file
+        sync_every (float): seconds between fsyncs (default = 1.0)
+    """
+    def __init__(self, fpath, sync_every=1.0):
+        self.fpath = fpath
+        self.sync_every = sync_every
+        self._file = None
+        self._reader = None
+        self._last_sync = 0.0
+
+    def _iter_records(self):
+        """ yields (offset, key, result) and cuts off a torn tail """
+        if not exists(self.fpath):
+            return
+        good_offset = 0
+        with open(self.fpath, 'rb') as file_:
+            while True:
+                try:
+                    key, result = pickle.load(file_)
+                except EOFError:
+                    break
+                except Exception:
+                    # torn record at the end of the log
+                    break
+                yield good_offset, key, result
+                good_offset = file_.tell()
+        if good_offset < os.path.getsize(self.fpath):
+            with open(self.fpath, 'ab') as file_:
+                file_.truncate(good_offset)
+
+    def load(self):
+        """
+        Returns:
+            dict: mapping from key to result of every complete record
+        """
+        return {key: result for _, key, result in self._iter_records()}
+
+    def load_offsets(self):
+        """
+        Returns:
+            dict: mapping from key to the offset of its latest record
+        """
+        return {key: offset for offset, key, _ in self._iter_records()}
+
+    def read(self, offset):
+        """
+        Returns:
+            tuple: (key, result) of the record at offset
+        """
+        self.flush()
+        if self._reader is None:
+            self._reader = open(self.fpath, 'rb')
+        self._reader.seek(offset)
+        return pickle.load(self._reader)
+
+    def append(self, key, result):
+        """
+        Returns:
+            int: offset of the new record
+        """
+        if self._file is None:
+            self._file = open(self.fpath, 'ab')
+        offset = self._file.tell()
+        pickle.dump((key, result), self._file, protocol=2)
+        now = default_timer()
+        if now - self._last_sync >= self.sync_every:
+            self.flush(fsync=True)
+            self._last_sync = now
+        return offset
+
+    def rewrite(self, offset_list):
+        """
+        Replaces the log with the records at offset_list, in that order,
+        copying one record at a time.
+        """
+        tmp_fpath = self.fpath + '.%s.tmp' % (uuid.uuid4().hex[0:8],)
+        try:
+            with open(tmp_fpath, 'wb') as file_:
+                for offset in offset_list:
+                    pickle.dump(self.read(offset), file_, protocol=2)
+                file_.flush()
+                os.fsync(file_.fileno())
+            self.close()
+            util_path.replace_file(tmp_fpath, self.fpath)
+        except Exception:
+            if exists(tmp_fpath):
+                os.remove(tmp_fpath)
+            raise
+
+    def flush(self, fsync=False):
+        if self._file is not None:
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.flush(fsync=True)
+            self._file.close()
+            self._file = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def delete(self):
+        self.close()
+        if exists(self.fpath):
+            util_path.remove_file(self.fpath, verbose=False)
+
+
+def checkpointed_generate(func, args_list, fname=None, cfgstr='',
+                          cache_dir='default', appname='utool', key='index',
+                          compact=True, reset=False, prog=True, verbose=None,
+                          **kwargs):
+    r"""
+    Resumable version of ut.generate.
+
+    Every result is appended to a CheckpointLog as soon as it is produced
+    and is not kept in memory afterwards. When the same call is repeated
+    after a crash or preemption the finished tasks are read back from the
+    log one at a time instead of being recomputed, and the old and new
+    results are yielded together in the order of args_list. The log stays
+    as the store of the results. Only the keys and log offsets of the tasks
+    are held in memory. If args_list is a sequence only the positions of
+    unfinished tasks are kept; other iterables keep the unfinished args.
+
+    Args:
+        func (function): function to apply to each argument
+        args_list (list or iter): arguments of each task
+        fname (str): name of the checkpoint (defaults to the function name)
+        cfgstr (str): configuration the results depend on
+        cache_dir (str): (default = 'default')
+        appname (str): (default = 'utool')
+        key (str): 'index' identifies a task by its position in args_list.
+            'hash' identifies it by the hash of its arguments, so args_list
+            may be reordered or extended between runs.
+        compact (bool): when every task is done, rewrite the log in the
+            order of args_list without records of other tasks
+            (default = True)
+        reset (bool): discard previous checkpoints (default = False)
+        **kwargs: passed to ut.generate. Results are always generated in
+            order, so ordered=False, on_error and broker are rejected.
+
+    Yields:
+        result of func for each args in args_list
+
+    CommandLine:
+        python -m utool.util_cache --test-checkpointed_generate
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> import itertools
+        >>> cache_dir = ut.ensure_app_resource_dir('utool', 'test_checkpoint')
+        >>> computed = []
+        >>> def square(x):
+        ...     computed.append(x)
+        ...     return x ** 2
+        >>> kw = dict(fname='squares', cache_dir=cache_dir, force_serial=True,
+        >>>           verbose=False)
+        >>> # Simulate a run that dies after four results
+        >>> gen = checkpointed_generate(square, range(10), reset=True, **kw)
+        >>> partial = list(itertools.islice(gen, 4))
+        >>> gen.close()
+        >>> resumed = list(checkpointed_generate(square, range(10), **kw))
+        >>> again = list(checkpointed_generate(square, iter(range(10)), **kw))
+        >>> assert resumed == again == [x ** 2 for x in range(10)]
+        >>> ut.assert_raises(ValueError, checkpointed_generate, square,
+        >>>                  range(10), ordered=False, **kw)
+        >>> result = 'partial=%r\ncomputed=%r' % (partial, computed)
+        >>> print(result)
+        partial=[0, 1, 4, 9]
+        computed=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    """
+    from utool import util_parallel
+    from utool import util_progress
+    from utool._internal.meta_util_six import get_funcname
+    if key not in ('index', 'hash'):
+        raise ValueError('key=%r must be index or hash' % (key,))
+    if not kwargs.get('ordered', True):
+        raise ValueError('checkpointed_generate results are always ordered')
+    for name in ['on_error', 'broker']:
+        if kwargs.get(name, None) is not None:
+            raise ValueError('%s is not supported by checkpointed_generate' % (
+                name,))
+    kwargs['ordered'] = True
+    if verbose is None:
+        verbose = VERBOSE_CACHE
+    if fname is None:
+        fname = get_funcname(func)
+    if cache_dir == 'default':
+        cache_dir = util_cplat.get_app_resource_dir(appname)
+    util_path.ensuredir(cache_dir)
+    log = CheckpointLog(_args2_fpath(cache_dir, fname, cfgstr, '.ckpt'))
+    if reset:
+        log.delete()
+
+    offset_of = log.load_offsets()
+    num_logged = len(offset_of)
+    is_sequence = (hasattr(args_list, '__len__') and
+                   hasattr(args_list, '__getitem__'))
+    key_list = []
+    # Each unfinished key is computed once, at its first occurrence
+    todo_set = set()
+    todo_items = []  # positions in args_list, or the args themselves
+    for count, args in enumerate(args_list):
+        key_ = count if key == 'index' else util_hash.hash_data(args)
+        key_list.append(key_)
+        if key_ not in offset_of and key_ not in todo_set:
+            todo_set.add(key_)
+            todo_items.append(count if is_sequence else args)
+    num_todo = len(todo_items)
+    if verbose:
+        print('[cache] checkpoint %s: %d/%d tasks already done' % (
+            fname, len(key_list) - num_todo, len(key_list)))
+
+    def _todo_args():
+        if is_sequence:
+            for count in todo_items:
+                yield args_list[count]
+        else:
+            for args in todo_items:
+                yield args
+
+    def _merged():
+        if num_todo:
+            new_results = util_parallel.generate(
+                func, _todo_args(), nTasks=num_todo, prog=False,
+                verbose=verbose, **kwargs)
+        try:
+            for key_ in key_list:
+                if key_ in todo_set:
+                    result = six.next(new_results)
+                    offset_of[key_] = log.append(key_, result)
+                    todo_set.remove(key_)
+                    yield result
+                    del result
+                else:
+                    yield log.read(offset_of[key_])[1]
+            if compact and (num_todo or num_logged != len(key_list)):
+                # one record per task, in order, so the next run reads the
+                # log sequentially
+                seen = set()
+                log.rewrite([offset_of[key_] for key_ in key_list
+                             if not (key_ in seen or seen.add(key_))])
+        finally:
+            log.close()
+
+    if prog:
+        lbl = '(ckpt) %s: ' % (fname,)
+        return iter(util_progress.ProgressIter(
+            _merged(), nTotal=len(key_list), lbl=lbl, verbose=verbose))
+    return _merged()
+
+
+# Sentinal for misses in the Cacher memory tier (None is valid data)
+_MEM_MISS = object()
+
+# Write-back cachers that need to be flushed before exit
+_WRITEBACK_CACHERS = weakref.WeakSet()
+
+
+# stamp of a memory entry whose background write has not finished
+_WRITE_PENDING = 'write_pending'
+
+
+def _on_entry_written(entry, fpath, ok):
+    if entry[2] is _WRITE_PENDING:
+        entry[2] = _disk_stamp(fpath) if ok else None
+
+
+def _memtier_nbytes(entry):
+    """ size of a Cacher memory tier entry is the size of its data """
+    return _default_nbytes(entry[0])
+
+
+def _disk_stamp(fpath):
+    """ identifies a version of a disk entry without reading it """
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return None
+    mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+    return (mtime, stat.st_size)
+
+
+class CacheFileLock(object):
+    """
+    Cross-process lock represented by the existence of a lock file.
+
+    The owner (host and pid) is written to a temporary file which is then
+    hard-linked into place, so the lock file never exists without its owner.
+    A lock left behind by a dead process on this host is broken
+    automatically. Breakers serialize on a separate ``.break`` lock and
+    re-check the owner under it, so a lock that was already broken and
+    retaken is never removed. Entering the
+    context returns True if the lock was acquired and False if ``timeout``
+    seconds passed first.
+
+    Args:
+        lock_fpath (str): path of the lock file
+        timeout (float): seconds to wait. None waits forever.
+        poll (float): seconds between attempts
+
+    CommandLine:
+        python -m utool.util_cache --test-CacheFileLock
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_cacher')
+        >>> lock_fpath = join(dpath, 'test.lock')
+        >>> with CacheFileLock(lock_fpath) as have_lock1:
+        ...     with CacheFileLock(lock_fpath, timeout=0.1) as have_lock2:
+        ...         pass
+        >>> assert have_lock1 and not have_lock2
+        >>> assert not exists(lock_fpath)
+    """
+    def __init__(self, lock_fpath, timeout=None, poll=0.05, verbose=False):
+        self.lock_fpath = lock_fpath
+        self.timeout = timeout
+        self.poll = poll
+        self.verbose = verbose
+        self.locked = False
+        self._owner = '%s:%d' % (socket.gethostname(), os.getpid())
+        # seconds after which an abandoned ``.break`` lock is removed
+        self.break_grace = 10.0
+
+    @staticmethod
+    def _read_owner(fpath):
+        try:
+            with open(fpath, 'r') as file_:
+                return file_.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _dead_owner(self):
+        """ returns the owner recorded in the lock file if it is dead """
+        owner = self._read_owner(self.lock_fpath)
+        try:
+            host, pid = owner.rsplit(':', 1)
+            pid = int(pid)
+        except (AttributeError, ValueError):
+            return None
+        if host != socket.gethostname() or os.name != 'posix':
+            return None
+        try:
+            os.kill(pid, 0)
+        except OSError as ex:
+            if ex.errno == errno.ESRCH:
+                return owner
+        return None
+
+    def _create(self, fpath):
+        """
+        Atomically creates fpath containing the owner. Raises OSError with
+        EEXIST if it already exists.
+        """
+        if not hasattr(os, 'link'):
+            fd = os.open(fpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            try:
+                os.write(fd, self._owner.encode('utf8'))
+            finally:
+                os.close(fd)
+            return
+        tmp_fpath = '%s.tmp.%s.%s' % (fpath, self._owner, uuid.uuid4().hex)
+        with open(tmp_fpath, 'w') as file_:
+            file_.write(self._owner)
+        try:
+            os.link(tmp_fpath, fpath)
+        finally:
+            os.remove(tmp_fpath)
+
+    def _break_stale(self, dead_owner):
+        """
+        Removes the lock of dead_owner and returns True if it did. Only the
+        holder of the ``.break`` lock may break, and it re-reads the owner
+        first, so a lock that another process broke and retook meanwhile is
+        left alone.
+        """
+        break_fpath = self.lock_fpath + '.break'
+        try:
+            self._create(break_fpath)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+            # a breaker that died mid-break must not block everyone forever
+            try:
+                age = time.time() - os.stat(break_fpath).st_mtime
+            except OSError:
+                return False
+            if age > self.break_grace:
+                try:
+                    os.remove(break_fpath)
+                except OSError:
+                    pass
+            return False
+        try:
+            if self._read_owner(self.lock_fpath) != dead_owner:
+                return False
+            try:
+                os.remove(self.lock_fpath)
+            except OSError:
+                return False
+            return True
+        finally:
+            os.remove(break_fpath)
+
+    def acquire(self):
+        start = default_timer()
+        while True:
+            try:
+                self._create(self.lock_fpath)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+                dead_owner = self._dead_owner()
+                if dead_owner is not None:
+                    if self.verbose:
+                        print('[cache] breaking stale lock %r' % (
+                            self.lock_fpath,))
+                    if self._break_stale(dead_owner):
+                        continue
+                if (self.timeout is not None and
+                        default_timer() - start >= self.timeout):
+                    return False
+                time.sleep(self.poll)
+            else:
+                self.locked = True
+                return True
+
+    def release(self):
+        if self.locked:
+            self.locked = False
+            try:
+                os.remove(self.lock_fpath)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, type_, value, trace):
+        self.release()
+
+
+@atexit.register
+def _flush_writeback_cachers():
+    for cacher in list(_WRITEBACK_CACHERS):
+        try:
+            cacher.flush()
+        except Exception as ex:
+            print('[cache] Failed to flush %s: %s' % (cacher.fname, ex))
+    # Background writes must finish before the interpreter exits
+    if _CACHE_WRITER is not None:
+        _CACHE_WRITER.close()
 
 
 @util_decor.memoize
@@ -662,9 +2040,26 @@ def cachestr_repr(val):
                 return val.get_dbname()
 
 
+# Arguments of these types keep a readable representation in cfgstrs
+_CFGSTR_SCALAR_TYPES = ((type(None), bool, float, six.binary_type) +
+                        six.integer_types + six.string_types)
+
+
 def get_cfgstr_from_args(func, args, kwargs, key_argx, key_kwds, kwdefaults,
                          argnames, use_hash=None):
     """
+    Builds a configuration string from the arguments of a function call.
+
+    Scalar arguments are represented by their json text (hashed if long).
+    Other arguments (lists, dicts, ndarrays, objects with a ``__utool_hash__``
+    method) are structurally hashed with ut.hash_data unless use_hash is
+    False.
+
+    Note:
+        Before structural hashing, container arguments were represented by
+        the hash of their json text. Their cfgstrs have changed, so caches
+        keyed on them are recomputed once. Scalar arguments are unaffected.
+
     Dev:
         argx = ['fdsf', '432443432432', 43423432, 'fdsfsd', 3.2, True]
         memlist = list(map(cachestr_repr, argx))
@@ -706,6 +2101,21 @@ def get_cfgstr_from_args(func, args, kwargs, key_argx, key_kwds, kwdefaults,
         >>> kwdefaults = ut.util_inspect.get_kwdefaults(func)
         >>> argnames   = ut.util_inspect.get_argnames(func)
         >>> get_cfgstr_from_args(func, args, kwargs, key_argx, key_kwds, kwdefaults, argnames)
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> import numpy as np
+        >>> func = consensed_cfgstr
+        >>> kwdefaults = ut.util_inspect.get_kwdefaults(func)
+        >>> argnames   = ut.util_inspect.get_argnames(func)
+        >>> args1 = ('a', {'x': list(range(100)), 'y': np.arange(10)})
+        >>> args2 = ('a', {'y': np.arange(10), 'x': list(range(100))})
+        >>> cfgstr1 = get_cfgstr_from_args(func, args1, {}, [0, 1], [], kwdefaults, argnames)
+        >>> cfgstr2 = get_cfgstr_from_args(func, args2, {}, [0, 1], [], kwdefaults, argnames)
+        >>> assert cfgstr1 == cfgstr2
+        >>> assert cfgstr1.startswith('prefix=("a")_cfgstr=(')
     """
     #try:
     #fmt_str = '%s(%s)'
@@ -725,29 +2135,70 @@ def get_cfgstr_from_args(func, args, kwargs, key_argx, key_kwds, kwdefaults,
     kw_hashfmtstr = [key + '=(%s)' for key in key_kwds]
     cfgstr_fmt = '_'.join(chain(arg_hashfmtstr, kw_hashfmtstr))
     #print('cfgstr_fmt = %r' % cfgstr_fmt)
-    argrepr_iter = (cachestr_repr(args[argx]) for argx in key_argx)
-    kwdrepr_iter = (cachestr_repr(given_kwargs[key]) for key in key_kwds)
-    if use_hash is None:
-        #print('conditional hashing args')
-        argcfg_list = [hashstr_(argrepr) if len(argrepr) > 16 else argrepr
-                       for argrepr in argrepr_iter]
-        kwdcfg_list =  [hashstr_(kwdrepr) if len(kwdrepr) > 16 else kwdrepr
-                        for kwdrepr in kwdrepr_iter]
-    elif use_hash is True:
-        #print('hashing args')
-        argcfg_list = [hashstr_(argrepr) for argrepr in argrepr_iter]
-        kwdcfg_list =  [hashstr_(kwdrepr) for kwdrepr in kwdrepr_iter]
-    else:
-        argcfg_list = list(argrepr_iter)
-        kwdcfg_list = list(kwdrepr_iter)
+
+    def _cfgstr_part(val):
+        if use_hash is not False and not isinstance(val, _CFGSTR_SCALAR_TYPES):
+            # Containers and arrays are hashed structurally, which is much
+            # cheaper than serializing them to json first.
+            try:
+                return util_hash.hash_data(val, alphabet=util_hash.ALPHABET_27)
+            except TypeError:
+                pass
+        valrepr = cachestr_repr(val)
+        if use_hash is None:
+            return hashstr_(valrepr) if len(valrepr) > 16 else valrepr
+        elif use_hash is True:
+            return hashstr_(valrepr)
+        else:
+            return valrepr
+
+    argcfg_list = [_cfgstr_part(args[argx]) for argx in key_argx]
+    kwdcfg_list = [_cfgstr_part(given_kwargs[key]) for key in key_kwds]
     #print('formating args and kwargs')
     cfgstr = cfgstr_fmt % tuple(chain(argcfg_list, kwdcfg_list))
     #print('made cfgstr = %r' % cfgstr)
     return cfgstr
 
 
+def time_cfgstr_from_args(num=1000000):
+    """
+    Times the cost of building a cache key for 1M element arguments using
+    structural hashing versus the old json text path.
+
+    CommandLine:
+        python -m utool.util_cache --exec-time_cfgstr_from_args
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> time_cfgstr_from_args()
+    """
+    import utool as ut
+    import numpy as np
+    rng = np.random.RandomState(0)
+    inputs = {
+        'list_int': list(range(num)),
+        'list_str': [str(x) for x in range(num)],
+        'dict_str_int': {str(x): x for x in range(num)},
+        'ndarray_float': rng.rand(num),
+    }
+    for key, val in sorted(inputs.items()):
+        t_old = ut.Timerit(3, verbose=0)
+        for timer in t_old:
+            with timer:
+                util_hash.hashstr27(cachestr_repr(val))
+        t_new = ut.Timerit(3, verbose=0)
+        for timer in t_new:
+            with timer:
+                util_hash.hash_data(val, alphabet=util_hash.ALPHABET_27)
+        print('%14s: json=%.4fs structural=%.4fs' % (
+            key, min(t_old.times), min(t_new.times)))
+
+
 def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
-                key_kwds=None, use_cache=None, verbose=None):
+                key_kwds=None, use_cache=None, verbose=None,
+                mem_max_bytes=None, write_mode='through', mem_validate=1.0,
+                single_flight=False, lock_timeout=None, write_behind=False):
     r"""
     Wraps a function with a Cacher object
 
@@ -760,6 +2211,19 @@ def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
         key_argx (None): (default = None)
         key_kwds (None): (default = None)
         use_cache (bool):  turns on disk based caching(default = None)
+        mem_max_bytes (int): byte budget of an in-process memory tier in
+            front of the disk cache (default = None)
+        write_mode (str): 'through' or 'back'. See Cacher.
+            (default = 'through')
+        mem_validate (float): seconds between checks that the disk entry of
+            a memory hit is unchanged. See Cacher. (default = 1.0)
+        single_flight (bool): if True only one process computes a missing
+            result while others wait and load it. See Cacher.
+            (default = False)
+        lock_timeout (float): seconds to wait on another process before
+            computing locally. See Cacher. (default = None)
+        write_behind (bool): if True results are written to disk on a
+            background thread. See Cacher. (default = False)
 
     CommandLine:
         python -m utool.util_cache --exec-cached_func
@@ -783,6 +2247,23 @@ def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
         >>> assert ans5 == ans4
         >>> assert ans5 == ans0
         >>> assert ans1 != ans0
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> import utool as ut
+        >>> ncalls = [0]
+        >>> def costly_func2(a):
+        ...     ncalls[0] += 1
+        ...     return [a] * 10
+        >>> closure_ = ut.cached_func('costly_func2', appname='utool_test',
+        >>>                           mem_max_bytes=2 ** 20, mem_validate=None)
+        >>> efficient_func = closure_(costly_func2)
+        >>> ans1 = efficient_func(7)
+        >>> # The second call is served from memory without touching disk
+        >>> ans2 = efficient_func(7)
+        >>> assert ans1 == ans2
+        >>> assert ncalls[0] <= 1
+        >>> assert efficient_func.cacher.memcache.hits == 1
     """
     if verbose is None:
         verbose = VERBOSE_CACHE
@@ -796,7 +2277,11 @@ def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
             # ignore self for methods
             argnames = argnames[1:]
         cacher = Cacher(fname_, cache_dir=cache_dir, appname=appname,
-                        verbose=verbose)
+                        verbose=verbose, mem_max_bytes=mem_max_bytes,
+                        write_mode=write_mode, mem_validate=mem_validate,
+                        single_flight=single_flight,
+                        lock_timeout=lock_timeout,
+                        write_behind=write_behind)
         if use_cache is None:
             use_cache_ = not util_arg.get_argflag('--nocache-' + fname_)
         else:
@@ -828,6 +2313,9 @@ def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
                     data = cacher.tryload(cfgstr)
                     if data is not None:
                         return data
+                    if cacher.single_flight:
+                        return cacher._compute_single_flight(cfgstr, func,
+                                                             args, kwargs)
                 # Cached missed compute function
                 data = func(*args, **kwargs)
                 # Cache save
@@ -855,6 +2343,428 @@ def cached_func(fname=None, cache_dir='default', appname='utool', key_argx=None,
     return cached_closure
 
 
+# --- Cache Directory Management ---
+
+CACHE_INDEX_FNAME = '_cache_index.json'
+CACHE_ACCESS_FNAME = '_cache_access.log'
+
+# seconds before a directory without a budget is checked again
+_UNMANAGED_RECHECK_TIME = 60.0
+# seconds between full rescans of a managed directory. In between, files
+# written through utool are tracked through the access log.
+CACHE_DIR_RESCAN_TIME = 60.0
+# the access log is folded into the index once it grows past this size
+CACHE_ACCESS_LOG_MAX_BYTES = 2 ** 20
+# an over budget write prunes down to this fraction of the budget, so the
+# next writes do not immediately prune again
+CACHE_DIR_PRUNE_RATIO = 0.9
+_CACHE_DIR_MANAGERS = {}
+
+
+class CacheDirManager(object):
+    """
+    Bounds the disk usage of a cache directory.
+
+    The manager keeps a small json index (size, last access time and
+    producing fname of every file) in the cache directory itself.  Reads and
+    writes made through save_cache, load_cache, Cacher, and Cachable only
+    append a line to an access log, which is folded into the index when the
+    directory is pruned or the log grows past CACHE_ACCESS_LOG_MAX_BYTES.
+    The directory itself is only listed every CACHE_DIR_RESCAN_TIME
+    seconds. When a write takes the directory over its byte budget the
+    least recently used files are deleted until it is within
+    CACHE_DIR_PRUNE_RATIO of the budget.
+
+    Directories are only managed once a budget has been set (see
+    set_cache_dir_budget or the ``--cachedir`` command line).
+
+    Args:
+        dpath (str): cache directory
+        max_bytes (int): byte budget. Defaults to the budget stored in the
+            index.
+
+    CommandLine:
+        python -m utool.util_cache --test-CacheDirManager
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_cachedir_manager')
+        >>> ut.delete(dpath)
+        >>> ut.ensuredir(dpath)
+        >>> self = set_cache_dir_budget(dpath, 3500)
+        >>> fpaths = [save_cache(dpath, 'test_', 'cfg%d' % (x,), 'x' * 1000)
+        >>>           for x in range(3)]
+        >>> # access the first entry so the second is the least recently used
+        >>> data = load_cache(dpath, 'test_', 'cfg0')
+        >>> fpaths += [save_cache(dpath, 'test_', 'cfg3', 'x' * 1000)]
+        >>> assert exists(fpaths[0])
+        >>> assert not exists(fpaths[1])
+        >>> assert self.total_nbytes <= 3500
+        >>> groups = self.report()
+        >>> removed = self.prune(prefix='test_cfg3')
+        >>> assert not exists(fpaths[3])
+        >>> ut.delete(dpath)
+    """
+    def __init__(self, dpath, max_bytes=None, verbose=None):
+        if verbose is None:
+            verbose = VERBOSE_CACHE
+        self.dpath = normpath(dpath)
+        self.index_fpath = join(self.dpath, CACHE_INDEX_FNAME)
+        self.log_fpath = join(self.dpath, CACHE_ACCESS_FNAME)
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        # maps file basenames to dicts with keys fname, nbytes, and atime
+        self.entries = {}
+        # names deleted since the index was last written
+        self._removed = set()
+        self.total_nbytes = 0
+        # time of the last full rescan of the directory
+        self._last_rescan = None
+        self._lock = threading.RLock()
+        self._read_index()
+
+    def is_managed(self):
+        return exists(self.index_fpath)
+
+    def _read_index(self):
+        try:
+            with open(self.index_fpath, 'r') as file_:
+                index = json.load(file_)
+        except (IOError, OSError, ValueError):
+            index = {}
+        self.entries = index.get('entries', {})
+        self.total_nbytes = sum(entry['nbytes']
+                                for entry in self.entries.values())
+        if self.max_bytes is None:
+            self.max_bytes = index.get('max_bytes', None)
+
+    def _write_index(self):
+        """
+        Merges the in-memory entries with the index on disk and writes the
+        result. Other processes fold access times into their own copy of
+        the index, so the newest atime of every entry is kept and entries
+        this process deleted are dropped.
+        """
+        with CacheFileLock(self.index_fpath + '.lock'):
+            entries, max_bytes = self.entries, self.max_bytes
+            removed = self._removed
+            self._read_index()
+            for name, entry in self.entries.items():
+                if name in removed:
+                    continue
+                mine = entries.get(name, None)
+                if mine is None:
+                    entries[name] = entry
+                else:
+                    mine['atime'] = max(mine['atime'], entry['atime'])
+                    if not mine['fname']:
+                        mine['fname'] = entry['fname']
+            self.entries, self.max_bytes = entries, max_bytes
+            self._removed = set()
+            self.total_nbytes = sum(entry['nbytes']
+                                    for entry in self.entries.values())
+            index = {'max_bytes': self.max_bytes, 'entries': self.entries}
+            tmp_fpath = self.index_fpath + '.tmp%d' % (os.getpid(),)
+            with open(tmp_fpath, 'w') as file_:
+                json.dump(index, file_)
+            util_path.replace_file(tmp_fpath, self.index_fpath)
+
+    def _is_bookkeeping(self, name):
+        return (name.startswith(CACHE_INDEX_FNAME) or
+                name.startswith(CACHE_ACCESS_FNAME) or
+                name.startswith(CACHABLE_MANIFEST_FNAME) or
+                name.startswith(CACHABLE_MANIFEST_LOG_FNAME) or
+                name.endswith('.lock') or name.endswith('.lock.break') or
+                '.lock.tmp.' in name or '.lock.break.tmp.' in name)
+
+    def _replay_log(self):
+        """ folds access times recorded by any process into the index """
+        # Move the log aside so concurrent appends start a fresh log
+        replay_fpath = self.log_fpath + '.replay%d' % (os.getpid(),)
+        try:
+            os.rename(self.log_fpath, replay_fpath)
+        except OSError:
+            return
+        with open(replay_fpath, 'r') as file_:
+            for line in file_:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3:
+                    continue
+                atime, fname, name = parts
+                entry = self.entries.get(name, None)
+                if entry is None:
+                    # written since the last rescan, possibly by another
+                    # process
+                    try:
+                        nbytes = os.path.getsize(join(self.dpath, name))
+                    except OSError:
+                        continue
+                    entry = {'fname': None, 'atime': float(atime),
+                             'nbytes': nbytes}
+                    self.entries[name] = entry
+                    self._removed.discard(name)
+                entry['atime'] = max(entry['atime'], float(atime))
+                if fname:
+                    entry['fname'] = fname
+        os.remove(replay_fpath)
+        self.total_nbytes = sum(entry['nbytes']
+                                for entry in self.entries.values())
+
+    def _fold_log(self):
+        """ folds the access log into the index without listing the dir """
+        with self._lock:
+            self._replay_log()
+            self._write_index()
+
+    def refresh(self):
+        """
+        Reconciles the index with the directory contents and the access log
+        """
+        with self._lock:
+            max_bytes = self.max_bytes
+            self._read_index()
+            self.max_bytes = max_bytes
+            entries = {}
+            for name in os.listdir(self.dpath):
+                if self._is_bookkeeping(name):
+                    continue
+                fpath = join(self.dpath, name)
+                try:
+                    stat = os.stat(fpath)
+                except OSError:
+                    continue
+                if not os.path.isfile(fpath):
+                    continue
+                entry = self.entries.get(name, None)
+                if entry is None:
+                    entry = {'fname': None, 'atime': stat.st_mtime}
+                entry['nbytes'] = stat.st_size
+                entries[name] = entry
+            # the listing is authoritative for which files exist
+            self._removed = set(self.entries) - set(entries)
+            self.entries = entries
+            self._replay_log()
+            self.total_nbytes = sum(entry['nbytes']
+                                    for entry in self.entries.values())
+            self._last_rescan = default_timer()
+            self._write_index()
+
+    def set_budget(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.refresh()
+        if max_bytes is not None and self.total_nbytes > max_bytes:
+            self.prune()
+
+    def record_access(self, fpath, fname=None):
+        """ appends a (time, fname, file) record to the access log """
+        line = '%r\t%s\t%s\n' % (time.time(), '' if fname is None else fname,
+                                 basename(fpath))
+        with open(self.log_fpath, 'a') as file_:
+            file_.write(line)
+            log_nbytes = file_.tell()
+        if log_nbytes > CACHE_ACCESS_LOG_MAX_BYTES:
+            self._fold_log()
+
+    def record_write(self, fpath, fname=None):
+        self.record_access(fpath, fname)
+        if self.max_bytes is not None:
+            try:
+                nbytes = os.path.getsize(fpath)
+            except OSError:
+                return
+            with self._lock:
+                name = basename(fpath)
+                self._removed.discard(name)
+                entry = self.entries.get(name, None)
+                if entry is not None:
+                    self.total_nbytes -= entry['nbytes']
+                self.entries[name] = {'fname': fname, 'atime': time.time(),
+                                      'nbytes': nbytes}
+                self.total_nbytes += nbytes
+                if self.total_nbytes > self.max_bytes:
+                    self.prune(max_bytes=int(self.max_bytes *
+                                             CACHE_DIR_PRUNE_RATIO))
+
+    def usage(self, prefix=None):
+        """
+        Returns:
+            list: (name, entry) tuples matching a fname or cfgstr prefix
+        """
+        items = list(self.entries.items())
+        if prefix is not None:
+            items = [(name, entry) for name, entry in items
+                     if name.startswith(prefix) or
+                     (entry['fname'] or '').startswith(prefix)]
+        return items
+
+    def prune(self, max_bytes=None, prefix=None, dryrun=False):
+        """
+        Deletes the least recently used files until usage is within budget.
+
+        Args:
+            max_bytes (int): defaults to the directory budget, or 0 if
+                prefix is specified.
+            prefix (str): only consider files whose name or fname start with
+                this prefix. max_bytes then applies to the matching files.
+            dryrun (bool): report what would be deleted without deleting
+
+        Returns:
+            list: names of the deleted files
+        """
+        with self._lock:
+            if (self._last_rescan is None or
+                    default_timer() - self._last_rescan >=
+                    CACHE_DIR_RESCAN_TIME):
+                self.refresh()
+            else:
+                self._fold_log()
+            if max_bytes is None:
+                max_bytes = 0 if prefix is not None else self.max_bytes
+            if max_bytes is None:
+                return []
+            candidates = sorted(self.usage(prefix),
+                                key=lambda item: item[1]['atime'])
+            usage_nbytes = sum(entry['nbytes'] for _, entry in candidates)
+            removed = []
+            removed_nbytes = 0
+            for name, entry in candidates:
+                if usage_nbytes - removed_nbytes <= max_bytes:
+                    break
+                if not dryrun:
+                    try:
+                        os.remove(join(self.dpath, name))
+                    except OSError as ex:
+                        if ex.errno != errno.ENOENT:
+                            continue
+                        # already removed by another process
+                    del self.entries[name]
+                    self._removed.add(name)
+                    self.total_nbytes -= entry['nbytes']
+                removed_nbytes += entry['nbytes']
+                removed.append(name)
+            if self.verbose > 0 or dryrun:
+                import utool as ut
+                print('[cache] %s %d files (%s) from %s' % (
+                    'would prune' if dryrun else 'pruned', len(removed),
+                    ut.byte_str2(removed_nbytes), self.dpath))
+            if not dryrun:
+                self._write_index()
+            return removed
+
+    def report(self, prefix=None):
+        """
+        Prints and returns disk usage grouped by the fname that produced each
+        file (guessed from the filename for files written elsewhere).
+        """
+        import utool as ut
+        self.refresh()
+        groups = collections.defaultdict(lambda: {
+            'num': 0, 'nbytes': 0, 'last_access': 0})
+        for name, entry in self.usage(prefix):
+            fname = entry['fname']
+            if not fname:
+                fname = re.match('[^_(=]*_?', name).group(0)
+            group = groups[fname]
+            group['num'] += 1
+            group['nbytes'] += entry['nbytes']
+            group['last_access'] = max(group['last_access'], entry['atime'])
+        groups = dict(groups)
+        budget_str = ('unbounded' if self.max_bytes is None else
+                      ut.byte_str2(self.max_bytes))
+        print('[cache] %s uses %s of %s' % (
+            self.dpath, ut.byte_str2(self.total_nbytes), budget_str))
+        for fname in sorted(groups, key=lambda k: -groups[k]['nbytes']):
+            group = groups[fname]
+            print('    %10s in %6d files, last used %s: %s' % (
+                ut.byte_str2(group['nbytes']), group['num'],
+                ut.unixtime_to_datetimestr(group['last_access']), fname))
+        return groups
+
+
+def get_cache_dir_manager(dpath):
+    """
+    Returns the CacheDirManager for dpath if it has a budget, otherwise None.
+    Lookups are cached, so this is cheap enough to call on every read.
+    """
+    dpath = normpath(dpath)
+    now = default_timer()
+    manager, checked = _CACHE_DIR_MANAGERS.get(dpath, (None, None))
+    if manager is not None:
+        return manager
+    if checked is not None and now - checked < _UNMANAGED_RECHECK_TIME:
+        return None
+    if exists(join(dpath, CACHE_INDEX_FNAME)):
+        manager = CacheDirManager(dpath)
+    _CACHE_DIR_MANAGERS[dpath] = (manager, now)
+    return manager
+
+
+def set_cache_dir_budget(dpath, max_bytes):
+    """
+    Starts managing a cache directory. Once set, the budget is stored on disk
+    and is respected by every process that writes to the directory.
+
+    Args:
+        dpath (str): cache directory (e.g. ut.get_app_resource_dir(appname))
+        max_bytes (int or str): byte budget (e.g. 2 ** 30 or '1GB')
+
+    Returns:
+        CacheDirManager: manager
+    """
+    if isinstance(max_bytes, six.string_types):
+        max_bytes = int(util_str.parse_bytes(max_bytes))
+    manager = CacheDirManager(normpath(dpath))
+    manager.set_budget(max_bytes)
+    _CACHE_DIR_MANAGERS[manager.dpath] = (manager, default_timer())
+    return manager
+
+
+def _record_cache_access(fpath, fname=None, is_write=False):
+    manager = get_cache_dir_manager(os.path.dirname(fpath))
+    if manager is not None:
+        if is_write:
+            manager.record_write(fpath, fname)
+        else:
+            manager.record_access(fpath, fname)
+
+
+def cache_dir_main():
+    """
+    Command line interface to report and prune cache directories
+
+    CommandLine:
+        python -m utool.util_cache --cachedir --appname=ibeis
+        python -m utool.util_cache --cachedir --appname=ibeis --global
+        python -m utool.util_cache --cachedir --dpath=~/.cache/ibeis --prefix=normalizer_
+        python -m utool.util_cache --cachedir --appname=ibeis --budget=50GB
+        python -m utool.util_cache --cachedir --appname=ibeis --prune --prefix=normalizer_ --dryrun
+    """
+    import utool as ut
+    dpath = ut.get_argval('--dpath', type_=str, default=None)
+    appname = ut.get_argval('--appname', type_=str, default='utool')
+    prefix = ut.get_argval('--prefix', type_=str, default=None)
+    budget = ut.get_argval('--budget', type_=str, default=None)
+    if dpath is None:
+        if ut.get_argflag('--global'):
+            dpath = get_global_cache_dir(appname)
+        else:
+            dpath = util_cplat.get_app_resource_dir(appname)
+    dpath = util_path.truepath(dpath)
+    if budget is not None:
+        manager = set_cache_dir_budget(dpath, budget)
+    else:
+        manager = CacheDirManager(dpath, verbose=True)
+    if ut.get_argflag('--prune'):
+        max_bytes = ut.get_argval('--max-bytes', type_=str, default=None)
+        if max_bytes is not None:
+            max_bytes = int(util_str.parse_bytes(max_bytes))
+        manager.prune(max_bytes=max_bytes, prefix=prefix,
+                      dryrun=ut.get_argflag('--dryrun'))
+    manager.report(prefix=prefix)
+
+
 # --- Global Cache ---
 
 def view_global_cache_dir(appname='default'):
@@ -908,31 +2818,90 @@ def shelf_open(fpath):
 #        self.shelf = shelve.open(shelf_fpath)
 
 
+# Open global key/value stores, keyed by fpath. Connections stay open for the
+# life of the process instead of being reopened on every read and write.
+_GLOBAL_KVSTORES = {}
+
+
+def get_global_kvstore_fpath(appname='default', ensure=False):
+    """ Returns the filepath to the global sqlite key/value store """
+    global_cache_dir = get_global_cache_dir(appname, ensure=ensure)
+    kvstore_fpath = join(global_cache_dir,
+                         meta_util_constants.global_cache_sqlite_fname)
+    return kvstore_fpath
+
+
+def _migrate_global_shelf(appname, store):
+    """ copies entries from a legacy global shelf into the sqlite store """
+    shelf_fpath = get_global_shelf_fpath(appname)
+    try:
+        shelf = shelve.open(shelf_fpath, flag='r')
+    except Exception:
+        # there is no legacy shelf (or it is unreadable)
+        return
+    try:
+        store.set_many(list(shelf.items()))
+        if VERBOSE:
+            print('[cache] migrated %d items from %s' % (len(shelf),
+                                                         shelf_fpath))
+    finally:
+        shelf.close()
+
+
+def get_global_kvstore(appname='default'):
+    """
+    Returns the persistent SqliteKeyValueStore that backs the global cache
+
+    CommandLine:
+        python -m utool.util_cache --test-get_global_kvstore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> store1 = get_global_kvstore('utool')
+        >>> store2 = get_global_kvstore('utool')
+        >>> assert store1 is store2
+    """
+    if appname is None or appname == 'default':
+        appname = get_default_appname()
+    kvstore_fpath = get_global_kvstore_fpath(appname, ensure=True)
+    store = _GLOBAL_KVSTORES.get(kvstore_fpath, None)
+    if store is None:
+        if VERBOSE:
+            print('[cache] open: ' + kvstore_fpath)
+        is_new = not exists(kvstore_fpath)
+        store = SqliteKeyValueStore(kvstore_fpath)
+        if is_new:
+            _migrate_global_shelf(appname, store)
+        _GLOBAL_KVSTORES[kvstore_fpath] = store
+    return store
+
+
 class GlobalShelfContext(object):
-    """ older class. might need update """
+    """
+    Yields the global key/value store for ``appname``.
+
+    The store is a process-wide SqliteKeyValueStore that stays open between
+    uses, so entering the context is cheap.
+    """
     def __init__(self, appname):
         self.appname = appname
 
     def __enter__(self):
-        #self.shelf = get_global_shelf(self.appname)
         try:
-            shelf_fpath = get_global_shelf_fpath(self.appname, ensure=True)
-            if VERBOSE:
-                print('[cache] open: ' + shelf_fpath)
-            self.shelf = shelve.open(shelf_fpath)
+            self.shelf = get_global_kvstore(self.appname)
         except Exception as ex:
             from utool import util_dbg
-            util_dbg.printex(ex, 'Failed opening shelf_fpath',
-                             key_list=['shelf_fpath'])
+            kvstore_fpath = get_global_kvstore_fpath(self.appname)  # NOQA
+            util_dbg.printex(ex, 'Failed opening kvstore_fpath',
+                             key_list=['kvstore_fpath'])
             raise
         return self.shelf
 
     def __exit__(self, type_, value, trace):
-        self.shelf.close()
         if trace is not None:
             print('[cache] Error under GlobalShelfContext!: ' + str(value))
             return False  # return a falsey value on error
-        #close_global_shelf(self.appname)
 
 
 def global_cache_read(key, appname='default', **kwargs):
@@ -943,11 +2912,31 @@ def global_cache_read(key, appname='default', **kwargs):
             return shelf[key]
 
 
+def global_cache_read_many(key_list, appname='default', default=None):
+    """
+    Reads several global cache entries with a single query
+
+    CommandLine:
+        python -m utool.util_cache --test-global_cache_read_many
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> global_cache_write_many({'_test_key1': 1, '_test_key2': [2]}, appname='utool')
+        >>> result = global_cache_read_many(['_test_key1', '_test_key2', '_test_nokey'], appname='utool')
+        >>> print(result)
+        [1, [2], None]
+    """
+    with GlobalShelfContext(appname) as shelf:
+        found = shelf.get_many(key_list)
+    return [found.get(key, default) for key in key_list]
+
+
 def global_cache_dump(appname='default'):
-    shelf_fpath = get_global_shelf_fpath(appname)
-    print('shelf_fpath = %r' % shelf_fpath)
+    kvstore_fpath = get_global_kvstore_fpath(appname)
+    print('kvstore_fpath = %r' % kvstore_fpath)
     with GlobalShelfContext(appname) as shelf:
-        print(util_str.dict_str(shelf))
+        print(util_str.dict_str(dict(shelf.items())))
 
 
 def global_cache_write(key, val, appname='default'):
@@ -956,12 +2945,306 @@ def global_cache_write(key, val, appname='default'):
         shelf[key] = val
 
 
+def global_cache_write_many(dict_, appname='default'):
+    """ Writes several global cache entries in a single transaction """
+    with GlobalShelfContext(appname) as shelf:
+        shelf.set_many(list(six.iteritems(dict_)))
+
+
 def delete_global_cache(appname='default'):
     """ Reads cache files to a safe place in each operating system """
-    #close_global_shelf(appname)
+    if appname is None or appname == 'default':
+        appname = get_default_appname()
+    kvstore_fpath = get_global_kvstore_fpath(appname)
+    store = _GLOBAL_KVSTORES.pop(kvstore_fpath, None)
+    if store is not None:
+        store.close()
+    for fpath in [kvstore_fpath, kvstore_fpath + '-wal',
+                  kvstore_fpath + '-shm']:
+        if exists(fpath):
+            util_path.remove_file(fpath, verbose=True, dryrun=False)
     shelf_fpath = get_global_shelf_fpath(appname)
     util_path.remove_file(shelf_fpath, verbose=True, dryrun=False)
 
+
+# --- Cachable Manifest ---
+
+CACHABLE_MANIFEST_FNAME = '_cachable_manifest.json'
+CACHABLE_MANIFEST_LOG_FNAME = '_cachable_manifest.log'
+# log entries folded into the manifest before it is rewritten
+_MANIFEST_COMPACT_SIZE = 1000
+_CACHABLE_MANIFESTS = {}
+
+_MANIFEST_TOKEN_SPLIT = re.compile(r'[^a-zA-Z0-9]+')
+
+
+class CachableManifest(object):
+    r"""
+    Index of the Cachable files in a directory.
+
+    Maps every file to the prefix and full cfgstr it was saved with and to
+    the alphanumeric components of its name, so ``glob_valid_targets`` and
+    ``fuzzyload`` are dictionary queries instead of directory scans.
+    ``Cachable.save`` and ``delete`` append one json line to a log next to
+    the manifest, which any process folds in on its next query. The
+    manifest rebuilds itself from a directory listing when it is missing,
+    when a query returns a file that no longer exists, or when a query
+    finds nothing and the directory changed since the last rebuild. Changes
+    this object makes itself (saves, deletes, and its own bookkeeping
+    files) are already recorded, so they do not count as a change.
+
+    Args:
+        dpath (str): cache directory
+
+    CommandLine:
+        python -m utool.util_cache --test-CachableManifest
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> from utool.util_cache import _args2_fpath
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_manifest')
+        >>> ut.delete(dpath)
+        >>> ut.ensuredir(dpath)
+        >>> self = CachableManifest(dpath)
+        >>> for cfgstr in ['_cfg(sz450,K4)', '_cfg(sz450,K8)', '_cfg(sz300,K4)']:
+        ...     fpath = _args2_fpath(dpath, 'Result_', cfgstr, '.cPkl')
+        ...     ut.write_to(fpath, 'data')
+        ...     self.record_save(basename(fpath), 'Result_', cfgstr)
+        >>> result1 = [basename(p) for p in self.query('Result_', 'sz450', '.cPkl')]
+        >>> result2 = [basename(p) for p in self.query('Result_', 'sz300,K4', '.cPkl')]
+        >>> # other processes and rebuilds see the same entries
+        >>> other = CachableManifest(dpath)
+        >>> ut.delete(fpath)
+        >>> result3 = [basename(p) for p in other.query('Result_', '', '.cPkl')]
+        >>> result = '\n'.join(map(repr, [result1, result2, result3]))
+        >>> print(result)
+        ['Result__cfg(sz450,K4).cPkl', 'Result__cfg(sz450,K8).cPkl']
+        ['Result__cfg(sz300,K4).cPkl']
+        ['Result__cfg(sz450,K4).cPkl', 'Result__cfg(sz450,K8).cPkl']
+    """
+    def __init__(self, dpath, verbose=None):
+        if verbose is None:
+            verbose = VERBOSE_CACHE
+        self.dpath = normpath(dpath)
+        self.manifest_fpath = join(self.dpath, CACHABLE_MANIFEST_FNAME)
+        self.log_fpath = join(self.dpath, CACHABLE_MANIFEST_LOG_FNAME)
+        self.verbose = verbose
+        self._lock = threading.RLock()
+        self._dir_stamp = None
+        self._clear()
+        self.refresh()
+
+    def _clear(self):
+        # maps file basenames to [prefix, cfgstr]
+        self.entries = {}
+        self._prefix_index = collections.defaultdict(set)
+        self._token_index = collections.defaultdict(set)
+        self._manifest_stamp = None
+        self._log_pos = 0
+        self._num_logged = 0
+
+    def _tokens(self, name, prefix, cfgstr):
+        text = name if prefix is None else name[len(prefix):]
+        if cfgstr is not None:
+            text = text + ' ' + cfgstr
+        return set(_MANIFEST_TOKEN_SPLIT.split(text)) - {''}
+
+    def _add(self, name, prefix, cfgstr):
+        if name in self.entries:
+            self._remove(name)
+        self.entries[name] = [prefix, cfgstr]
+        self._prefix_index[prefix].add(name)
+        for token in self._tokens(name, prefix, cfgstr):
+            self._token_index[token].add(name)
+
+    def _remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+        prefix, cfgstr = entry
+        self._prefix_index[prefix].discard(name)
+        for token in self._tokens(name, prefix, cfgstr):
+            names = self._token_index.get(token, None)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._token_index[token]
+
+    def _is_bookkeeping(self, name):
+        return (name.startswith(CACHABLE_MANIFEST_FNAME) or
+                name.startswith(CACHABLE_MANIFEST_LOG_FNAME) or
+                name.startswith(CACHE_INDEX_FNAME) or
+                name.startswith(CACHE_ACCESS_FNAME) or
+                name.endswith('.lock') or name.endswith('.lock.break') or
+                '.lock.tmp.' in name or '.lock.break.tmp.' in name)
+
+    def _read_manifest(self):
+        self._clear()
+        try:
+            with open(self.manifest_fpath, 'r') as file_:
+                manifest = json.load(file_)
+        except (IOError, OSError, ValueError):
+            return False
+        for name, (prefix, cfgstr) in six.iteritems(manifest['entries']):
+            self._add(name, prefix, cfgstr)
+        self._manifest_stamp = _disk_stamp(self.manifest_fpath)
+        return True
+
+    def _write_manifest(self):
+        manifest = {'entries': self.entries}
+        tmp_fpath = self.manifest_fpath + '.tmp%d' % (os.getpid(),)
+        with open(tmp_fpath, 'w') as file_:
+            json.dump(manifest, file_)
+        util_path.replace_file(tmp_fpath, self.manifest_fpath)
+        # Entries logged before the rewrite are now part of the manifest
+        if exists(self.log_fpath):
+            os.remove(self.log_fpath)
+        self._manifest_stamp = _disk_stamp(self.manifest_fpath)
+        self._log_pos = 0
+        self._num_logged = 0
+        self._dir_stamp = _disk_stamp(self.dpath)
+
+    def _replay_log(self):
+        """ applies save/delete records appended since the last replay """
+        try:
+            with open(self.log_fpath, 'rb') as file_:
+                file_.seek(0, os.SEEK_END)
+                if file_.tell() < self._log_pos:
+                    # the log was compacted into the manifest by another
+                    # process
+                    return False
+                file_.seek(self._log_pos)
+                for line in file_:
+                    if not line.endswith(b'\n'):
+                        # partially written record
+                        break
+                    self._log_pos += len(line)
+                    try:
+                        record = json.loads(line.decode('utf8'))
+                    except ValueError:
+                        continue
+                    self._num_logged += 1
+                    if record[0] == '+':
+                        self._add(record[1], record[2], record[3])
+                    else:
+                        self._remove(record[1])
+        except (IOError, OSError):
+            pass
+        return True
+
+    def refresh(self):
+        """
+        Picks up changes made by other processes. Costs one stat and a read
+        of any new log lines.
+        """
+        with self._lock:
+            stamp = _disk_stamp(self.manifest_fpath)
+            if stamp is None:
+                self.rebuild()
+            elif stamp != self._manifest_stamp or not self._replay_log():
+                self._read_manifest()
+                self._replay_log()
+
+    def rebuild(self):
+        """
+        Reconciles the manifest with a listing of the directory. Files that
+        were not saved through Cachable keep a prefix and cfgstr of None.
+        """
+        with self._lock:
+            if self.verbose > 0:
+                print('[cache] rebuilding cachable manifest in %r' % (
+                    self.dpath,))
+            self._read_manifest()
+            self._replay_log()
+            old_entries = self.entries
+            self._clear()
+            for name in os.listdir(self.dpath):
+                if self._is_bookkeeping(name):
+                    continue
+                prefix, cfgstr = old_entries.get(name, (None, None))
+                self._add(name, prefix, cfgstr)
+            self._write_manifest()
+
+    def _append(self, record):
+        line = json.dumps(record) + '\n'
+        with codecs.open(self.log_fpath, 'a', encoding='utf8') as file_:
+            file_.write(line)
+
+    def record_save(self, name, prefix, cfgstr):
+        with self._lock:
+            self.refresh()
+            self._append(['+', name, prefix, cfgstr])
+            self._replay_log()
+            if self._num_logged >= _MANIFEST_COMPACT_SIZE:
+                self._write_manifest()
+            self._dir_stamp = _disk_stamp(self.dpath)
+
+    def record_delete(self, name):
+        with self._lock:
+            self.refresh()
+            self._append(['-', name])
+            self._replay_log()
+            self._dir_stamp = _disk_stamp(self.dpath)
+
+    def _query(self, prefix, partial_cfgstr, ext):
+        candidates = self._prefix_index.get(prefix, set())
+        # files not saved through Cachable are matched by name only
+        unknown = self._prefix_index.get(None, ())
+        candidates = candidates | {name for name in unknown
+                                   if name.startswith(prefix)}
+        if not any(char in partial_cfgstr for char in '*?['):
+            # Components that are delimited on both sides in the query must
+            # be whole components of a match
+            inner_tokens = _MANIFEST_TOKEN_SPLIT.split(partial_cfgstr)[1:-1]
+            for token in inner_tokens:
+                if token:
+                    candidates = (candidates &
+                                  self._token_index.get(token, set()))
+        # the same pattern glob_valid_targets globs for without the index
+        name_pattern = prefix + '*' + partial_cfgstr + '*' + ext
+        cfgstr_pattern = '*' + partial_cfgstr + '*'
+        matches = []
+        for name in candidates:
+            if not (name.startswith(prefix) and name.endswith(ext)):
+                continue
+            cfgstr = self.entries[name][1]
+            if fnmatch.fnmatch(name, name_pattern) or (
+                    cfgstr is not None and
+                    fnmatch.fnmatch(cfgstr, cfgstr_pattern)):
+                matches.append(join(self.dpath, name))
+        return sorted(matches)
+
+    def query(self, prefix, partial_cfgstr='', ext=''):
+        """
+        Returns:
+            list: paths of files matching the glob pattern
+                ``prefix*partial_cfgstr*ext``, or whose recorded cfgstr
+                matches ``*partial_cfgstr*``
+        """
+        with self._lock:
+            self.refresh()
+            matches = self._query(prefix, partial_cfgstr, ext)
+            drifted = not all(exists(fpath) for fpath in matches)
+            if not matches:
+                # the file may have been added without going through Cachable
+                drifted = _disk_stamp(self.dpath) != self._dir_stamp
+            if drifted:
+                self.rebuild()
+                matches = self._query(prefix, partial_cfgstr, ext)
+            return matches
+
+
+def get_cachable_manifest(dpath):
+    """ Returns the shared CachableManifest for a directory """
+    key = normpath(dpath)
+    manifest = _CACHABLE_MANIFESTS.get(key, None)
+    if manifest is None:
+        manifest = _CACHABLE_MANIFESTS[key] = CachableManifest(key)
+    return manifest
+
+
 #import abc  # abstract base class
 #import six
 
@@ -991,6 +3274,10 @@ class Cachable(object):
         # return ut.get_funcname(self.__class__) + '_'
         # raise NotImplementedError('abstract method')
 
+    def _get_cache_counter(self):
+        return util_cachestats.get_cache_counter(
+            'Cachable:' + self.get_prefix())
+
     def get_cachedir(self, cachedir=None):
         if cachedir is None:
             if hasattr(self, 'cachedir'):
@@ -999,6 +3286,17 @@ class Cachable(object):
                 cachedir = '.'
         return cachedir
 
+    def _get_manifest(self, cachedir=None):
+        """
+        The CachableManifest of the cache directory, or None for the current
+        working directory (the default cachedir), which is not littered with
+        manifest files.
+        """
+        cachedir = self.get_cachedir(cachedir)
+        if os.path.abspath(cachedir) == os.getcwd():
+            return None
+        return get_cachable_manifest(cachedir)
+
     def get_fname(self, cfgstr=None, ext=None):
         # convinience
         return basename(self.get_fpath('', cfgstr=cfgstr, ext=ext))
@@ -1024,6 +3322,9 @@ class Cachable(object):
         if verbose:
             print('[Cachable] cache delete: %r' % (basename(fpath),))
         os.remove(fpath)
+        manifest = self._get_manifest(cachedir)
+        if manifest is not None:
+            manifest.record_delete(basename(fpath))
 
     @profile
     def save(self, cachedir=None, cfgstr=None, verbose=VERBOSE, quiet=QUIET,
@@ -1047,7 +3348,19 @@ class Cachable(object):
                          for (key, val) in six.iteritems(statedict)
                          if key not in ignore_keys}
 
+        stats_on = util_cachestats.ENABLED
+        if stats_on:
+            start = default_timer()
         util_io.save_data(fpath, save_dict)
+        if stats_on:
+            stamp = _disk_stamp(fpath)
+            self._get_cache_counter().saved(
+                default_timer() - start, None if stamp is None else stamp[1])
+        _record_cache_access(fpath, self.get_prefix(), is_write=True)
+        manifest = self._get_manifest(cachedir)
+        if manifest is not None:
+            _cfgstr = self.get_cfgstr() if cfgstr is None else cfgstr
+            manifest.record_save(basename(fpath), self.get_prefix(), _cfgstr)
         return fpath
         #save_cache(cachedir, '', cfgstr, self.__dict__)
         #with open(fpath, 'wb') as file_:
@@ -1067,11 +3380,21 @@ class Cachable(object):
         #    loaded_dict = pickle.load(file_)
         #    self.__dict__.update(loaded_dict)
 
-    def glob_valid_targets(self, cachedir=None, partial_cfgstr=''):
+    def glob_valid_targets(self, cachedir=None, partial_cfgstr='',
+                           use_index=True):
+        """
+        Returns paths of saved files matching a partial cfgstr, which may
+        contain glob wildcards. Uses the directory's CachableManifest unless
+        use_index is False or the directory is the current working
+        directory.
+        """
         from utool import util_path
         prefix = self.get_prefix()
-        pattern = prefix + '*' + partial_cfgstr + '*' + self.ext
         cachedir = self.get_cachedir(cachedir)
+        manifest = self._get_manifest(cachedir) if use_index else None
+        if manifest is not None:
+            return manifest.query(prefix, partial_cfgstr, self.ext)
+        pattern = prefix + '*' + partial_cfgstr + '*' + self.ext
         valid_targets = util_path.glob(cachedir, pattern, recursive=False)
         return valid_targets
 
@@ -1099,8 +3422,17 @@ class Cachable(object):
             fpath = self.get_fpath(cachedir, cfgstr=cfgstr)
         if verbose:
             print('[Cachable] cache tryload: %r' % (basename(fpath),))
+        stats_on = util_cachestats.ENABLED
+        if stats_on:
+            start = default_timer()
         try:
             self._unsafe_load(fpath, ignore_keys)
+            _record_cache_access(fpath, self.get_prefix())
+            if stats_on:
+                stamp = _disk_stamp(fpath)
+                self._get_cache_counter().hit(
+                    default_timer() - start,
+                    None if stamp is None else stamp[1])
             if verbose:
                 print('... self cache hit: %r' % (basename(fpath),))
         except ValueError as ex:
@@ -1128,6 +3460,8 @@ class Cachable(object):
                 msg = '... self cache miss: %r' % (basename(fpath),)
                 if verbose:
                     print(msg)
+                if stats_on:
+                    self._get_cache_counter().miss(default_timer() - start)
                 raise
             print('CORRUPT fpath = %s' % (fpath,))
             msg = '[!Cachable] Cachable(%s) is corrupt' % (self.get_cfgstr())
@@ -1139,10 +3473,11 @@ class Cachable(object):
             raise
 
 
-def get_lru_cache(max_size=5):
+def get_lru_cache(max_size=5, max_bytes=None):
     """
     Args:
         max_size (int):
+        max_bytes (int): if specified returns a byte budgeted MemoryCache
 
     References:
         https://github.com/amitdev/lru-dict
@@ -1168,6 +3503,8 @@ def get_lru_cache(max_size=5):
         >>> print(result)
         {2: 2, 3: 3, 4: 4, 5: 5, 6: 6}
     """
+    if max_bytes is not None:
+        return MemoryCache(max_bytes=max_bytes, max_size=max_size)
     USE_C_LRU = False
     if USE_C_LRU:
         import lru
@@ -1186,6 +3523,8 @@ class LRUDict(object):
 
     Args:
         max_size (int): (default = 5)
+        name (str): name the hit/miss/eviction counts are recorded under
+            when util_cachestats is enabled (default = None)
 
     Returns:
         LRUDict: cache_obj
@@ -1217,9 +3556,11 @@ class LRUDict(object):
         })
     """
 
-    def __init__(self, max_size):
+    def __init__(self, max_size, name=None):
         self._max_size = max_size
         self._cache = collections.OrderedDict()
+        self.stats = util_cachestats.get_cache_counter(
+            'LRUDict' if name is None else 'LRUDict:' + name)
 
     def has_key(self, item):
         return item in self
@@ -1270,8 +3611,12 @@ class LRUDict(object):
         try:
             value = self._cache.pop(key)
             self._cache[key] = value
+            if util_cachestats.ENABLED:
+                self.stats.hit()
             return value
         except KeyError:
+            if util_cachestats.ENABLED:
+                self.stats.miss()
             raise
 
     def __setitem__(self, key, value):
@@ -1280,9 +3625,371 @@ class LRUDict(object):
         except KeyError:
             if len(self._cache) >= self._max_size:
                 self._cache.popitem(last=False)
+                if util_cachestats.ENABLED:
+                    self.stats.evicted()
         self._cache[key] = value
 
 
+def _default_nbytes(obj):
+    """ cheap size estimate for MemoryCache entries """
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(nbytes, six.integer_types):
+        # ndarrays report their buffer size directly
+        return nbytes
+    from utool import util_dev
+    nbytes = util_dev.get_object_nbytes(obj)
+    if nbytes is None:
+        nbytes = sys.getsizeof(obj)
+    return nbytes
+
+
+class MemoryCache(object):
+    """
+    Thread-safe in-memory cache bounded by the total number of bytes it holds.
+
+    Unlike LRUDict, which only bounds the number of entries, each value is
+    sized when it is inserted and entries are evicted until the total size
+    fits in ``max_bytes``.
+
+    Args:
+        max_bytes (int): byte budget. None means unbounded. (default = None)
+        max_size (int): optional bound on the number of entries
+        policy (str): eviction policy. One of:
+            'lru' - evict the least recently used entry
+            'lfu' - evict the least frequently used entry (ties broken by
+                    recency)
+            'ttl' - evict the oldest inserted entry. Requires ``ttl``.
+        ttl (float): seconds until an entry expires. Can be used with any
+            policy. (default = None)
+        nbytes_func (func): computes the size of a value. Defaults to
+            ``obj.nbytes`` for ndarrays and ``ut.get_object_nbytes`` otherwise.
+        on_evict (func): called as ``on_evict(key, value)`` whenever an entry
+            is evicted or expires (but not when it is explicitly deleted).
+
+    CommandLine:
+        python -m utool.util_cache --test-MemoryCache
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> self = MemoryCache(max_bytes=30, nbytes_func=len)
+        >>> self['a'] = 'x' * 10
+        >>> self['b'] = 'x' * 10
+        >>> self['c'] = 'x' * 10
+        >>> self['a']
+        >>> self['d'] = 'x' * 10
+        >>> assert 'b' not in self, 'b is least recently used'
+        >>> assert self.nbytes == 30
+        >>> self['e'] = 'x' * 100
+        >>> assert 'e' not in self, 'values larger than the budget are skipped'
+        >>> assert self.get('b') is None
+        >>> stats = self.get_stats()
+        >>> assert stats['hits'] == 1 and stats['misses'] == 1
+        >>> assert stats['evictions'] == 1 and stats['rejected'] == 1
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> self = MemoryCache(max_bytes=30, policy='lfu', nbytes_func=len)
+        >>> self['a'] = 'x' * 10
+        >>> self['b'] = 'x' * 10
+        >>> self['c'] = 'x' * 10
+        >>> _ = self['a'], self['a'], self['c']
+        >>> self['d'] = 'x' * 10
+        >>> assert sorted(self.keys()) == ['a', 'c', 'd']
+        >>> ttl_cache = MemoryCache(policy='ttl', ttl=0)
+        >>> ttl_cache['a'] = 1
+        >>> assert 'a' not in ttl_cache
+    """
+    POLICIES = ('lru', 'lfu', 'ttl')
+
+    def __init__(self, max_bytes=None, max_size=None, policy='lru', ttl=None,
+                 nbytes_func=None, on_evict=None):
+        if policy not in self.POLICIES:
+            raise ValueError('policy=%r must be one of %r' % (
+                policy, self.POLICIES))
+        if policy == 'ttl' and ttl is None:
+            raise ValueError('policy=ttl requires ttl to be specified')
+        if nbytes_func is None:
+            nbytes_func = _default_nbytes
+        self.policy = policy
+        self.ttl = ttl
+        self._max_bytes = max_bytes
+        self._max_size = max_size
+        self._nbytes_func = nbytes_func
+        self._on_evict = on_evict
+        self._lock = threading.RLock()
+        # The order of _cache is recency for lru / lfu and insertion for ttl
+        self._cache = collections.OrderedDict()
+        self._nbytes = {}
+        # lfu: circular doubly linked list of [prev, next, count, keys]
+        # frequency buckets in increasing count order. Each bucket's keys
+        # are ordered by recency, so eviction and access are O(1).
+        self._freq_root = []
+        self._freq_root[:] = [self._freq_root, self._freq_root, None, None]
+        # lfu: maps each key to its frequency bucket
+        self._freq_buckets = {}
+        self._stamps = {}
+        self._total_nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+    @property
+    def nbytes(self):
+        return self._total_nbytes
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'rejected': self.rejected,
+                'size': len(self._cache),
+                'nbytes': self._total_nbytes,
+            }
+        return stats
+
+    def _is_expired(self, key, now=None):
+        if self.ttl is None:
+            return False
+        if now is None:
+            now = default_timer()
+        return now - self._stamps[key] >= self.ttl
+
+    def _remove(self, key, evicted=False):
+        value = self._cache.pop(key)
+        self._total_nbytes -= self._nbytes.pop(key)
+        if self.policy == 'lfu':
+            self._freq_unlink(key)
+        self._stamps.pop(key, None)
+        if evicted and self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def _purge_expired(self):
+        if self.ttl is None:
+            return
+        now = default_timer()
+        if self.policy == 'ttl':
+            # insertion ordered, so stop at the first live entry
+            for key in list(self._cache.keys()):
+                if not self._is_expired(key, now):
+                    break
+                self._remove(key, evicted=True)
+                self.expirations += 1
+        else:
+            for key in [key for key in self._cache
+                        if self._is_expired(key, now)]:
+                self._remove(key, evicted=True)
+                self.expirations += 1
+
+    def _freq_insert(self, key, prev, count):
+        """ adds key to the bucket for count, which must follow prev """
+        bucket = prev[1]
+        if bucket is self._freq_root or bucket[2] != count:
+            bucket = [prev, prev[1], count, collections.OrderedDict()]
+            prev[1][0] = bucket
+            prev[1] = bucket
+        bucket[3][key] = None
+        self._freq_buckets[key] = bucket
+
+    def _freq_unlink(self, key):
+        """ removes key from its bucket and returns that bucket's count """
+        bucket = self._freq_buckets.pop(key)
+        del bucket[3][key]
+        if not bucket[3]:
+            bucket[0][1] = bucket[1]
+            bucket[1][0] = bucket[0]
+        return bucket[2]
+
+    def _choose_victim(self):
+        if self.policy == 'lfu':
+            # the least recent key of the least frequent bucket
+            return next(iter(self._freq_root[1][3]))
+        else:
+            return next(iter(self._cache))
+
+    def _over_budget(self, extra_bytes=0, extra_items=0):
+        if (self._max_bytes is not None and
+             self._total_nbytes + extra_bytes > self._max_bytes):
+            return True
+        if (self._max_size is not None and
+             len(self._cache) + extra_items > self._max_size):
+            return True
+        return False
+
+    def _evict(self, extra_bytes=0, extra_items=0):
+        if self._over_budget(extra_bytes, extra_items):
+            self._purge_expired()
+        while len(self._cache) > 0 and self._over_budget(extra_bytes,
+                                                          extra_items):
+            self._remove(self._choose_victim(), evicted=True)
+            self.evictions += 1
+
+    def _touch(self, key):
+        if self.policy != 'ttl':
+            # move to the most recent position (py2 has no move_to_end)
+            self._cache[key] = self._cache.pop(key)
+        if self.policy == 'lfu':
+            bucket = self._freq_buckets[key]
+            # the bucket is only unlinked once empty, so its links stay
+            # valid and the next count can be inserted after it
+            prev = bucket if len(bucket[3]) > 1 else bucket[0]
+            count = self._freq_unlink(key)
+            self._freq_insert(key, prev, count + 1)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._cache and not self._is_expired(key)
+
+    def has_key(self, key):
+        return key in self
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key not in self._cache:
+                self.misses += 1
+                raise KeyError(key)
+            if self._is_expired(key):
+                self._remove(key, evicted=True)
+                self.expirations += 1
+                self.misses += 1
+                raise KeyError(key)
+            self._touch(key)
+            self.hits += 1
+            return self._cache[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        nbytes = self._nbytes_func(value)
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            if self._max_bytes is not None and nbytes > self._max_bytes:
+                # Caching this would flush everything else
+                self.rejected += 1
+                return
+            self._evict(nbytes, 1)
+            self._cache[key] = value
+            self._nbytes[key] = nbytes
+            self._total_nbytes += nbytes
+            if self.policy == 'lfu':
+                self._freq_insert(key, self._freq_root, 1)
+            if self.ttl is not None:
+                self._stamps[key] = default_timer()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def pop(self, key, *default):
+        with self._lock:
+            if key in self._cache:
+                value = self._cache[key]
+                self._remove(key)
+                return value
+        if len(default) > 0:
+            return default[0]
+        raise KeyError(key)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._cache.keys())
+
+    def values(self):
+        with self._lock:
+            return list(self._cache.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._cache.items())
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes.clear()
+            self._freq_root[:] = [self._freq_root, self._freq_root, None,
+                                  None]
+            self._freq_buckets.clear()
+            self._stamps.clear()
+            self._total_nbytes = 0
+
+    def __str__(self):
+        import utool as ut
+        return ut.dict_str(dict(self.items()), nl=False)
+
+    def __repr__(self):
+        import utool as ut
+        return 'MemoryCache(' + ut.dict_str(dict(self.items())) + ')'
+
+
+def time_memory_caches(num_items=1000, num_access=10000, policy='lru'):
+    """
+    Compares the OrderedDict LRUDict against the byte budgeted MemoryCache
+    using variably sized numpy arrays and a skewed access pattern.
+
+    CommandLine:
+        python -m utool.util_cache --exec-time_memory_caches
+        python -m utool.util_cache --exec-time_memory_caches --policy=lfu
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from utool.util_cache import *  # NOQA
+        >>> import utool as ut
+        >>> policy = ut.get_argval('--policy', default='lru')
+        >>> time_memory_caches(policy=policy)
+    """
+    import utool as ut
+    import numpy as np
+    rng = np.random.RandomState(0)
+    # sizes that differ by orders of magnitude
+    sizes = (10 ** rng.uniform(1, 5, num_items)).astype(np.int64)
+    items = [np.empty(size, dtype=np.uint8) for size in sizes]
+    # zipf-like access pattern
+    access = np.minimum(rng.zipf(1.3, num_access), num_items) - 1
+    max_bytes = int(sizes.sum() // 4)
+    max_size = num_items // 4
+
+    def run(cache):
+        for key in access:
+            try:
+                cache[key]
+            except KeyError:
+                cache[key] = items[key]
+
+    for timer in ut.Timerit(5, 'LRUDict(max_size=%d)' % (max_size,)):
+        lru = LRUDict(max_size)
+        with timer:
+            run(lru)
+    for timer in ut.Timerit(5, 'MemoryCache(max_bytes=%s, policy=%s)' % (
+            ut.byte_str2(max_bytes), policy)):
+        ttl = 1.0 if policy == 'ttl' else None
+        cache = MemoryCache(max_bytes=max_bytes, policy=policy, ttl=ttl)
+        with timer:
+            run(cache)
+    lru_bytes = sum(sizes[key] for key in lru.keys())
+    print('LRUDict holds %d items using %s' % (len(lru),
+                                               ut.byte_str2(lru_bytes)))
+    print('MemoryCache holds %d items using %s' % (
+        len(cache), ut.byte_str2(cache.nbytes)))
+    print('MemoryCache stats = %s' % (ut.repr2(cache.get_stats()),))
+
+
 def time_different_diskstores():
     """
     %timeit shelf_write_test()    # 15.1 ms per loop
@@ -1640,4 +4347,7 @@ if __name__ == '__main__':
     import multiprocessing
     multiprocessing.freeze_support()  # for win32
     import utool as ut  # NOQA
-    ut.doctest_funcs()
+    if ut.get_argflag('--cachedir'):
+        cache_dir_main()
+    else:
+        ut.doctest_funcs()
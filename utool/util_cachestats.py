@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Shared instrumentation for the caching layers in utool.
+
+Every cache (Cacher, cached_func, memoize, LRUDict, Cachable) records into a
+named CacheCounter. Counting is off by default and call sites only check the
+module level ENABLED flag, so a disabled counter costs one attribute lookup.
+
+Turn it on with ``--cache-stats`` (or ``UTOOL_CACHE_STATS=1``) or by calling
+``enable_cache_stats()``. Pass ``--cache-stats-fpath <fpath>`` (or set
+``UTOOL_CACHE_STATS_FPATH``) to dump the counters as json at exit.
+
+CommandLine:
+    python -m utool.util_cachestats --test-get_cache_stats
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import sys
+import json
+import atexit
+import threading
+import six
+from utool import util_inject
+print, rrr, profile = util_inject.inject2(__name__, '[cachestats]')
+
+
+ENABLED = ('--cache-stats' in sys.argv or
+           os.environ.get('UTOOL_CACHE_STATS', '') not in ('', '0'))
+
+_COUNTERS = {}
+_COUNTERS_LOCK = threading.Lock()
+
+
+class CacheCounter(object):
+    """
+    Hit, miss, latency, byte and eviction counts for one named cache.
+    Updates are not locked; counts from concurrent threads are approximate.
+    """
+    __slots__ = ('name', 'hits', 'misses', 'evictions', 'num_loads',
+                 'load_time', 'bytes_read', 'num_saves', 'save_time',
+                 'bytes_written')
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_loads = 0
+        self.load_time = 0.0
+        self.bytes_read = 0
+        self.num_saves = 0
+        self.save_time = 0.0
+        self.bytes_written = 0
+
+    def hit(self, load_time=None, nbytes=None):
+        self.hits += 1
+        if load_time is not None:
+            self.num_loads += 1
+            self.load_time += load_time
+        if nbytes:
+            self.bytes_read += nbytes
+
+    def miss(self, load_time=None):
+        self.misses += 1
+        if load_time is not None:
+            self.num_loads += 1
+            self.load_time += load_time
+
+    def saved(self, save_time=None, nbytes=None):
+        self.num_saves += 1
+        if save_time is not None:
+            self.save_time += save_time
+        if nbytes:
+            self.bytes_written += nbytes
+
+    def evicted(self, num=1):
+        self.evictions += num
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return (self.hits / total) if total else None
+
+    def asdict(self):
+        stats = {attr: getattr(self, attr) for attr in self.__slots__}
+        stats['hit_rate'] = self.hit_rate
+        return stats
+
+    def __repr__(self):
+        return '<CacheCounter(%s) hits=%d misses=%d evictions=%d>' % (
+            self.name, self.hits, self.misses, self.evictions)
+
+
+def get_cache_counter(name):
+    """
+    Returns the (shared) counter registered under ``name``
+    """
+    counter = _COUNTERS.get(name, None)
+    if counter is None:
+        with _COUNTERS_LOCK:
+            counter = _COUNTERS.setdefault(name, CacheCounter(name))
+    return counter
+
+
+def enable_cache_stats(flag=True):
+    """ turns recording on (or off) for every cache """
+    global ENABLED
+    ENABLED = flag
+
+
+def reset_cache_stats():
+    for counter in list(_COUNTERS.values()):
+        counter.reset()
+
+
+def get_cache_stats(name=None, nonzero=True):
+    """
+    Args:
+        name (str): if specified only return the stats of this cache
+        nonzero (bool): skip caches that have not recorded anything
+
+    Returns:
+        dict: mapping from cache name to a dict of its counts
+
+    CommandLine:
+        python -m utool.util_cachestats --test-get_cache_stats
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_cachestats import *  # NOQA
+        >>> counter = get_cache_counter('test_cache')
+        >>> counter.reset()
+        >>> counter.hit(load_time=.01, nbytes=100)
+        >>> counter.miss()
+        >>> stats = get_cache_stats('test_cache')
+        >>> result = ('hits=%r, misses=%r, bytes_read=%r, hit_rate=%r' % (
+        >>>     stats['hits'], stats['misses'], stats['bytes_read'],
+        >>>     stats['hit_rate']))
+        >>> print(result)
+        hits=1, misses=1, bytes_read=100, hit_rate=0.5
+    """
+    if name is not None:
+        return get_cache_counter(name).asdict()
+    stats = {}
+    for key, counter in list(_COUNTERS.items()):
+        if nonzero and not (counter.hits or counter.misses or
+                            counter.num_saves or counter.evictions):
+            continue
+        stats[key] = counter.asdict()
+    return stats
+
+
+def dump_cache_stats(fpath=None):
+    """
+    Writes the stats of every cache as json. Prints them if fpath is None.
+    """
+    text = json.dumps(get_cache_stats(), indent=4, sort_keys=True)
+    if fpath is None:
+        print(text)
+    else:
+        with open(fpath, 'w') as file_:
+            file_.write(six.text_type(text))
+
+
+def print_cache_stats():
+    """ prints a one line summary per cache """
+    stats = get_cache_stats()
+    for key in sorted(stats.keys()):
+        s = stats[key]
+        hit_rate = s['hit_rate']
+        print('%s: hits=%d misses=%d rate=%s evict=%d load=%.4fs save=%.4fs '
+              'read=%dB written=%dB' % (
+                  key, s['hits'], s['misses'],
+                  'NA' if hit_rate is None else '%.2f' % hit_rate,
+                  s['evictions'], s['load_time'], s['save_time'],
+                  s['bytes_read'], s['bytes_written']))
+
+
+def _get_dump_fpath():
+    if '--cache-stats-fpath' in sys.argv:
+        index = sys.argv.index('--cache-stats-fpath')
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return os.environ.get('UTOOL_CACHE_STATS_FPATH', None)
+
+
+@atexit.register
+def _dump_cache_stats_atexit():
+    if ENABLED:
+        fpath = _get_dump_fpath()
+        if fpath is not None:
+            try:
+                dump_cache_stats(fpath)
+            except Exception as ex:
+                print('[cachestats] failed to dump to %r: %s' % (fpath, ex))
+
+
+if __name__ == '__main__':
+    """
+    CommandLine:
+        python -m utool.util_cachestats
+        python -m utool.util_cachestats --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -14,6 +14,7 @@ from utool import util_dbg
 from utool import util_arg
 from utool import util_type
 from utool import util_inject
+from utool import util_cachestats
 from utool._internal import meta_util_six
 (print, rrr, profile) = util_inject.inject2(__name__, '[decor]')
 
@@ -688,14 +689,21 @@ def memoize(func):
         >>> assert foo_memo('a') == 'b' and foo_memo('c') == 'd'
     """
     cache = func._util_decor_memoize_cache = {}
+    stats = util_cachestats.get_cache_counter(
+        'memoize:' + meta_util_six.get_funcname(func))
     # @functools.wraps(func)
     def memoizer(*args, **kwargs):
         key = str(args) + str(kwargs)
         if key not in cache:
+            if util_cachestats.ENABLED:
+                stats.miss()
             cache[key] = func(*args, **kwargs)
+        elif util_cachestats.ENABLED:
+            stats.hit()
         return cache[key]
     memoizer = preserve_sig(memoizer, func)
     memoizer.cache = cache
+    memoizer.stats = stats
     return memoizer
 
 
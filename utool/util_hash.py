@@ -10,11 +10,13 @@ Currently there is a mix of sha1, sha256, and sha512 in different places.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 import hashlib
-import copy
+import binascii
+import io
 import os
 import six
 import uuid
 import random
+import struct
 import warnings
 from utool import util_inject
 from utool import util_path
@@ -23,6 +25,9 @@ from utool import util_type
 
 if util_type.HAVE_NUMPY:
     import numpy as np
+    _ndarray_types = (np.ndarray,)
+else:
+    _ndarray_types = ()
 
 # default length of hash codes
 HASH_LEN = 16
@@ -73,23 +78,35 @@ def make_hash(o):
 
     make_hash([fn.__dict__, fn.__code__])
 
+    The data is encoded by update_hasher in a single pass without copying
+    it. Objects update_hasher does not support fall back to the builtin
+    hash, which is only stable within one process.
+
+    Returns:
+        int: signed 64 bit hash
+
     References:
         http://stackoverflow.com/questions/5884066/hashing-a-python-dictionary
+
+    CommandLine:
+        python -m utool.util_hash --test-make_hash
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> hash1 = make_hash({'a': [1, {'b': (2, 3)}], 'c': {4, 5}})
+        >>> hash2 = make_hash({'c': {5, 4}, 'a': [1, {'b': (2, 3)}]})
+        >>> hash3 = make_hash({'a': [1, {'b': (2, 4)}], 'c': {4, 5}})
+        >>> assert hash1 == hash2 and hash1 != hash3
+        >>> assert isinstance(make_hash([make_hash.__code__]), int)
+        >>> nan = float('nan')
+        >>> assert make_hash({'a': {nan, 1.0}}) == make_hash({'a': {1.0, nan}})
     """
     if type(o) == DictProxyType:
-        o2 = {}
-        for k, v in o.items():
-            if not k.startswith("__"):
-                o2[k] = v
-            o = o2
-    if isinstance(o, (set, tuple, list)):
-        return tuple([make_hash(e) for e in o])
-    elif not isinstance(o, dict):
-        return hash(o)
-    new_o = copy.deepcopy(o)
-    for k, v in new_o.items():
-        new_o[k] = make_hash(v)
-    return hash(tuple(frozenset(sorted(new_o.items()))))
+        o = {k: v for k, v in o.items() if not k.startswith('__')}
+    hasher = hashlib.sha1()
+    update_hasher(hasher, o, default=hash)
+    return struct.unpack(str('<q'), hasher.digest()[:8])[0]
 
 
 def hashstr_arr27(arr, lbl, alphabet=ALPHABET_27, **kwargs):
@@ -175,6 +192,13 @@ def hashstr(data, hashlen=HASH_LEN, alphabet=ALPHABET):
     Returns:
         str: hashstr
 
+    Note:
+        Tuples and object arrays are hashed structurally through
+        update_hasher. Their hashstrs (and those of hashstr_arr) differ from
+        releases that hashed their repr, e.g. ``hashstr((1, 2, 'a'))`` was
+        ``xtqa5egdzukwvztu``, so cache files named by them are recomputed
+        once. Strings, bytes and numeric arrays are unaffected.
+
     CommandLine:
         python -m utool.util_hash --test-hashstr
         python3 -m utool.util_hash --test-hashstr
@@ -231,13 +255,17 @@ def hashstr(data, hashlen=HASH_LEN, alphabet=ALPHABET):
 
 
     Example3:
-        >>> # UNSTABLE_DOCTEST
+        >>> # ENABLE_DOCTEST
         >>> from utool.util_hash import *  # NOQA
         >>> import numpy as np
         >>> data = np.array(['a', 'b'], dtype=object)
         >>> text = hashstr(data, alphabet=ALPHABET_27)
-        >>> result = ('text = %s' % (str(text),))
-        >>> print(result)
+        >>> assert text == hashstr(np.array(['a', 'b'], dtype=object),
+        >>>                        alphabet=ALPHABET_27)
+        >>> assert hashstr((1, 'a')) != hashstr((1, b'a'))
+        >>> # members without a structural encoding are hashed by repr
+        >>> import datetime
+        >>> assert hashstr((1, datetime.date(2020, 1, 1))) != hashstr((1, 2))
 
     Ignore:
         data = np.array(['a', 'b'], dtype=object)
@@ -265,32 +293,16 @@ def hashstr(data, hashlen=HASH_LEN, alphabet=ALPHABET):
         python -c "import hashlib, numpy; print(hashlib.sha1(numpy.array(['a', 'b'], dtype=object)).hexdigest())"
         python -c "import hashlib, numpy; print(hashlib.sha1(numpy.array(['a', 'b'], dtype=object)).hexdigest())"
     """
-    if util_type.HAVE_NUMPY and isinstance(data, np.ndarray):
-        if data.dtype.kind == 'O':
-            msg = '[ut] hashing ndarrays with dtype=object is unstable'
-            warnings.warn(msg, RuntimeWarning)
-            # but tobytes is ok, but differs between python 2 and 3 for objects
-            data = data.dumps()
-            # data = data.tobytes()
-    if isinstance(data, tuple):
-        # should instead do
-        if False:
-            hasher = hashlib.sha512()
-            items = data
-            for item in items:
-                if isinstance(item, uuid.UUID):
-                    hasher.update(item.bytes_)
-                else:
-                    hasher.update(item)
-            text = hasher.hexdigest()
-            hashstr2 = convert_hexstr_to_bigbase(text, alphabet, bigbase=len(alphabet))
-            # Truncate
-            text = hashstr2[:hashlen]
-            return text
-        else:
-            msg = '[ut] hashing tuples with repr is not a good idea. FIXME'
-            warnings.warn(msg, RuntimeWarning)
-            data = repr(data)  # Hack?
+    is_object_arr = (util_type.HAVE_NUMPY and isinstance(data, np.ndarray)
+                     and data.dtype.kind == 'O')
+    if isinstance(data, tuple) or is_object_arr:
+        # Hash the structure itself instead of a repr or pickle of it.
+        # Members without a structural encoding still fall back to repr.
+        hasher = hashlib.sha512()
+        update_hasher(hasher, data, default=repr)
+        text = hasher.hexdigest()
+        hashstr2 = convert_hexstr_to_bigbase(text, alphabet, bigbase=len(alphabet))
+        return hashstr2[:hashlen]
 
     # convert unicode into raw bytes
     if isinstance(data, six.text_type):
@@ -301,7 +313,14 @@ def hashstr(data, hashlen=HASH_LEN, alphabet=ALPHABET):
         text = (alphabet[0] * hashlen)
     else:
         # Get a 128 character hex string
-        text = hashlib.sha512(data).hexdigest()
+        if util_type.HAVE_NUMPY and isinstance(data, np.ndarray):
+            # feed the C-order bytes without copying the whole array
+            hasher = hashlib.sha512()
+            for chunk in _iter_array_chunks(data):
+                hasher.update(chunk)
+            text = hasher.hexdigest()
+        else:
+            text = hashlib.sha512(data).hexdigest()
         # Shorten length of string (by increasing base)
         hashstr2 = convert_hexstr_to_bigbase(text, alphabet, bigbase=len(alphabet))
         # Truncate
@@ -328,6 +347,411 @@ valid_filename_ascii_chars()
 """
 
 
+# Number of sequence items encoded per hasher.update call
+_HASH_CHUNKSIZE = 4096
+
+
+def _pack_run(chunk):
+    """
+    Returns the packed encoding of a run of items that all share one exact
+    type among int (int64 range), float, str, and bytes, or None.
+    """
+    if len(set(map(type, chunk))) != 1:
+        return None
+    type_ = type(chunk[0])
+    fmt = str('<%dq' % (len(chunk),))
+    if type_ is int:
+        try:
+            return b'q' + struct.pack(fmt, *chunk)
+        except struct.error:
+            # out of range for int64
+            return None
+    elif type_ is float:
+        if any(item != item for item in chunk):
+            # NaNs have many bit patterns, encode them one at a time
+            return None
+        return b'd' + struct.pack(str('<%dd' % (len(chunk),)), *chunk)
+    elif type_ is six.text_type:
+        encoded = [item.encode('utf-8') for item in chunk]
+        return b'S' + struct.pack(fmt, *map(len, encoded)) + b''.join(encoded)
+    elif type_ is six.binary_type:
+        return b'B' + struct.pack(fmt, *map(len, chunk)) + b''.join(chunk)
+    return None
+
+
+def _sorted_members(items, default=None):
+    """
+    Canonical order for dict keys and set members. Runs of only strings,
+    only bytes, or only numbers use their natural order (NaN last), anything
+    else is ordered by the digest of its own encoding.
+    """
+    items = list(items)
+    types = set(map(type, items))
+    if types <= {six.text_type} or types <= {six.binary_type}:
+        return sorted(items)
+    if types <= set(six.integer_types) | {float, bool}:
+        return sorted(items, key=_number_order)
+    return sorted(items, key=lambda item: _member_digest(item, default))
+
+
+def _number_order(num):
+    # NaN compares false to everything, so give it a fixed place
+    return (True, 0) if num != num else (False, num)
+
+
+def _member_digest(item, default=None):
+    hasher = hashlib.sha1()
+    update_hasher(hasher, item, default=default)
+    return hasher.digest()
+
+
+def _ascii_len(num):
+    return str(num).encode('ascii') + b'_'
+
+
+_FLOAT_NAN = struct.pack(str('<d'), float('nan'))
+
+
+def update_hasher(hasher, data, default=None):
+    r"""
+    Feeds a structural encoding of data into a hasher in a single pass,
+    without copying or serializing the data to an intermediate string.
+
+    Nested containers are walked with an explicit stack, so deeply nested
+    data does not hit the recursion limit. The encoding only depends on the
+    values, not on the Python version, process, or hash seed:
+
+        ============  ====================================================
+        None          ``N``
+        bool          ``T`` or ``F``
+        int           ``i`` decimal digits ``_``
+        float         ``f`` little endian float64 (one canonical NaN)
+        bytes         ``b`` length ``_`` bytes
+        str           ``s`` utf-8 length ``_`` utf-8 bytes
+        UUID          ``u`` 16 bytes
+        list, tuple   ``L`` / ``U`` length ``_`` items
+        set           ``E`` length ``_`` items in canonical order
+        dict          ``D`` length ``_`` keys in canonical order, values
+        ndarray       ``A`` dtype ``_`` shape ``_`` C-order buffer
+        object array  ``O`` shape ``_`` items in C order
+        numpy scalar  the encoding of ``.item()``
+        other         ``H`` and the encoding of ``__utool_hash__()``
+        ============  ====================================================
+
+    Items of a container are emitted in runs of up to 4096. A run whose
+    items share one exact type is packed: ``q`` int64s, ``d`` float64s,
+    ``S`` / ``B`` int64 lengths followed by the concatenated (utf-8) bytes.
+    The canonical order sorts strings, bytes, and numbers naturally and any
+    other members by the digest of their encoding.
+
+    Args:
+        hasher (_hashlib.HASH): e.g. hashlib.sha1() or hashlib.blake2b()
+        data (object): nested dict / list / tuple / set / str / bytes / int /
+            float / UUID / ndarray data
+        default (func): if given, converts objects of unsupported types into
+            supported data instead of raising
+
+    Raises:
+        TypeError: if data contains an unsupported type
+
+    CommandLine:
+        python -m utool.util_hash update_hasher
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import numpy as np
+        >>> data1 = {'a': [1, 2, 3], 'b': (np.arange(4), 'foo', None)}
+        >>> data2 = {'b': (np.arange(4), 'foo', None), 'a': [1, 2, 3]}
+        >>> data3 = {'a': [1, 2, 3], 'b': (np.arange(4), 'foo', 0)}
+        >>> hashers = [hashlib.sha1() for _ in range(3)]
+        >>> for hasher, data in zip(hashers, [data1, data2, data3]):
+        >>>     update_hasher(hasher, data)
+        >>> digests = [hasher.hexdigest() for hasher in hashers]
+        >>> assert digests[0] == digests[1]
+        >>> assert digests[0] != digests[2]
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import uuid
+        >>> # the encoding is fixed, so this digest never changes
+        >>> data = {'b': {3, 1, 2}, 'a': [1.5, 'x', b'y', None, True],
+        >>>         'c': (uuid.UUID(int=0), [[[]]])}
+        >>> hasher = hashlib.sha1()
+        >>> update_hasher(hasher, data)
+        >>> result = hasher.hexdigest()
+        >>> print(result)
+        89b776e651d2e4df7461f75a2171734d16b31150
+    """
+    update = hasher.update
+    # frames of (items, position, whether runs of items may be packed)
+    stack = [((data,), 0, False)]
+    while stack:
+        items, pos, packable = stack.pop()
+        if packable and pos % _HASH_CHUNKSIZE == 0:
+            chunk = items[pos:pos + _HASH_CHUNKSIZE]
+            packed = _pack_run(chunk)
+            if packed is not None:
+                update(packed)
+                if pos + len(chunk) < len(items):
+                    stack.append((items, pos + len(chunk), packable))
+                continue
+        item = items[pos]
+        if pos + 1 < len(items):
+            stack.append((items, pos + 1, packable))
+        type_ = type(item)
+        if type_ is six.text_type:
+            bytes_ = item.encode('utf-8')
+            update(b's' + _ascii_len(len(bytes_)))
+            update(bytes_)
+        elif type_ is six.binary_type:
+            update(b'b' + _ascii_len(len(item)))
+            update(item)
+        elif item is None:
+            update(b'N')
+        elif type_ is bool:
+            update(b'T' if item else b'F')
+        elif isinstance(item, six.integer_types) and not isinstance(item, bool):
+            update(b'i' + _ascii_len(item))
+        elif isinstance(item, float):
+            if item != item:
+                update(b'f' + _FLOAT_NAN)
+            else:
+                update(b'f' + struct.pack(str('<d'), item))
+        elif isinstance(item, (list, tuple)):
+            update((b'L' if isinstance(item, list) else b'U') +
+                   _ascii_len(len(item)))
+            if len(item):
+                stack.append((item, 0, True))
+        elif isinstance(item, dict):
+            keys = _sorted_members(item.keys(), default)
+            update(b'D' + _ascii_len(len(keys)))
+            if keys:
+                stack.append(([item[key] for key in keys], 0, True))
+                stack.append((keys, 0, True))
+        elif isinstance(item, (set, frozenset)):
+            members = _sorted_members(item, default)
+            update(b'E' + _ascii_len(len(members)))
+            if members:
+                stack.append((members, 0, True))
+        elif isinstance(item, uuid.UUID):
+            update(b'u' + item.bytes)
+        elif util_type.HAVE_NUMPY and isinstance(item, np.ndarray):
+            shape = ','.join([str(int(dim)) for dim in item.shape])
+            if item.dtype.kind == 'O':
+                update(b'O' + shape.encode('ascii') + b'_')
+                if item.size:
+                    # a flat view of the references, no list of them
+                    stack.append((item.reshape(-1), 0, True))
+            else:
+                update(_array_header(item))
+                for chunk in _iter_array_chunks(item):
+                    update(chunk)
+        elif util_type.HAVE_NUMPY and isinstance(item, np.generic):
+            stack.append(((item.item(),), 0, False))
+        elif hasattr(item, '__utool_hash__'):
+            update(b'H')
+            stack.append(((item.__utool_hash__(),), 0, False))
+        elif default is not None:
+            stack.append(((default(item),), 0, False))
+        else:
+            raise TypeError('Cannot structurally hash type=%r' % (type_,))
+
+
+def hash_data(data, hashlen=HASH_LEN, alphabet=ALPHABET, hasher=None):
+    r"""
+    Structural hash of nested data. Unlike hashstr this does not need a
+    string representation of the data.
+
+    Args:
+        data (object): see update_hasher
+        hashlen (int): (default = 16)
+        alphabet (list): (default = ALPHABET)
+        hasher (_hashlib.HASH): (default = hashlib.sha512()). Any hashlib
+            object works, hashlib.blake2b() is the fastest on 64 bit machines
+
+    Returns:
+        str: text
+
+    CommandLine:
+        python -m utool.util_hash hash_data
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import numpy as np
+        >>> text1 = hash_data([1, 2, (3, '4'), np.array([5, 6])])
+        >>> text2 = hash_data([1, 2, (3, '4'), np.array([5, 6])])
+        >>> text3 = hash_data([1, 2, [3, '4'], np.array([5, 6])])
+        >>> assert text1 == text2 and text1 != text3
+        >>> assert len(text1) == 16
+    """
+    if hasher is None:
+        hasher = hashlib.sha512()
+    update_hasher(hasher, data)
+    text = hasher.hexdigest()
+    hashstr2 = convert_hexstr_to_bigbase(text, alphabet, bigbase=len(alphabet))
+    text = hashstr2[:hashlen]
+    return text
+
+
+# bytes hashed per update when walking large arrays
+_ARRAY_CHUNK_BYTES = 2 ** 22
+
+
+def _array_header(arr):
+    """ the ``A`` dtype ``_`` shape ``_`` prefix used by update_hasher """
+    dtype = arr.dtype.str
+    if arr.dtype.fields is not None:
+        dtype += repr(arr.dtype.descr)
+    shape = ','.join([str(int(dim)) for dim in arr.shape])
+    return b'A' + dtype.encode('ascii') + b'_' + shape.encode('ascii') + b'_'
+
+
+def _iter_array_chunks(arr, chunk_bytes=_ARRAY_CHUNK_BYTES):
+    """
+    Yields the bytes of arr in C order as a sequence of contiguous uint8
+    buffers of at most about chunk_bytes.
+
+    C-contiguous arrays (including memmaps) are yielded as views and are
+    never copied. Other layouts are split along their leading axes and only
+    one block of at most chunk_bytes is copied at a time.
+    """
+    if arr.flags.c_contiguous:
+        flat = arr.reshape(-1).view(np.uint8)
+        for start in range(0, flat.size, chunk_bytes):
+            yield flat[start:start + chunk_bytes]
+    elif arr.ndim == 1:
+        step = max(1, chunk_bytes // max(1, arr.itemsize))
+        for start in range(0, arr.shape[0], step):
+            block = np.ascontiguousarray(arr[start:start + step])
+            yield block.view(np.uint8)
+    else:
+        row_bytes = arr[0:1].nbytes
+        if row_bytes <= chunk_bytes:
+            step = max(1, chunk_bytes // max(1, row_bytes))
+            for start in range(0, arr.shape[0], step):
+                block = np.ascontiguousarray(arr[start:start + step])
+                yield block.reshape(-1).view(np.uint8)
+        else:
+            for row in arr:
+                for chunk in _iter_array_chunks(row, chunk_bytes):
+                    yield chunk
+
+
+def _iter_exact_chunks(chunks, chunk_bytes):
+    """ regroups a stream of buffers into pieces of exactly chunk_bytes """
+    pending = []
+    num_pending = 0
+    for chunk in chunks:
+        if not pending and len(chunk) == chunk_bytes:
+            yield chunk
+            continue
+        pending.append(chunk)
+        num_pending += len(chunk)
+        while num_pending >= chunk_bytes:
+            data = b''.join([bytes(part) for part in pending])
+            yield data[:chunk_bytes]
+            rest = data[chunk_bytes:]
+            pending = [rest] if rest else []
+            num_pending = len(rest)
+    if pending:
+        yield b''.join([bytes(part) for part in pending])
+
+
+def hash_array(arr, hash_name='sha1', chunk_bytes=_ARRAY_CHUNK_BYTES,
+               num_threads=None, hexdigest=False):
+    r"""
+    Hashes a (possibly huge or memory mapped) ndarray in chunks without
+    loading or copying the whole array.
+
+    The digest is a two level hash tree. The C-order bytes of the array are
+    split into pieces of exactly chunk_bytes, each piece is hashed on its
+    own (in parallel when num_threads > 1), and the root hashes the array
+    header (dtype, shape, and chunk_bytes) followed by the piece digests.
+    The result therefore depends on the values, dtype, shape, and
+    chunk_bytes, but not on the memory layout or the number of threads.
+    Object arrays have no buffer and are hashed structurally instead.
+
+    Args:
+        arr (ndarray): array or memmap
+        hash_name (str): any name accepted by hashlib.new
+        chunk_bytes (int): bytes per leaf of the tree
+        num_threads (int): threads used to hash leaves. Defaults to the
+            number of cpus. hashlib releases the GIL on large buffers.
+        hexdigest (bool): returns a hex string instead of raw bytes
+
+    Returns:
+        bytes: digest
+
+    CommandLine:
+        python -m utool.util_hash --test-hash_array
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import numpy as np
+        >>> import utool as ut
+        >>> arr = np.arange(3 * 1000 * 7, dtype=np.float32).reshape(3, 1000, 7)
+        >>> chunk_bytes = 4096
+        >>> hash1 = hash_array(arr, chunk_bytes=chunk_bytes, num_threads=1)
+        >>> hash2 = hash_array(arr, chunk_bytes=chunk_bytes, num_threads=4)
+        >>> # non-contiguous views hash like their contiguous copies
+        >>> view = arr.transpose(2, 0, 1)[:, ::2]
+        >>> hash3 = hash_array(view, chunk_bytes=chunk_bytes)
+        >>> hash4 = hash_array(view.copy(), chunk_bytes=chunk_bytes)
+        >>> # memmapped arrays are read in place
+        >>> fpath = ut.unixjoin(ut.ensure_app_resource_dir('utool'), 'arr.npy')
+        >>> np.save(fpath, arr)
+        >>> mmap = np.load(fpath, mmap_mode='r')
+        >>> hash5 = hash_array(mmap, chunk_bytes=chunk_bytes)
+        >>> del mmap
+        >>> assert hash1 == hash2 == hash5 and hash3 == hash4
+        >>> assert hash1 != hash_array(arr.astype(np.float64))
+        >>> assert hash1 != hash_array(arr.reshape(1000, 21),
+        >>>                            chunk_bytes=chunk_bytes)
+        >>> result = hash_array(np.arange(10, dtype=np.int64), hexdigest=True)
+        >>> print(result)
+        c0750b2324485621a8d681a41fc7952b1b0caedc
+    """
+    if arr.dtype.kind == 'O':
+        hasher = hashlib.new(hash_name)
+        update_hasher(hasher, arr)
+        return hasher.hexdigest() if hexdigest else hasher.digest()
+    if num_threads is None:
+        import multiprocessing
+        num_threads = multiprocessing.cpu_count()
+
+    def _leaf_digest(chunk):
+        return hashlib.new(hash_name, chunk).digest()
+
+    root = hashlib.new(hash_name)
+    root.update(b'T' + _array_header(arr) + _ascii_len(chunk_bytes))
+    leaves = _iter_exact_chunks(_iter_array_chunks(arr, chunk_bytes),
+                                chunk_bytes)
+    if num_threads <= 1:
+        for chunk in leaves:
+            root.update(_leaf_digest(chunk))
+    else:
+        import itertools
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(num_threads)
+        try:
+            # bounded windows keep at most a few copied chunks in memory
+            window = 2 * num_threads
+            while True:
+                chunks = list(itertools.islice(leaves, window))
+                if not chunks:
+                    break
+                for leaf in pool.map(_leaf_digest, chunks, chunksize=1):
+                    root.update(leaf)
+        finally:
+            pool.close()
+            pool.join()
+    return root.hexdigest() if hexdigest else root.digest()
+
+
 def convert_hexstr_to_bigbase(hexstr, alphabet=ALPHABET, bigbase=BIGBASE):
     """ Packs a long hexstr into a shorter length string with a larger base
     """
@@ -368,7 +792,7 @@ def hashstr_sha1(data, base10=False):
 
 
 def get_file_hash(fpath, blocksize=65536, hasher=None, stride=1,
-                  hexdigest=False):
+                  hexdigest=False, use_index=False):
     r"""
     For better hashes use hasher=hashlib.sha256, and keep stride=1
 
@@ -379,6 +803,10 @@ def get_file_hash(fpath, blocksize=65536, hasher=None, stride=1,
         stride (int): strides > 1 skip data to hash, useful for faster
                       hashing, but less accurate, also makes hash dependant on
                       blocksize.
+        hexdigest (bool): returns a hex string instead of raw bytes
+        use_index (bool): if True (and stride == 1) the digest is looked up
+            in / stored to the persistent :class:`FileHashIndex`, so an
+            unchanged file is never read twice. hasher must be fresh.
 
     References:
         http://stackoverflow.com/questions/3431825/generating-a-md5-checksum-of-a-file
@@ -423,6 +851,10 @@ def get_file_hash(fpath, blocksize=65536, hasher=None, stride=1,
     Ignore:
         file_ = open(fpath, 'rb')
     """
+    if use_index and stride == 1:
+        hash_name = 'sha1' if hasher is None else hasher.name
+        return get_file_hashes([fpath], hash_name=hash_name,
+                               hexdigest=hexdigest)[0]
     if hasher is None:
         hasher = hashlib.sha1()
     with open(fpath, 'rb') as file_:
@@ -438,7 +870,8 @@ def get_file_hash(fpath, blocksize=65536, hasher=None, stride=1,
             return hasher.digest()
 
 
-def write_hash_file(fpath, hash_tag='md5', recompute=False, **kwargs):
+def write_hash_file(fpath, hash_tag='md5', recompute=False, use_index=False,
+                    **kwargs):
     r""" Creates a hash file for each file in a path
 
     CommandLine:
@@ -470,7 +903,8 @@ def write_hash_file(fpath, hash_tag='md5', recompute=False, **kwargs):
     if file_type == 'file':
         # Compute hash
         hasher = hash_dict[hash_tag]
-        hash_local = get_file_hash(fpath, hasher=hasher, hexdigest=True)
+        hash_local = get_file_hash(fpath, hasher=hasher, hexdigest=True,
+                                   use_index=use_index)
         print('[utool] Adding:', fpath, hash_local)
         with open(hash_fpath, 'w') as hash_file:
             hash_file.write(hash_local)
@@ -495,24 +929,724 @@ def write_hash_file_for_path(path, **kwargs):
         >>>     assert os.path.exists(hash_fpath)
         >>>     ut.delete(hash_fpath)
     """
-    hash_fpath_list = []
+    fpath_list = []
     for root, dname_list, fname_list in os.walk(path):
         for fname in sorted(fname_list):
-            fpath = os.path.join(path, fname)
-            hash_fpath = write_hash_file(fpath, **kwargs)
-            if hash_fpath is not None:
-                hash_fpath_list.append(hash_fpath)
+            fpath_list.append(os.path.join(root, fname))
+    if kwargs.get('use_index', False):
+        # hash every file not yet in the index in one threaded batch
+        hash_tag = kwargs.get('hash_tag', 'md5')
+        get_file_hashes([fpath for fpath in fpath_list
+                         if not fpath.endswith('.' + hash_tag)],
+                        hash_name=hash_tag)
+    hash_fpath_list = []
+    for fpath in fpath_list:
+        hash_fpath = write_hash_file(fpath, **kwargs)
+        if hash_fpath is not None:
+            hash_fpath_list.append(hash_fpath)
     return hash_fpath_list
 
 
-def get_file_uuid(fpath, hasher=None, stride=1):
+# reading whole files in large blocks keeps the number of syscalls low
+_FILE_HASH_BLOCKSIZE = 2 ** 20
+
+
+def _file_stat_key(fpath, hash_name):
+    """
+    Identifies the contents of a file without reading it. A file whose
+    device, inode, size, and modification time are unchanged is assumed to
+    have unchanged contents.
+
+    Returns:
+        tuple: (key, stamp) where key names the file (its device and inode)
+            and stamp is its (size, mtime_ns)
+    """
+    st = os.stat(fpath)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1E9)
+    key = '%s:%d:%d' % (hash_name, st.st_dev, st.st_ino)
+    return key, (st.st_size, mtime_ns)
+
+
+def _hash_file_buffered(fpath, hash_name='sha1',
+                        blocksize=_FILE_HASH_BLOCKSIZE):
+    """
+    Hashes an entire file by reading into a single reused buffer. hashlib
+    releases the GIL on large updates, so this scales across threads.
+    """
+    hasher = hashlib.new(hash_name)
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    with io.open(fpath, 'rb', buffering=0) as file_:
+        while True:
+            nbytes = file_.readinto(buf)
+            if not nbytes:
+                break
+            hasher.update(view[:nbytes])
+    return hasher.digest()
+
+
+class FileHashIndex(object):
+    """
+    Persistent map from file identity to file digest.
+
+    Entries are keyed by (hash_name, st_dev, st_ino) and remember the
+    st_size and st_mtime_ns the file had when it was hashed, so asking for
+    the hash of a file that has not changed since it was last seen costs one
+    stat and one database lookup instead of a full read. Files missing from
+    the index or changed since are hashed on a thread pool, and the new hash
+    replaces the entry of their inode. ``prune`` removes the entries of
+    files that no longer exist.
+
+    Args:
+        fpath (str): sqlite database path. Defaults to a file in the
+            application resource directory.
+        hash_name (str): any name accepted by hashlib.new
+        blocksize (int): read size used when hashing new files
+        num_threads (int): threads used to hash new files
+        appname (str): used to find the default database location
+
+    CommandLine:
+        python -m utool.util_hash --test-FileHashIndex
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_filehashindex')
+        >>> fpath_list = [os.path.join(dpath, 'file%d.txt' % (count,))
+        >>>               for count in range(4)]
+        >>> for count, fpath in enumerate(fpath_list):
+        >>>     ut.write_to(fpath, 'contents %d' % (count,), verbose=False)
+        >>> self = FileHashIndex(os.path.join(dpath, 'index.sqlite'))
+        >>> self.clear()
+        >>> hashes1 = self.get_hashes(fpath_list, hexdigest=True)
+        >>> hashes2 = self.get_hashes(fpath_list, hexdigest=True)
+        >>> assert hashes1 == hashes2
+        >>> assert hashes1[0] == get_file_hash(fpath_list[0], hexdigest=True)
+        >>> ut.write_to(fpath_list[0], 'changed contents', verbose=False)
+        >>> hashes3 = self.get_hashes(fpath_list, hexdigest=True)
+        >>> assert hashes3[0] != hashes1[0] and hashes3[1:] == hashes1[1:]
+        >>> assert len(self.store) == 4
+        >>> ut.delete(fpath_list[3], verbose=False)
+        >>> num_pruned = self.prune()
+        >>> result = ('num_hashed=%r, num_cached=%r, num_pruned=%r' % (
+        >>>     self.num_hashed, self.num_cached, num_pruned))
+        >>> self.close()
+        >>> print(result)
+        num_hashed=5, num_cached=7, num_pruned=1
+    """
+    def __init__(self, fpath=None, hash_name='sha1',
+                 blocksize=_FILE_HASH_BLOCKSIZE, num_threads=None,
+                 appname='utool', verbose=False):
+        from utool import util_cache
+        if fpath is None:
+            from utool import util_cplat
+            dpath = util_cplat.ensure_app_resource_dir(appname)
+            fpath = os.path.join(dpath, 'file_hash_index.sqlite')
+        hashlib.new(hash_name)  # fail early on an unknown hash
+        if num_threads is None:
+            from utool import util_parallel
+            num_threads = util_parallel.get_default_numthreads()
+        self.fpath = fpath
+        self.hash_name = hash_name
+        self.blocksize = blocksize
+        self.num_threads = num_threads
+        self.verbose = verbose
+        self.store = util_cache.SqliteKeyValueStore(fpath)
+        self.num_hashed = 0
+        self.num_cached = 0
+
+    def _hash_files(self, fpath_list):
+        import functools
+        hashfunc = functools.partial(_hash_file_buffered,
+                                     hash_name=self.hash_name,
+                                     blocksize=self.blocksize)
+        num_threads = min(self.num_threads, len(fpath_list))
+        if num_threads <= 1:
+            return [hashfunc(fpath) for fpath in fpath_list]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(num_threads)
+        try:
+            return pool.map(hashfunc, fpath_list, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_hashes(self, fpath_list, hexdigest=False):
+        """
+        Args:
+            fpath_list (list): paths to existing files
+            hexdigest (bool): returns hex strings instead of raw bytes
+
+        Returns:
+            list: the digest of each file, in the order given
+        """
+        fpath_list = list(fpath_list)
+        keystamp_list = [_file_stat_key(fpath, self.hash_name)
+                         for fpath in fpath_list]
+        key_list = [key for key, stamp in keystamp_list]
+        key_to_entry = self.store.get_many(set(key_list))
+        key_to_digest = {}
+        # hardlinks share a key, so each distinct miss is read only once
+        miss_fpaths = []
+        miss_keys = []
+        for (key, stamp), fpath in zip(keystamp_list, fpath_list):
+            if key in key_to_digest:
+                continue
+            entry = key_to_entry.get(key, None)
+            if isinstance(entry, tuple) and entry[0] == stamp:
+                key_to_digest[key] = entry[2]
+            else:
+                key_to_digest[key] = None
+                miss_keys.append((key, stamp))
+                miss_fpaths.append(fpath)
+        self.num_cached += len(fpath_list) - len(miss_keys)
+        if miss_keys:
+            if self.verbose:
+                print('[hashindex] hashing %d new files' % (len(miss_keys),))
+            miss_digests = self._hash_files(miss_fpaths)
+            self.num_hashed += len(miss_keys)
+            new_items = []
+            for (key, stamp), fpath, digest in zip(miss_keys, miss_fpaths,
+                                                   miss_digests):
+                key_to_digest[key] = digest
+                # do not remember files that changed while being read
+                if _file_stat_key(fpath, self.hash_name) == (key, stamp):
+                    new_items.append((key, (stamp, fpath, digest)))
+            self.store.set_many(new_items)
+        digest_list = [key_to_digest[key] for key in key_list]
+        if hexdigest:
+            digest_list = [binascii.hexlify(digest).decode('ascii')
+                           for digest in digest_list]
+        return digest_list
+
+    def get_hash(self, fpath, hexdigest=False):
+        return self.get_hashes([fpath], hexdigest=hexdigest)[0]
+
+    def prune(self):
+        """
+        Removes entries whose file was deleted or replaced by another inode
+        since it was hashed, and entries in an old format.
+
+        Returns:
+            int: number of removed entries
+        """
+        # only entries of this hash_name, other indexes may share the store
+        stale_keys = []
+        for key, entry in self.store.iteritems(prefix=self.hash_name + ':'):
+            if not isinstance(entry, tuple):
+                stale_keys.append(key)
+                continue
+            fpath = entry[1]
+            try:
+                is_same = _file_stat_key(fpath, self.hash_name)[0] == key
+            except OSError:
+                is_same = False
+            if not is_same:
+                stale_keys.append(key)
+        self.store.delete_many(stale_keys)
+        if self.verbose:
+            print('[hashindex] pruned %d entries' % (len(stale_keys),))
+        return len(stale_keys)
+
+    def clear(self):
+        self.store.clear()
+
+    def close(self):
+        self.store.close()
+
+
+_FILE_HASH_INDEXES = {}
+
+
+def get_file_hash_index(hash_name='sha1', appname='utool'):
+    """
+    Returns:
+        FileHashIndex: the shared index stored in the app resource dir
+    """
+    key = (hash_name, appname)
+    if key not in _FILE_HASH_INDEXES:
+        _FILE_HASH_INDEXES[key] = FileHashIndex(hash_name=hash_name,
+                                                appname=appname)
+    return _FILE_HASH_INDEXES[key]
+
+
+def get_file_hashes(fpath_list, hash_name='sha1', hexdigest=False,
+                    index=None):
+    """
+    Bulk version of get_file_hash that only reads files whose contents may
+    have changed since they were last hashed.
+
+    Args:
+        fpath_list (list): paths to existing files
+        hash_name (str): any name accepted by hashlib.new
+        hexdigest (bool): returns hex strings instead of raw bytes
+        index (FileHashIndex): defaults to the shared index for hash_name
+
+    CommandLine:
+        python -m utool.util_hash --test-get_file_hashes
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import utool as ut
+        >>> fpath = ut.unixjoin(ut.ensure_app_resource_dir('utool'), 'tmp.txt')
+        >>> ut.write_to(fpath, ut.lorium_ipsum(), verbose=False)
+        >>> hashes = get_file_hashes([fpath, fpath], hash_name='md5',
+        >>>                          hexdigest=True)
+        >>> assert hashes[0] == hashes[1]
+        >>> assert hashes[0] == get_file_hash(fpath, hasher=hashlib.md5(),
+        >>>                                   hexdigest=True)
+    """
+    if index is None:
+        index = get_file_hash_index(hash_name)
+    return index.get_hashes(fpath_list, hexdigest=hexdigest)
+
+
+def _sample_file_digest(fpath, nbytes, sample_size=2 ** 12, num_samples=8,
+                        hash_name='sha1'):
+    """
+    Returns:
+        tuple: (digest, is_exact). When the file is no larger than the
+            sampled region it is read in full, is_exact is True, and digest
+            is the ordinary hash of its contents.
+    """
+    hasher = hashlib.new(hash_name)
+    with io.open(fpath, 'rb') as file_:
+        if nbytes <= sample_size * (num_samples + 2):
+            _read_into_hasher(file_, hasher)
+            return hasher.digest(), True
+        # head, tail, and evenly spaced blocks in between
+        hasher.update(struct.pack('>Q', nbytes))
+        last = nbytes - sample_size
+        for count in range(num_samples + 2):
+            file_.seek(last * count // (num_samples + 1))
+            hasher.update(file_.read(sample_size))
+    return hasher.digest(), False
+
+
+def _read_into_hasher(file_, hasher, blocksize=_FILE_HASH_BLOCKSIZE):
+    buf = file_.read(blocksize)
+    while buf:
+        hasher.update(buf)
+        buf = file_.read(blocksize)
+
+
+def get_file_sample_hash(fpath, sample_size=2 ** 12, num_samples=8,
+                         hash_name='sha1'):
+    """
+    Cheap digest of a file built from its size, its first and last
+    sample_size bytes, and num_samples evenly spaced blocks in between.
+    Unlike get_file_hash with stride > 1 the result does not depend on any
+    read blocksize. Files that differ only outside the sampled blocks
+    collide, so equal sample hashes must be confirmed with a full hash.
+
+    Args:
+        fpath (str): file path
+        sample_size (int): bytes per sampled block
+        num_samples (int): number of blocks between the head and the tail
+        hash_name (str): any name accepted by hashlib.new
+
+    Returns:
+        bytes: digest
+
+    CommandLine:
+        python -m utool.util_hash --test-get_file_sample_hash
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import utool as ut
+        >>> fpath = ut.unixjoin(ut.ensure_app_resource_dir('utool'), 'tmp.txt')
+        >>> ut.write_to(fpath, ut.lorium_ipsum(), verbose=False)
+        >>> # small files are read in full
+        >>> hash1 = get_file_sample_hash(fpath, hash_name='md5')
+        >>> assert hash1 == get_file_hash(fpath, hasher=hashlib.md5())
+        >>> hash2 = get_file_sample_hash(fpath, sample_size=8, num_samples=2)
+        >>> assert hash2 != get_file_hash(fpath)
+    """
+    nbytes = os.path.getsize(fpath)
+    return _sample_file_digest(fpath, nbytes, sample_size, num_samples,
+                               hash_name)[0]
+
+
+def _iter_walk_fpaths(dpath):
+    for root, dname_list, fname_list in os.walk(dpath):
+        for fname in fname_list:
+            yield os.path.join(root, fname)
+
+
+def iter_duplicate_files(fpath_iter, hash_name='sha1', sample_size=2 ** 12,
+                         num_samples=8, min_size=1, use_index=True,
+                         num_threads=None, batch_size=2 ** 12, stats=None):
+    """
+    Lazily finds sets of files with identical contents.
+
+    Candidates are narrowed in three phases, and each phase only looks at
+    files that survived the one before:
+
+        1. group by size. (path, size) rows are spilled to a temporary
+           sqlite table, so memory does not grow with the number of files.
+        2. group by a sampled digest (see get_file_sample_hash). Small files
+           are read in full here and need no further work.
+        3. group by a full hash. With use_index these hashes are cached in
+           the persistent FileHashIndex.
+
+    Several paths to the same inode (hard links, symlinks) count as one
+    file, because removing one of them reclaims no space.
+
+    Args:
+        fpath_iter (iterable or str): file paths or a directory to walk
+        hash_name (str): any name accepted by hashlib.new
+        sample_size (int): bytes per sampled block
+        num_samples (int): sampled blocks between the head and the tail
+        min_size (int): smaller files are ignored (empty files by default)
+        use_index (bool): cache full hashes in the persistent index
+        num_threads (int): threads used to read files
+        batch_size (int): approximate number of candidate files read
+            concurrently. Bounds memory in phases 2 and 3. Larger size
+            groups are paged through the temporary table.
+        stats (dict): if given, filled with counts from each phase
+
+    Yields:
+        tuple: (nbytes, digest, fpath_list) for each set of duplicates,
+            where nbytes is the size of one file
+    """
+    import sqlite3
+    import shutil
+    import stat as stat_
+    import tempfile
+    from multiprocessing.pool import ThreadPool
+    if isinstance(fpath_iter, six.string_types):
+        fpath_iter = _iter_walk_fpaths(fpath_iter)
+    if stats is None:
+        stats = {}
+    for key in ['num_files', 'num_errors', 'num_size_candidates',
+                'num_full_hashed', 'num_dup_sets', 'num_dup_files',
+                'reclaimable_bytes']:
+        stats[key] = 0
+    if num_threads is None:
+        from utool import util_parallel
+        num_threads = util_parallel.get_default_numthreads()
+    index = get_file_hash_index(hash_name) if use_index else None
+    dpath = tempfile.mkdtemp(prefix='utool_dedup_')
+    conn = sqlite3.connect(os.path.join(dpath, 'sizes.sqlite'))
+    pool = ThreadPool(num_threads)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE files (dev INTEGER, ino INTEGER, '
+                     'size INTEGER, path TEXT, sample BLOB, exact INTEGER, '
+                     'digest BLOB, PRIMARY KEY (dev, ino))')
+        insert = ('INSERT OR IGNORE INTO files (dev, ino, size, path) '
+                  'VALUES (?, ?, ?, ?)')
+        rows = []
+        for fpath in fpath_iter:
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                stats['num_errors'] += 1
+                continue
+            if not stat_.S_ISREG(st.st_mode):
+                continue
+            stats['num_files'] += 1
+            if st.st_size >= min_size:
+                rows.append((st.st_dev, st.st_ino, st.st_size, fpath))
+            if len(rows) >= 10000:
+                conn.executemany(insert, rows)
+                rows = []
+        conn.executemany(insert, rows)
+        del rows
+        conn.execute('CREATE INDEX files_size ON files (size)')
+        # lets the large group queries seek to one sample or digest instead
+        # of scanning the whole size group
+        conn.execute('CREATE INDEX files_sample ON files (size, sample)')
+        conn.execute('CREATE INDEX files_digest ON files (size, digest)')
+
+        def _process(items):
+            for item in items:
+                stats['num_dup_sets'] += 1
+                stats['num_dup_files'] += len(item[2])
+                stats['reclaimable_bytes'] += item[0] * (len(item[2]) - 1)
+                yield item
+
+        size_list = conn.execute(
+            'SELECT size, COUNT(*) FROM files GROUP BY size '
+            'HAVING COUNT(*) > 1').fetchall()
+        batch = []
+        num_batched = 0
+        for size, count in size_list:
+            stats['num_size_candidates'] += count
+            if count > batch_size:
+                # too many files of one size to hold at once
+                large_items = _dedup_large_group(
+                    conn, size, pool, index, hash_name, sample_size,
+                    num_samples, batch_size, stats)
+                for item in _process(large_items):
+                    yield item
+                continue
+            fpath_list = [path for (path,) in conn.execute(
+                'SELECT path FROM files WHERE size = ?', (size,))]
+            batch.append((size, fpath_list))
+            num_batched += len(fpath_list)
+            if num_batched >= batch_size:
+                for item in _process(_dedup_batch(
+                        batch, pool, index, hash_name, sample_size,
+                        num_samples, stats)):
+                    yield item
+                batch = []
+                num_batched = 0
+        for item in _process(_dedup_batch(batch, pool, index, hash_name,
+                                          sample_size, num_samples, stats)):
+            yield item
+    finally:
+        pool.close()
+        pool.join()
+        conn.close()
+        shutil.rmtree(dpath, ignore_errors=True)
+
+
+def _dedup_batch(batch, pool, index, hash_name, sample_size, num_samples,
+                 stats):
+    """ phases 2 and 3 of iter_duplicate_files for several size groups """
+    from collections import defaultdict
+
+    def _sample(size_fpath):
+        size, fpath = size_fpath
+        try:
+            return _sample_file_digest(fpath, size, sample_size, num_samples,
+                                       hash_name)
+        except (IOError, OSError):
+            return None
+
+    size_fpath_list = [(size, fpath) for size, fpath_list in batch
+                       for fpath in fpath_list]
+    sample_list = pool.map(_sample, size_fpath_list, chunksize=1)
+    sample_groups = defaultdict(list)
+    for (size, fpath), sample in zip(size_fpath_list, sample_list):
+        if sample is None:
+            stats['num_errors'] += 1
+        else:
+            sample_groups[(size,) + sample].append(fpath)
+    full_cands = []
+    for (size, digest, is_exact), fpath_list in sample_groups.items():
+        if len(fpath_list) < 2:
+            continue
+        if is_exact:
+            yield size, digest, sorted(fpath_list)
+        else:
+            full_cands.extend([(size, fpath) for fpath in fpath_list])
+    if not full_cands:
+        return
+    stats['num_full_hashed'] += len(full_cands)
+    fpath_list = [fpath for size, fpath in full_cands]
+    digest_list = _full_digests(fpath_list, pool, index, hash_name)
+    full_groups = defaultdict(list)
+    for (size, fpath), digest in zip(full_cands, digest_list):
+        if digest is None:
+            stats['num_errors'] += 1
+        else:
+            full_groups[(size, digest)].append(fpath)
+    for (size, digest), fpath_list in full_groups.items():
+        if len(fpath_list) > 1:
+            yield size, digest, sorted(fpath_list)
+
+
+def _full_digests(fpath_list, pool, index, hash_name):
+    """ full hash of each file, or None if it could not be read """
+    if index is None:
+        def _hash(fpath):
+            try:
+                return _hash_file_buffered(fpath, hash_name)
+            except (IOError, OSError):
+                return None
+        return pool.map(_hash, fpath_list, chunksize=1)
+    try:
+        return index.get_hashes(fpath_list)
+    except (IOError, OSError):
+        # a file vanished since it was listed, fall back to one by one
+        digest_list = []
+        for fpath in fpath_list:
+            try:
+                digest_list.append(index.get_hash(fpath))
+            except (IOError, OSError):
+                digest_list.append(None)
+        return digest_list
+
+
+def _iter_pages(conn, query, params, page_size):
+    """
+    Runs query once per page of rows ordered by its first column, which the
+    query must select and compare against the last value seen, i.e.
+    ``... WHERE <col> > ? ... ORDER BY <col> LIMIT ?``. The first page
+    starts after -1, which sqlite orders before any rowid or blob. The
+    cursor is never held open while the caller updates the table.
+    """
+    last = -1
+    while True:
+        page = conn.execute(query, tuple(params) + (last, page_size)).fetchall()
+        if not page:
+            return
+        yield page
+        last = page[-1][0]
+
+
+def _dedup_large_group(conn, size, pool, index, hash_name, sample_size,
+                       num_samples, page_size, stats):
+    """
+    phases 2 and 3 of iter_duplicate_files for one size group with more
+    than page_size files. Digests are written to the temporary table a page
+    at a time and grouped there, so only one page of paths is in memory.
+    """
+    import sqlite3
+
+    def _sample(fpath):
+        try:
+            return _sample_file_digest(fpath, size, sample_size, num_samples,
+                                       hash_name)
+        except (IOError, OSError):
+            return None
+
+    for page in _iter_pages(
+            conn, 'SELECT rowid, path FROM files WHERE size = ? AND '
+            'rowid > ? ORDER BY rowid LIMIT ?', (size,), page_size):
+        sample_list = pool.map(_sample, [path for _, path in page],
+                               chunksize=1)
+        stats['num_errors'] += sample_list.count(None)
+        conn.executemany(
+            'UPDATE files SET sample = ?, exact = ? WHERE rowid = ?',
+            [(sqlite3.Binary(sample[0]), int(sample[1]), rowid)
+             for (rowid, _), sample in zip(page, sample_list)
+             if sample is not None])
+
+    def _paths_where(where, params):
+        return [path for page in _iter_pages(
+            conn, 'SELECT rowid, path FROM files WHERE size = ? AND ' +
+            where + ' AND rowid > ? ORDER BY rowid LIMIT ?',
+            (size,) + params, page_size) for _, path in page]
+
+    # keyset pages over the (size, sample) index, so each page only reads
+    # the samples after the last one seen
+    group_query = ('SELECT sample, MAX(exact) FROM files '
+                   'WHERE size = ? AND sample > ? GROUP BY sample '
+                   'HAVING COUNT(*) > 1 ORDER BY sample LIMIT ?')
+    for page in _iter_pages(conn, group_query, (size,), page_size):
+        for sample, exact in page:
+            if exact:
+                yield size, bytes(sample), sorted(
+                    _paths_where('sample = ?', (sample,)))
+                continue
+            for cand_page in _iter_pages(
+                    conn, 'SELECT rowid, path FROM files WHERE size = ? AND '
+                    'sample = ? AND rowid > ? ORDER BY rowid LIMIT ?',
+                    (size, sample), page_size):
+                stats['num_full_hashed'] += len(cand_page)
+                digest_list = _full_digests([path for _, path in cand_page],
+                                            pool, index, hash_name)
+                stats['num_errors'] += digest_list.count(None)
+                conn.executemany(
+                    'UPDATE files SET digest = ? WHERE rowid = ?',
+                    [(sqlite3.Binary(digest), rowid)
+                     for (rowid, _), digest in zip(cand_page, digest_list)
+                     if digest is not None])
+            digest_query = (
+                'SELECT digest FROM files WHERE size = ? AND sample = ? AND '
+                'digest > ? GROUP BY digest HAVING COUNT(*) > 1 '
+                'ORDER BY digest LIMIT ?')
+            for digest_page in _iter_pages(conn, digest_query,
+                                           (size, sample), page_size):
+                for digest, in digest_page:
+                    yield size, bytes(digest), sorted(_paths_where(
+                        'sample = ? AND digest = ?', (sample, digest)))
+
+
+def find_duplicate_files(fpath_iter, **kwargs):
+    """
+    Finds sets of files with identical contents and the space that removing
+    all but one file from each set would reclaim.
+
+    Args:
+        fpath_iter (iterable or str): file paths or a directory to walk
+        **kwargs: passed to iter_duplicate_files
+
+    Returns:
+        dict: dup_sets (a list of path lists), nbytes (the file size of each
+            set), digests, reclaimable_bytes, and the phase counts.
+
+    CommandLine:
+        python -m utool.util_hash --test-find_duplicate_files
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import utool as ut
+        >>> dpath = ut.ensure_app_resource_dir('utool', 'test_dedup')
+        >>> ut.delete(dpath, verbose=False)
+        >>> ut.ensuredir(dpath)
+        >>> big = b'x' * 10000
+        >>> # same size and same samples as big, differs in the middle
+        >>> big2 = big[:5000] + b'y' + big[5001:]
+        >>> contents = {'a.bin': big, 'b.bin': big, 'c.bin': big2,
+        >>>             'd.txt': b'small', 'e.txt': b'small', 'f.txt': b'other',
+        >>>             'g.txt': b''}
+        >>> for fname, data in contents.items():
+        >>>     with open(os.path.join(dpath, fname), 'wb') as file_:
+        >>>         file_.write(data)
+        >>> os.link(os.path.join(dpath, 'a.bin'), os.path.join(dpath, 'h.bin'))
+        >>> fpath_list = [os.path.join(dpath, fname)
+        >>>               for fname in sorted(os.listdir(dpath))]
+        >>> info = find_duplicate_files(fpath_list, sample_size=16,
+        >>>                             num_samples=2, use_index=False)
+        >>> dup_sets = [[os.path.basename(fpath) for fpath in fpath_list]
+        >>>             for fpath_list in info['dup_sets']]
+        >>> info.pop('digests')
+        >>> info['dup_sets'] = sorted(dup_sets)
+        >>> result = ut.repr4(info, sorted_=True)
+        >>> print(result)
+        {
+            'dup_sets': [['a.bin', 'b.bin'], ['d.txt', 'e.txt']],
+            'nbytes': [5, 10000],
+            'num_dup_files': 4,
+            'num_dup_sets': 2,
+            'num_errors': 0,
+            'num_files': 8,
+            'num_full_hashed': 3,
+            'num_size_candidates': 6,
+            'reclaimable_bytes': 10005,
+        }
+    """
+    stats = {}
+    dup_sets = []
+    nbytes_list = []
+    digest_list = []
+    for nbytes, digest, fpath_list in iter_duplicate_files(fpath_iter,
+                                                           stats=stats,
+                                                           **kwargs):
+        nbytes_list.append(nbytes)
+        digest_list.append(digest)
+        dup_sets.append(fpath_list)
+    info = {
+        'dup_sets': dup_sets,
+        'nbytes': nbytes_list,
+        'digests': digest_list,
+    }
+    info.update(stats)
+    return info
+
+
+def get_file_uuid(fpath, hasher=None, stride=1, use_index=False):
     """ Creates a uuid from the hash of a file
+
+    If use_index is True the hash is cached in the persistent FileHashIndex.
     """
     if hasher is None:
         hasher = hashlib.sha1()  # 20 bytes of output
         #hasher = hashlib.sha256()  # 32 bytes of output
     # sha1 produces a 20 byte hash
-    hashbytes_20 = get_file_hash(fpath, hasher=hasher, stride=stride)
+    hashbytes_20 = get_file_hash(fpath, hasher=hasher, stride=stride,
+                                 use_index=use_index)
     # sha1 produces 20 bytes, but UUID requires 16 bytes
     hashbytes_16 = hashbytes_20[0:16]
     uuid_ = uuid.UUID(bytes=hashbytes_16)
@@ -535,33 +1669,89 @@ def image_uuid(pil_img):
     return uuid_
 
 
+def _repr_hashable(x):
+    y = repr(x)
+    # hack to remove u prefix
+    if isinstance(x, six.string_types):
+        if y.startswith('u'):
+            y = y[1:]
+    return y
+
+
+def _augment_uuid_list(uuids, hashables_lists):
+    sha1 = hashlib.sha1
+    UUID = uuid.UUID
+    for hashables in hashables_lists:
+        if len(hashables) != len(uuids):
+            raise ValueError('got %d uuids but %d hashables' % (
+                len(uuids), len(hashables)))
+    if hashables_lists:
+        hashables_rows = zip(*hashables_lists)
+    else:
+        hashables_rows = [()] * len(uuids)
+    augmented_list = []
+    for uuid_, hashables in zip(uuids, hashables_rows):
+        hashable_text = ''.join(map(_repr_hashable, hashables))
+        augmented_data = uuid_.bytes + hashable_text.encode('utf-8')
+        augmented_list.append(UUID(bytes=sha1(augmented_data).digest()[:16]))
+    return augmented_list
+
+
+def _like_input(values, template):
+    """ packs a list of results into an object array if template is one """
+    if util_type.HAVE_NUMPY and isinstance(template, np.ndarray):
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+        return arr.reshape(template.shape)
+    return values
+
+
 def augment_uuid(uuid_, *hashables):
-    #from six.moves import reprlib
-    #uuidhex_data   = uuid_.get_bytes()
-    uuidhex_data   = uuid_.bytes
-    #hashable_str    = ''.join(map(repr, hashables))
     # Python 2 and 3 diverge here because repr returns
     # ascii data in python2 and unicode text in python3
-    # it would be nice to
     warnings.warn('[ut] should not use repr when hashing', RuntimeWarning)
-    def tmprepr(x):
-        y = repr(x)
-        # hack to remove u prefix
-        if isinstance(x, six.string_types):
-            if y.startswith('u'):
-                y = y[1:]
-        return y
-    if six.PY2:
-        hashable_text = ''.join(map(tmprepr, hashables))
-        hashable_data = hashable_text.encode('utf-8')
-        #hashable_data = b''.join(map(bytes, hashables))
-    elif six.PY3:
-        hashable_text    = ''.join(map(tmprepr, hashables))
-        hashable_data = hashable_text.encode('utf-8')
-        #hashable_data = b''.join(map(bytes, hashables))
-    augmented_data   = uuidhex_data + hashable_data
-    augmented_uuid_ = hashable_to_uuid(augmented_data)
-    return augmented_uuid_
+    return _augment_uuid_list([uuid_], [[hashable] for hashable in hashables])[0]
+
+
+def augment_uuids(uuids, *hashables_lists):
+    """
+    Batch version of augment_uuid. Item i of the result is
+    ``augment_uuid(uuids[i], *[hashables[i] for hashables in hashables_lists])``.
+
+    Args:
+        uuids (list or ndarray): uuid objects
+        *hashables_lists: one list of hashables per augmenting argument
+
+    Returns:
+        list: augmented uuids (an object ndarray if uuids is an ndarray)
+
+    Raises:
+        ValueError: if a hashables list is not as long as uuids
+
+    CommandLine:
+        python -m utool.util_hash augment_uuids
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import warnings
+        >>> uuids = hashables_to_uuids(['a', 'b', 'c'])
+        >>> names = ['x', 'y', 'z']
+        >>> augmented = augment_uuids(uuids, names, [1, 2, 3])
+        >>> with warnings.catch_warnings():
+        >>>     warnings.simplefilter('ignore')
+        >>>     expected = [augment_uuid(u, n, i + 1)
+        >>>                 for i, (u, n) in enumerate(zip(uuids, names))]
+        >>> assert augmented == expected
+    """
+    warnings.warn('[ut] should not use repr when hashing', RuntimeWarning)
+    uuid_list = uuids.ravel().tolist() if isinstance(uuids, _ndarray_types) else uuids
+    hashables_lists = [
+        hashables.ravel().tolist() if isinstance(hashables, _ndarray_types)
+        else hashables
+        for hashables in hashables_lists
+    ]
+    return _like_input(_augment_uuid_list(uuid_list, hashables_lists), uuids)
 
 
 def combine_uuids(uuids, ordered=True, salt=''):
@@ -597,18 +1787,53 @@ def combine_uuids(uuids, ordered=True, salt=''):
             UUID('2b8c46b7-8d0d-23c6-a81e-3eb453b2eb04'),
         ]
     """
-    if len(uuids) == 0:
-        return get_zero_uuid()
-    elif len(uuids) == 1:
-        return uuids[0]
-    else:
-        if not ordered:
-            uuids = sorted(uuids)
-        sep = six.b(str('-'))
-        pref = six.b(str(salt) + str(sep) + str(len(uuids)))
-        combined_bytes = pref + sep.join([u.bytes for u in uuids])
-        combined_uuid = hashable_to_uuid(combined_bytes)
-        return combined_uuid
+    return combine_uuid_groups([uuids], ordered=ordered, salt=salt)[0]
+
+
+def combine_uuid_groups(uuid_groups, ordered=True, salt=''):
+    """
+    Batch version of combine_uuids. Combines each group of uuids into one.
+
+    Args:
+        uuid_groups (list): list of lists of uuid objects
+        ordered (bool): if False each group is considered an orderless set
+        salt (str): see combine_uuids
+
+    Returns:
+        list: one combined uuid per group
+
+    CommandLine:
+        python -m utool.util_hash combine_uuid_groups
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> uuids = hashables_to_uuids(['one', 'two', 'three'])
+        >>> groups = [uuids, uuids[::-1], uuids[:1], []]
+        >>> combos = combine_uuid_groups(groups, ordered=False)
+        >>> assert combos == [combine_uuids(g, ordered=False) for g in groups]
+        >>> assert combos[0] == combos[1] and combos[2] == uuids[0]
+        >>> assert combos[3] == get_zero_uuid()
+    """
+    sha1 = hashlib.sha1
+    UUID = uuid.UUID
+    sep = six.b(str('-'))
+    salt_text = str(salt) + str(sep)
+    zero_uuid = get_zero_uuid()
+    combined_list = []
+    for uuids in uuid_groups:
+        num = len(uuids)
+        if num == 0:
+            combined_list.append(zero_uuid)
+        elif num == 1:
+            combined_list.append(uuids[0])
+        else:
+            if not ordered:
+                uuids = sorted(uuids)
+            pref = six.b(salt_text + str(num))
+            combined_bytes = pref + sep.join([u.bytes for u in uuids])
+            combined_list.append(UUID(bytes=sha1(combined_bytes).digest()[:16]))
+    return combined_list
 
 
 def hashable_to_uuid(hashable_):
@@ -671,42 +1896,134 @@ def hashable_to_uuid(hashable_):
         e864ece8-8880-43b6-7277-c8b2cefe96ad
 
     """
-    print('hashable_ = %r' % (hashable_,))
-    # Hash the bytes
-    if six.PY3:
-        # If hashable_ is text (python3)
-        if isinstance(hashable_, bytes):
-            bytes_ = hashable_
-        if isinstance(hashable_, str):
-            bytes_ = hashable_.encode('utf-8')
-            #print('sbytes=%r' % (bytes_,))
-        elif isinstance(hashable_, int):
-            bytes_ = hashable_.to_bytes(4, byteorder='big')
+    bytes_ = _hashable_to_bytes(hashable_)
+    hashbytes_16 = hashlib.sha1(bytes_).digest()[0:16]
+    uuid_ = uuid.UUID(bytes=hashbytes_16)
+    return uuid_
+
+
+def _hashable_to_bytes(hashable_):
+    if isinstance(hashable_, six.binary_type):
+        return hashable_
+    elif isinstance(hashable_, six.text_type):
+        return hashable_.encode('utf-8')
+    elif isinstance(hashable_, six.integer_types):
+        if six.PY2:
+            return struct.pack('>i', hashable_)
         else:
-            #bytes_ = bytearray(hashable_)
-            bytes_ = hashable_
-            # bytes_ = hashable_
-            #print('bytes_=%r' % (bytes_,))
+            return hashable_.to_bytes(4, byteorder='big')
     elif six.PY2:
-        # If hashable_ is data (python2)
-        if isinstance(hashable_, bytes):
-            bytes_ = hashable_
-        elif isinstance(hashable_, str):
-            bytes_ = hashable_.encode('utf-8')
-        elif isinstance(hashable_, int):
-            import struct
-            bytes_ = struct.pack('>i', hashable_)
+        return bytes(hashable_)
+    else:
+        # any other object supporting the buffer protocol
+        return hashable_
+
+
+def hashables_to_uuids(hashables, as_bytes=False):
+    """
+    Batch version of hashable_to_uuid.
+
+    Args:
+        hashables (list or ndarray): str / bytes / int items. The items of
+            an ndarray are hashed exactly like ``hashable_to_uuid(arr[i])``.
+            That means unicode and bytes items are hashed like str and bytes,
+            and numeric items by their raw native bytes.
+        as_bytes (bool): skips building UUID objects and returns the 16 raw
+            bytes of each uuid (a uint8 array with a trailing axis of 16 for
+            ndarray input). This is about twice as fast.
+
+    Returns:
+        list: uuids (an object ndarray of the same shape for ndarray input)
+
+    CommandLine:
+        python -m utool.util_hash hashables_to_uuids
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> import numpy as np
+        >>> hashables = ['foobar', b'foobar', 10, u'baz']
+        >>> uuids = hashables_to_uuids(hashables)
+        >>> assert uuids == [hashable_to_uuid(h) for h in hashables]
+        >>> arr = np.array([['foobar', 'baz'], ['x', 'y']])
+        >>> uuid_arr = hashables_to_uuids(arr)
+        >>> assert uuid_arr[0, 0] == uuids[0]
+        >>> raw = hashables_to_uuids(arr, as_bytes=True)
+        >>> for nums in [np.array([[1, 2], [3, 2 ** 40]]), np.array([-1]),
+        >>>              np.array([1.5, np.nan]), np.array([True]),
+        >>>              np.array([1, 2], dtype='>i8')]:
+        >>>     expected = [hashable_to_uuid(num) for num in nums.ravel()]
+        >>>     assert hashables_to_uuids(nums).ravel().tolist() == expected
+        >>> result = str((uuid_arr.shape, raw.shape, str(uuid_arr[0, 0])))
+        >>> print(result)
+        ((2, 2), (2, 2, 16), '8843d7f9-2416-211d-e9eb-b963ff4ce281')
+    """
+    is_arr = isinstance(hashables, _ndarray_types)
+    sha1 = hashlib.sha1
+    if is_arr and hashables.dtype.kind not in 'USO':
+        # numpy scalars are hashed through their buffer, so hash each
+        # itemsize slice of the raw data. Indexing returns native order
+        # scalars, so byteswapped arrays are converted first.
+        native = hashables.dtype.newbyteorder('=')
+        flat = np.ascontiguousarray(hashables, dtype=native).reshape(-1)
+        raw = flat.tobytes()
+        step = flat.itemsize
+        digests = [sha1(raw[start:start + step]).digest()[:16]
+                   for start in range(0, len(raw), step)]
+    else:
+        items = hashables.ravel().tolist() if is_arr else hashables
+        if all(type(item) is six.text_type for item in items):
+            digests = [sha1(item.encode('utf-8')).digest()[:16]
+                       for item in items]
         else:
-            bytes_ = bytes(hashable_)
-    print('bytes_ = %r' % (bytes_,))
-    bytes_sha1 = hashlib.sha1(bytes_)
-    # Digest them into a hash
-    #hashstr_40 = img_bytes_sha1.hexdigest()
-    #hashstr_32 = hashstr_40[0:32]
-    hashbytes_20 = bytes_sha1.digest()
-    hashbytes_16 = hashbytes_20[0:16]
-    uuid_ = uuid.UUID(bytes=hashbytes_16)
-    return uuid_
+            to_bytes = _hashable_to_bytes
+            digests = [sha1(to_bytes(item)).digest()[:16] for item in items]
+    if as_bytes:
+        if is_arr:
+            raw = np.frombuffer(b''.join(digests), dtype=np.uint8)
+            return raw.reshape(hashables.shape + (16,))
+        return digests
+    UUID = uuid.UUID
+    uuids = [UUID(bytes=digest) for digest in digests]
+    return _like_input(uuids, hashables)
+
+
+def time_uuid_batches(num=1000000):
+    """
+    Prints the per item cost of the single and batch uuid functions for num
+    items.
+
+    CommandLine:
+        python -m utool.util_hash --exec-time_uuid_batches
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from utool.util_hash import *  # NOQA
+        >>> time_uuid_batches()
+    """
+    import utool as ut
+    hashables = ['item%d' % (count,) for count in range(num)]
+    uuids = hashables_to_uuids(hashables)
+    groups = [uuids[count:count + 3] for count in range(0, num, 3)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        tests = [
+            ('hashable_to_uuid', lambda: [hashable_to_uuid(h) for h in hashables]),
+            ('hashables_to_uuids', lambda: hashables_to_uuids(hashables)),
+            ('hashables_to_uuids(as_bytes)',
+             lambda: hashables_to_uuids(hashables, as_bytes=True)),
+            ('combine_uuids', lambda: [combine_uuids(g) for g in groups]),
+            ('combine_uuid_groups', lambda: combine_uuid_groups(groups)),
+            ('augment_uuid', lambda: [augment_uuid(u, 1) for u in uuids]),
+            ('augment_uuids', lambda: augment_uuids(uuids, [1] * num)),
+        ]
+        for label, func in tests:
+            num_items = len(groups) if 'combine' in label else num
+            t = ut.Timerit(3, verbose=0)
+            for timer in t:
+                with timer:
+                    func()
+            print('%30s: %.3f us/item' % (label, 1E6 * min(t.times) / num_items))
 
 
 def deterministic_uuid(hashable):
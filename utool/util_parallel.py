@@ -4,9 +4,11 @@ Module to executes the same function with different arguments in parallel.
 """
 from __future__ import absolute_import, division, print_function
 import multiprocessing
-# import atexit
+import atexit
 #import sys
 import signal
+import itertools
+import bisect
 import ctypes
 import six
 import threading
@@ -24,6 +26,12 @@ if six.PY2:
 elif six.PY3:
     import _thread
     import queue
+try:
+    from multiprocessing import shared_memory
+    HAVE_SHARED_MEMORY = True
+except ImportError:
+    # python < 3.8
+    HAVE_SHARED_MEMORY = False
 util_inject.noinject('[parallel]')
 
 
@@ -52,6 +60,30 @@ __TIME_GENERATE__   = VERBOSE_PARALLEL or util_arg.get_argflag('--time-generate'
 
 # Maybe global pooling is not correct?
 USE_GLOBAL_POOL = util_arg.get_argflag('--use_global_pool')
+# Reuse one lazily created pool across generate calls instead of paying the
+# pool startup cost every time. Opt-in because the workers only see the
+# module state from when they were forked.
+USE_PERSISTENT_POOL = util_arg.get_argflag('--persistent-pool')
+
+# Adaptive chunking aims for chunks that run this many seconds, which
+# amortizes the per-chunk IPC cost while leaving enough chunks to balance
+# uneven tasks.
+TARGET_CHUNK_TIME = .02
+# Minimum number of chunks given to each process
+MIN_CHUNKS_PER_PROC = 4
+
+# ndarray arguments at least this large are passed through shared memory
+SHARED_MEMORY_MIN_BYTES = 2 ** 16
+
+# generate backends. 'auto' probes the first tasks to choose one of the others
+BACKENDS = ('process', 'thread', 'serial', 'auto')
+# Number of tasks (and maximum seconds) run by the backend='auto' probe
+AUTO_PROBE_TASKS = 3
+AUTO_PROBE_TIME = .1
+# Work expected to take less than this many seconds runs in serial
+AUTO_SERIAL_TIME = .05
+# Tasks using less cpu time than this fraction of wall time run on threads
+AUTO_THREAD_CPU_RATIO = .5
 
 
 # FIXME: running tests in IBEIS has errors when this number is low
@@ -93,12 +125,589 @@ elif BACKEND == 'multiprocessing':
     def new_pool(num_procs, init_worker, maxtasksperchild):
         if FUTURE_ON:
             raise AssertionError('USE FUTURES')
+        if HAVE_SHARED_MEMORY:
+            # workers must inherit the resource tracker that owns shared
+            # memory segments or each starts one that reports them as leaked
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
         return multiprocessing.Pool(processes=num_procs,
                                     initializer=init_worker,
                                     maxtasksperchild=maxtasksperchild)
     pass
 
 
+__PERSISTENT_POOL__ = None
+__PERSISTENT_POOL_PID__ = None
+# Modules that were imported and the functions in __main__ when the
+# persistent pool was started
+__PERSISTENT_POOL_MODULES__ = set()
+__PERSISTENT_POOL_MAIN__ = {}
+# Maps function names to (mean, coefficient of variation) of task durations
+# measured in earlier generate calls
+__TASK_TIME_ESTIMATES__ = {}
+
+
+def _pool_knows_func(func):
+    """
+    True if workers of the persistent pool can resolve func to the same
+    object. Functions from modules imported after the pool started, or
+    defined or redefined in __main__ since then, are unknown to them.
+    """
+    modname = getattr(func, '__module__', None)
+    if modname is None:
+        return True
+    if modname not in __PERSISTENT_POOL_MODULES__:
+        return False
+    if modname == '__main__':
+        name = getattr(func, '__name__', None)
+        return __PERSISTENT_POOL_MAIN__.get(name, None) is func
+    return True
+
+
+def get_persistent_pool(num_procs=None, func=None):
+    """
+    Returns a worker pool that is created on first use and reused by later
+    generate and process calls. The pool is recreated if the requested number
+    of processes changes, if it was inherited from a parent process, or if
+    func cannot be resolved in its workers.
+    """
+    global __PERSISTENT_POOL__, __PERSISTENT_POOL_PID__
+    global __PERSISTENT_POOL_MODULES__, __PERSISTENT_POOL_MAIN__
+    import os
+    import sys
+    if num_procs is None:
+        num_procs = get_default_numprocs()
+    pool = __PERSISTENT_POOL__
+    if pool is not None:
+        if (__PERSISTENT_POOL_PID__ != os.getpid() or
+                pool._processes != num_procs or
+                (func is not None and not _pool_knows_func(func))):
+            close_persistent_pool(terminate=True)
+            pool = None
+    if pool is None:
+        if VERBOSE_PARALLEL:
+            print('[util_parallel] starting persistent pool with %d '
+                  'processes' % (num_procs,))
+        pool = new_pool(num_procs=num_procs, init_worker=init_worker,
+                        maxtasksperchild=None)
+        __PERSISTENT_POOL__ = pool
+        __PERSISTENT_POOL_PID__ = os.getpid()
+        __PERSISTENT_POOL_MODULES__ = set(sys.modules.keys())
+        main = sys.modules.get('__main__', None)
+        __PERSISTENT_POOL_MAIN__ = {
+            key: val for key, val in six.iteritems(vars(main))
+            if callable(val)} if main is not None else {}
+    return pool
+
+
+@atexit.register
+def close_persistent_pool(terminate=False):
+    """ shuts down the pool returned by get_persistent_pool """
+    global __PERSISTENT_POOL__, __PERSISTENT_POOL_PID__
+    global __PERSISTENT_POOL_MAIN__
+    import os
+    pool = __PERSISTENT_POOL__
+    __PERSISTENT_POOL__ = None
+    if pool is not None and __PERSISTENT_POOL_PID__ == os.getpid():
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    __PERSISTENT_POOL_PID__ = None
+    __PERSISTENT_POOL_MAIN__ = {}
+
+
+def get_default_numthreads():
+    """ thread count for I/O bound work (the ThreadPoolExecutor default) """
+    return min(32, multiprocessing.cpu_count() + 4)
+
+
+def _get_pool(backend='process', func=None):
+    """
+    Args:
+        func (callable): the function that will be run, used to tell if a
+            persistent pool has to be recreated
+
+    Returns:
+        tuple: (pool, is_shared) where shared pools must not be closed after
+            use
+    """
+    if backend == 'thread':
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(get_default_numthreads()), False
+    if USE_GLOBAL_POOL:
+        return __POOL__, True
+    elif USE_PERSISTENT_POOL:
+        return get_persistent_pool(func=func), True
+    else:
+        pool = new_pool(num_procs=get_default_numprocs(),
+                        init_worker=init_worker, maxtasksperchild=None)
+        return pool, False
+
+
+def _release_pool(pool, is_shared, quiet=QUIET, broken=False):
+    """ closes a pool from _get_pool when the caller is finished with it """
+    if is_shared:
+        if broken and pool is __PERSISTENT_POOL__:
+            # do not let abandoned tasks delay the next caller
+            close_persistent_pool(terminate=True)
+        elif __EAGER_JOIN__ and USE_GLOBAL_POOL:
+            close_pool(quiet=quiet)
+    elif __EAGER_JOIN__ or broken or _is_thread_pool(pool):
+        if broken:
+            pool.terminate()
+        pool.close()
+        pool.join()
+
+
+def _is_thread_pool(pool):
+    from multiprocessing.pool import ThreadPool
+    return isinstance(pool, ThreadPool)
+
+
+class _TimedFunc(object):
+    """ wraps a task so workers report how long each call took """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, args):
+        from timeit import default_timer
+        start = default_timer()
+        result = self.func(args)
+        return result, default_timer() - start
+
+
+class SharedArrayHandle(object):
+    """
+    Picklable reference to an ndarray stored in a shared memory segment
+    """
+    __slots__ = ('name', 'offset', 'shape', 'dtype')
+
+    def __init__(self, name, offset, shape, dtype):
+        self.name = name
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return (self.name, self.offset, self.shape, self.dtype)
+
+    def __setstate__(self, state):
+        self.name, self.offset, self.shape, self.dtype = state
+
+    def __repr__(self):
+        return 'SharedArrayHandle(%r, shape=%r, dtype=%r)' % (
+            self.name, self.shape, self.dtype)
+
+
+class SharedArrayArena(object):
+    """
+    Owns the shared memory segments used to pass ndarrays to workers.
+
+    ``share`` turns an array into a SharedArrayHandle. Arrays allocated with
+    ``empty`` already live in a segment and are shared without a copy; any
+    other array is copied into a new segment once, no matter how many tasks
+    use it. Every share of a copy must be matched by a ``release``, and the
+    copy is unlinked as soon as its last user releases it. ``close`` unlinks
+    every remaining segment. generate creates and closes an arena when
+    use_shared_memory=True, but one can be passed with ``shared_arena`` to
+    allocate zero-copy inputs or to collect outputs written by workers.
+
+    CommandLine:
+        python -m utool.util_parallel --test-SharedArrayArena
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> from utool.util_parallel import _resolve_shared, _release_shared
+        >>> import numpy as np
+        >>> if HAVE_SHARED_MEMORY:
+        >>>     with SharedArrayArena() as arena:
+        >>>         data = arena.empty((4, 3), dtype=np.float32)
+        >>>         data[:] = np.arange(12).reshape(4, 3)
+        >>>         handle = arena.share(data[1:3])
+        >>>         other = arena.share(np.arange(5))
+        >>>         assert len(arena.segments) == 2
+        >>>         arena.release([handle, other])
+        >>>         assert len(arena.segments) == 1
+        >>>         attached = []
+        >>>         view = _resolve_shared(handle, attached)
+        >>>         assert np.all(view == data[1:3])
+        >>>         view[0, 0] = -1
+        >>>         assert data[1, 0] == -1
+        >>>         del view
+        >>>         _release_shared(attached)
+    """
+    def __init__(self):
+        self.segments = {}
+        # id of a copied array -> (array, handle)
+        self._shared_ids = {}
+        # name of a copy segment -> (number of unreleased shares, id key)
+        self._refcounts = {}
+        # sorted start addresses (and info) of the segments from empty()
+        self._empty_starts = []
+        self._empty_info = []
+        self._lock = threading.Lock()
+
+    def _new_segment(self, nbytes):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        with self._lock:
+            self.segments[shm.name] = shm
+        return shm
+
+    def empty(self, shape, dtype=float):
+        """ allocates an ndarray that lives in a shared memory segment """
+        import numpy as np
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        shm = self._new_segment(nbytes)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        start = arr.__array_interface__['data'][0]
+        with self._lock:
+            pos = bisect.bisect(self._empty_starts, start)
+            self._empty_starts.insert(pos, start)
+            self._empty_info.insert(pos, (start + shm.size, shm))
+        return arr
+
+    def _find_segment(self, arr):
+        """ returns the segment from empty() and offset that contain arr """
+        ptr = arr.__array_interface__['data'][0]
+        with self._lock:
+            pos = bisect.bisect(self._empty_starts, ptr) - 1
+            if pos >= 0:
+                end, shm = self._empty_info[pos]
+                if ptr + arr.nbytes <= end:
+                    return shm, ptr - self._empty_starts[pos]
+        return None, None
+
+    def share(self, arr):
+        """
+        Returns:
+            SharedArrayHandle: handle that workers can turn back into arr
+        """
+        import numpy as np
+        if arr.flags['C_CONTIGUOUS']:
+            shm, offset = self._find_segment(arr)
+            if shm is not None:
+                return SharedArrayHandle(shm.name, offset, arr.shape,
+                                         arr.dtype.str)
+        key = id(arr)
+        with self._lock:
+            cached = self._shared_ids.get(key, None)
+            if cached is not None and cached[0] is arr:
+                handle = cached[1]
+                count, key = self._refcounts[handle.name]
+                self._refcounts[handle.name] = (count + 1, key)
+                return handle
+        shm = self._new_segment(arr.nbytes)
+        copy = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        copy[...] = arr
+        del copy
+        handle = SharedArrayHandle(shm.name, 0, arr.shape, arr.dtype.str)
+        with self._lock:
+            # keep arr alive so its id is not reused while it is shared
+            self._shared_ids[key] = (arr, handle)
+            self._refcounts[shm.name] = (1, key)
+        return handle
+
+    def release(self, handles):
+        """
+        Drops one share of each handle. Copies that are no longer shared are
+        unlinked. Segments allocated by empty() stay until close.
+        """
+        unused = []
+        with self._lock:
+            for handle in handles:
+                name = handle.name
+                if name not in self._refcounts:
+                    continue
+                count, key = self._refcounts[name]
+                if count > 1:
+                    self._refcounts[name] = (count - 1, key)
+                    continue
+                del self._refcounts[name]
+                cached = self._shared_ids.get(key, None)
+                if cached is not None and cached[1].name == name:
+                    del self._shared_ids[key]
+                unused.append(self.segments.pop(name))
+        for shm in unused:
+            _unlink_segment(shm)
+
+    def share_args(self, args, min_nbytes=SHARED_MEMORY_MIN_BYTES):
+        """
+        Replaces large ndarrays in args (and directly inside a tuple, list,
+        or dict args) by handles
+        """
+        import numpy as np
+        def _convert(item):
+            if isinstance(item, np.ndarray) and item.nbytes >= min_nbytes:
+                if item.dtype.kind != 'O':
+                    return self.share(item)
+            return item
+        if isinstance(args, tuple):
+            return tuple(_convert(item) for item in args)
+        elif isinstance(args, list):
+            return [_convert(item) for item in args]
+        elif isinstance(args, dict):
+            return {key: _convert(val) for key, val in six.iteritems(args)}
+        return _convert(args)
+
+    def close(self):
+        """ closes and unlinks every segment """
+        with self._lock:
+            segments = list(self.segments.values())
+            self.segments = {}
+            self._shared_ids = {}
+            self._refcounts = {}
+            self._empty_starts = []
+            self._empty_info = []
+        for shm in segments:
+            _unlink_segment(shm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, trace):
+        self.close()
+
+
+def _unlink_segment(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # arrays from empty() are still referenced. The memory is freed
+        # when they are garbage collected.
+        pass
+    try:
+        shm.unlink()
+    except (OSError, IOError):
+        pass
+
+
+def _shared_handles(args):
+    """ the SharedArrayHandles that share_args put into args """
+    if isinstance(args, SharedArrayHandle):
+        return [args]
+    elif isinstance(args, (tuple, list)):
+        items = args
+    elif isinstance(args, dict):
+        items = list(args.values())
+    else:
+        return []
+    return [item for item in items if isinstance(item, SharedArrayHandle)]
+
+
+def _attach_shared_memory(name):
+    """ attaches to an existing segment without taking ownership of it """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always registers the segment with the resource
+        # tracker. Pool workers share the tracker of the process that
+        # created the segment, so this is a no-op there.
+        return shared_memory.SharedMemory(name=name)
+
+
+# attachments that could not be closed because a result still references them
+_LINGERING_SHM = []
+
+
+def _resolve_shared(obj, attached):
+    """ inverse of SharedArrayArena.share_args """
+    if isinstance(obj, SharedArrayHandle):
+        import numpy as np
+        shm = _attach_shared_memory(obj.name)
+        attached.append(shm)
+        return np.ndarray(obj.shape, dtype=np.dtype(obj.dtype),
+                          buffer=shm.buf, offset=obj.offset)
+    elif isinstance(obj, tuple):
+        return tuple(_resolve_shared(item, attached) for item in obj)
+    elif isinstance(obj, list):
+        return [_resolve_shared(item, attached) for item in obj]
+    elif isinstance(obj, dict):
+        return {key: _resolve_shared(val, attached)
+                for key, val in six.iteritems(obj)}
+    return obj
+
+
+def _release_shared(attached):
+    for shm in _LINGERING_SHM + attached:
+        try:
+            shm.close()
+        except BufferError:
+            if shm not in _LINGERING_SHM:
+                _LINGERING_SHM.append(shm)
+        else:
+            if shm in _LINGERING_SHM:
+                _LINGERING_SHM.remove(shm)
+
+
+class _SharedMemFunc(object):
+    """ rebuilds shared ndarray arguments in the worker before calling """
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = get_funcname(func)
+
+    def __call__(self, *args, **kwargs):
+        attached = []
+        try:
+            args = _resolve_shared(args, attached)
+            kwargs = _resolve_shared(kwargs, attached)
+            return self.func(*args, **kwargs)
+        finally:
+            del args, kwargs
+            _release_shared(attached)
+
+
+def _wants_shared_memory(use_shared_memory, shared_arena=None):
+    """
+    Shared memory is opt-in because /dev/shm is often small (64MB in
+    docker) and running out of it kills workers with SIGBUS. Passing a
+    shared_arena opts in.
+    """
+    if not HAVE_SHARED_MEMORY or use_shared_memory is False:
+        return False
+    return bool(use_shared_memory) or shared_arena is not None
+
+
+def _generate_shared(pool, worker_func, indexed_args, arena, ordered,
+                     max_in_flight):
+    """
+    Runs (index, args) tasks through shared memory with at most
+    max_in_flight tasks submitted or waiting to be yielded. The copies made
+    for a task are released as soon as its result is back, so /dev/shm use
+    is bounded by max_in_flight instead of growing with the number of tasks.
+    """
+    indexed_args = iter(indexed_args)
+    done_queue = queue.Queue()
+    handles_of = {}
+    buffer_ = {}
+    next_index = [0]
+
+    def _submit():
+        try:
+            index, args = six.next(indexed_args)
+        except StopIteration:
+            return False
+        shared_args = arena.share_args(args)
+        handles_of[index] = _shared_handles(shared_args)
+
+        def _callback(result, index=index):
+            done_queue.put((index, False, result))
+
+        def _error_callback(ex, index=index):
+            done_queue.put((index, True, ex))
+        kw = {'error_callback': _error_callback} if six.PY3 else {}
+        pool.apply_async(worker_func, (shared_args,), callback=_callback,
+                         **kw)
+        return True
+
+    try:
+        while len(handles_of) < max_in_flight and _submit():
+            pass
+        while handles_of or buffer_:
+            if handles_of:
+                index, raised, value = done_queue.get()
+                arena.release(handles_of.pop(index))
+                if raised:
+                    raise value
+                buffer_[index] = value
+            if ordered:
+                ready = []
+                while next_index[0] in buffer_:
+                    ready.append(buffer_.pop(next_index[0]))
+                    next_index[0] += 1
+            else:
+                ready = list(buffer_.values())
+                buffer_.clear()
+            while len(handles_of) + len(buffer_) < max_in_flight and _submit():
+                pass
+            for result in ready:
+                yield result
+    finally:
+        for handles in handles_of.values():
+            arena.release(handles)
+
+
+class _IndexedTask(object):
+    """ runs func on (index, args) and returns (index, result) """
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = get_funcname(func)
+
+    def __call__(self, indexed_args):
+        index, args = indexed_args
+        return index, self.func(args)
+
+
+def lpt_order(costs):
+    """
+    Longest processing time first: task indices sorted by decreasing cost.
+    Ties keep their original order.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> result = lpt_order([1, 10, 3, 10, 0.5])
+        >>> print(result)
+        [1, 3, 2, 0, 4]
+    """
+    return sorted(range(len(costs)), key=lambda index: -costs[index])
+
+
+def _task_time_key(func):
+    module = getattr(func, '__module__', None)
+    return '%s.%s' % (module, get_funcname(func))
+
+
+def _summarize_task_times(durations):
+    """ returns the mean and coefficient of variation of task durations """
+    num = len(durations)
+    mean = sum(durations) / num
+    if num > 1 and mean > 0:
+        var = sum((d - mean) ** 2 for d in durations) / (num - 1)
+        cv = (var ** .5) / mean
+    else:
+        cv = 0.0
+    return mean, cv
+
+
+def adaptive_chunksize(mean_time, nTasks, num_procs, cv=0.0):
+    """
+    Picks a chunksize so each chunk runs about TARGET_CHUNK_TIME seconds.
+    Uneven tasks (high coefficient of variation) get proportionally smaller
+    chunks, and every process gets at least MIN_CHUNKS_PER_PROC chunks.
+
+    Args:
+        mean_time (float): mean seconds per task
+        nTasks (int): number of tasks left to schedule
+        num_procs (int): number of worker processes
+        cv (float): coefficient of variation of the task times
+
+    Returns:
+        int: chunksize
+
+    CommandLine:
+        python -m utool.util_parallel --test-adaptive_chunksize
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> fast = adaptive_chunksize(1E-6, 100000, 4)
+        >>> slow = adaptive_chunksize(.1, 100000, 4)
+        >>> uneven = adaptive_chunksize(1E-3, 100000, 4, cv=3.0)
+        >>> even = adaptive_chunksize(1E-3, 100000, 4, cv=0.0)
+        >>> result = (fast, slow, uneven, even)
+        >>> print(result)
+        (6250, 1, 5, 20)
+    """
+    mean_time = max(mean_time, 1E-7)
+    chunksize = int(TARGET_CHUNK_TIME / (mean_time * (1.0 + cv)))
+    max_chunksize = nTasks // (num_procs * MIN_CHUNKS_PER_PROC)
+    return max(1, min(chunksize, max_chunksize))
+
+
 def set_num_procs(num_procs):
     global __NUM_PROCS__
     __NUM_PROCS__ = num_procs
@@ -244,44 +853,72 @@ def _process_parallel(func, args_list, args_dict={}, nTasks=None, quiet=QUIET, p
         pass
     # Get the results
     result_list = [ap.get() for ap in apply_results]
-    if __EAGER_JOIN__:
-        if USE_GLOBAL_POOL:
-            close_pool(quiet=quiet)
-        else:
-            pool.close()
-            pool.join()
     return result_list
 
 
 def _generate_parallel(func, args_list, ordered=True, chunksize=None,
                        prog=True, verbose=True, quiet=QUIET, nTasks=None,
-                       **kwargs):
+                       use_shared_memory=None, shared_arena=None,
+                       backend='process', costs=None, **kwargs):
     """
-    Parallel process generator
+    Parallel process (or thread) generator
+
+    If chunksize is None it is chosen from measured task durations. Functions
+    seen in earlier calls reuse their recorded durations. Otherwise the first
+    tasks run with chunksize=1 as a pilot whose timings size the rest.
+
+    With use_shared_memory large ndarray arguments are moved into shared
+    memory segments (see SharedArrayArena). Tasks are then dispatched one at
+    a time with a bounded number in flight, and each copy is unlinked once
+    the results of all tasks using it are back. A caller supplied
+    shared_arena is left open.
+
+    If costs are given tasks are dispatched one at a time (unless chunksize
+    is set) in longest processing time first order and the results are put
+    back in the original order when ordered=True.
     """
-    global __POOL__
     if FUTURE_ON:
         raise AssertionError('USE FUTURES')
-    if USE_GLOBAL_POOL:
-        global __POOL__
-        pool = __POOL__
-    else:
-        # Maybe global pools are bad?
-        pool = new_pool(num_procs=get_default_numprocs(),
-                        init_worker=init_worker,
-                        maxtasksperchild=None)
-        #pool = new_pool()
-
-    prog = prog and verbose
     if nTasks is None:
         nTasks = len(args_list)
-    if chunksize is None:
-        chunksize = max(min(4, nTasks), min(8, nTasks // (pool._processes ** 2)))
+    use_shm = (backend != 'thread' and
+               _wants_shared_memory(use_shared_memory, shared_arena))
+    pool, is_shared = _get_pool(backend, func)
+
+    prog = prog and verbose
+    num_procs = pool._processes
+    timekey = _task_time_key(func)
+    adaptive = chunksize is None and costs is None and not use_shm
+    if costs is not None:
+        args_list = list(args_list)
+        if len(costs) != len(args_list):
+            raise ValueError('got %d costs for %d tasks' % (len(costs),
+                                                            len(args_list)))
+        args_list = [args_list[index] for index in lpt_order(costs)]
+    args_iter = iter(args_list)
+    arena = None
+    if use_shm:
+        arena = SharedArrayArena() if shared_arena is None else shared_arena
+        worker_func = _SharedMemFunc(func)
+    else:
+        worker_func = func
+    num_pilot = 0
+    if adaptive:
+        estimate = __TASK_TIME_ESTIMATES__.get(timekey, None)
+        if estimate is None:
+            num_pilot = min(nTasks, num_procs * 2)
+        else:
+            chunksize = adaptive_chunksize(estimate[0], nTasks, num_procs,
+                                           estimate[1])
     if verbose or VERBOSE_PARALLEL:
         prefix = '[util_parallel._generate_parallel]'
         fmtstr = (prefix +
-                  'executing %d %s tasks using %d processes with chunksize=%r')
-        print(fmtstr % (nTasks, get_funcname(func), pool._processes, chunksize))
+                  'executing %d %s tasks using %d %s with chunksize=%s')
+        print(fmtstr % (nTasks, get_funcname(func), num_procs,
+                        'threads' if backend == 'thread' else 'processes',
+                        ('adaptive' if adaptive else 'longest first'
+                         if costs is not None else
+                         'shared memory' if use_shm else chunksize)))
 
     #import utool as ut
     #buffered = ut.get_argflag('--buffered')
@@ -293,7 +930,53 @@ def _generate_parallel(func, args_list, ordered=True, chunksize=None,
     #    raw_generator = buffered_generator(source_gen)
     #else:
     pmap_func = pool.imap if ordered else pool.imap_unordered
-    raw_generator = pmap_func(func, args_list, chunksize)
+    durations = []
+
+    def _timed_generator():
+        timed_func = _TimedFunc(worker_func)
+        chunksize_ = chunksize
+        if num_pilot > 0:
+            pilot_args = list(itertools.islice(args_iter, num_pilot))
+            for result, duration in pmap_func(timed_func, pilot_args, 1):
+                durations.append(duration)
+                yield result
+            mean, cv = _summarize_task_times(durations)
+            chunksize_ = adaptive_chunksize(mean, nTasks - num_pilot,
+                                            num_procs, cv)
+            if VERBOSE_PARALLEL:
+                print('[util_parallel] pilot mean=%.2es cv=%.2f '
+                      'chunksize=%d' % (mean, cv, chunksize_))
+        for result, duration in pmap_func(timed_func, args_iter, chunksize_):
+            durations.append(duration)
+            yield result
+
+    def _lpt_generator():
+        order = lpt_order(costs)
+        indexed_args = zip(order, args_iter)
+        buffer_ = {}
+        next_index = 0
+        for index, result in pool.imap_unordered(_IndexedTask(worker_func),
+                                                 indexed_args,
+                                                 chunksize or 1):
+            if not ordered:
+                yield result
+                continue
+            buffer_[index] = result
+            while next_index in buffer_:
+                yield buffer_.pop(next_index)
+                next_index += 1
+
+    if use_shm:
+        indexed_args = (enumerate(args_iter) if costs is None else
+                        zip(lpt_order(costs), args_iter))
+        raw_generator = _generate_shared(pool, worker_func, indexed_args,
+                                         arena, ordered, 2 * num_procs)
+    elif costs is not None:
+        raw_generator = _lpt_generator()
+    elif adaptive:
+        raw_generator = _timed_generator()
+    else:
+        raw_generator = pmap_func(worker_func, args_iter, chunksize)
 
     # Get iterator with or without progress
     if prog:
@@ -312,24 +995,14 @@ def _generate_parallel(func, args_list, ordered=True, chunksize=None,
 
     if __TIME_GENERATE__:
         tt = util_time.tic('_generate_parallel func=' + get_funcname(func))
+    finished = False
     try:
         # Start generating
         for result in result_generator:
             yield result
-        if __EAGER_JOIN__:
-            if USE_GLOBAL_POOL:
-                close_pool(quiet=quiet)
-            else:
-                pool.close()
-                pool.join()
+        finished = True
     except Exception as ex:
         util_dbg.printex(ex, 'Parallel Generation Failed!', '[utool]', tb=True)
-        if __EAGER_JOIN__:
-            if USE_GLOBAL_POOL:
-                close_pool(quiet=quiet)
-            else:
-                pool.close()
-                pool.join()
         # DONT DO SERIAL FALLBACK IN GENERATOR CAN CAUSE ERRORS
         raise
         # print('__SERIAL_FALLBACK__ = %r' % __SERIAL_FALLBACK__)
@@ -342,19 +1015,381 @@ def _generate_parallel(func, args_list, ordered=True, chunksize=None,
         #         yield result
         # else:
         #     raise
+    finally:
+        # A generator abandoned part way through leaves tasks in the pool
+        _release_pool(pool, is_shared, quiet=quiet, broken=not finished)
+        if arena is not None and shared_arena is None:
+            arena.close()
+        if durations:
+            __TASK_TIME_ESTIMATES__[timekey] = _summarize_task_times(
+                durations)
     if __TIME_GENERATE__:
         util_time.toc(tt)
 
 
+class TaskTimeoutError(Exception):
+    """ a task ran longer than the timeout given to generate """
+
+
+class TaskResult(object):
+    """
+    Outcome of one task run by generate(..., on_error='capture')
+
+    Attributes:
+        index (int): position of the task in args_list
+        result: return value of the task (None if it failed)
+        error (Exception): final exception, or None on success
+        traceback (str): formatted traceback of the final exception
+        attempts (int): number of times the task was run
+    """
+    __slots__ = ('index', 'result', 'error', 'traceback', 'attempts')
+
+    def __init__(self, index, result=None, error=None, traceback=None,
+                 attempts=1):
+        self.index = index
+        self.result = result
+        self.error = error
+        self.traceback = traceback
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get(self):
+        """ returns the result or raises the error of the task """
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def __repr__(self):
+        if self.ok:
+            return 'TaskResult(%d, result=%r)' % (self.index, self.result)
+        return 'TaskResult(%d, error=%r, attempts=%d)' % (
+            self.index, self.error, self.attempts)
+
+
+class _CapturedTask(object):
+    """
+    Runs a task in the worker and returns (error, traceback, result) instead
+    of raising, so one failure does not break the pool
+    """
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = get_funcname(func)
+
+    def __call__(self, args):
+        try:
+            return None, None, self.func(args)
+        except Exception as ex:
+            import traceback
+            import pickle
+            tb = traceback.format_exc()
+            try:
+                pickle.loads(pickle.dumps(ex))
+            except Exception:
+                ex = RuntimeError('%s: %s' % (type(ex).__name__, ex))
+            return ex, tb, None
+
+
+def _terminate_pool_tree(pool):
+    """ KillableProcess.terminate2 for every worker of a pool """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        for proc in getattr(pool, '_pool', []):
+            try:
+                for child in psutil.Process(proc.pid).children(recursive=True):
+                    child.terminate()
+            except Exception:
+                pass
+    pool.terminate()
+    pool.join()
+
+
+def _generate_tolerant(func, args_list, ordered=True, on_error='raise',
+                       retries=0, retry_backoff=.1, timeout=None,
+                       backend='process', num_procs=None, max_in_flight=None,
+                       costs=None, quiet=QUIET):
+    """
+    Generator behind the error policy of generate and futures_generate.
+
+    Each task runs through _CapturedTask. Failed tasks are resubmitted up to
+    ``retries`` times, waiting ``retry_backoff * 2 ** (attempt - 1)``
+    seconds first. When a task exceeds ``timeout`` seconds the pool is
+    terminated (killing the hung worker and its children like
+    KillableProcess.terminate2), a new pool is started, the timed out task
+    counts a failed attempt, and the other unfinished tasks are resubmitted.
+    Only worker processes can be killed, so a timeout always runs the tasks
+    in a process pool, even when backend is 'serial' or 'thread'. If costs
+    are given tasks are submitted longest first (see lpt_order).
+
+    Yields:
+        TaskResult records if on_error='capture', otherwise plain results.
+        With on_error='raise' the final error of a task is raised in order.
+    """
+    import heapq
+    from timeit import default_timer
+    if on_error not in ('raise', 'capture'):
+        raise ValueError('on_error=%r must be raise or capture' % (on_error,))
+    if timeout is not None and backend != 'process':
+        backend = 'process'
+    if costs is not None:
+        args_list = list(args_list)
+        args_iter = ((index, args_list[index]) for index in lpt_order(costs))
+    else:
+        args_iter = enumerate(args_list)
+    task_func = _CapturedTask(func)
+
+    def _finish(index, error, tb, result, attempts):
+        if on_error == 'capture':
+            return TaskResult(index, result, error, tb, attempts)
+        if error is not None:
+            print('[util_parallel] task %d failed after %d attempts:\n%s' % (
+                index, attempts, tb))
+            raise error
+        return result
+
+    if backend == 'serial':
+        import time
+        for index, args in args_iter:
+            attempts = 0
+            while True:
+                attempts += 1
+                error, tb, result = task_func(args)
+                if error is None or attempts > retries:
+                    break
+                time.sleep(retry_backoff * 2 ** (attempts - 1))
+            yield _finish(index, error, tb, result, attempts)
+        return
+
+    # Without timeouts the pool is never restarted, so the shared one is used
+    use_shared_pool = (timeout is None and num_procs is None and
+                       backend == 'process' and not USE_GLOBAL_POOL)
+    if num_procs is None:
+        num_procs = (get_default_numthreads() if backend == 'thread' else
+                     get_default_numprocs())
+    if max_in_flight is None:
+        max_in_flight = 2 * num_procs
+    if timeout is not None:
+        # a queued task must not be charged for the time it waits for a
+        # worker, so only submit as many tasks as there are workers
+        max_in_flight = min(max_in_flight, num_procs)
+
+    def _new_pool():
+        if backend == 'thread':
+            from multiprocessing.pool import ThreadPool
+            return ThreadPool(num_procs)
+        return new_pool(num_procs, init_worker, None)
+
+    done_queue = queue.Queue()
+    if use_shared_pool:
+        first_pool, is_shared = _get_pool(backend, func)
+    else:
+        first_pool, is_shared = _new_pool(), False
+    pool = [first_pool, 0]  # pool and its generation
+    args_of = {}          # index -> args of tasks not yet finished
+    attempts_of = {}      # index -> number of submitted attempts
+    running = {}          # index -> (generation, start time)
+    retry_heap = []       # (ready time, index)
+    finished = {}         # index -> (raised, yieldable value or exception)
+    next_index = [0]
+    exhausted = [False]
+
+    def _submit(index):
+        attempts_of[index] = attempts_of.get(index, 0) + 1
+        generation = pool[1]
+        running[index] = (generation, default_timer())
+
+        def _callback(out, index=index, generation=generation):
+            done_queue.put((index, generation, out))
+
+        def _error_callback(ex, index=index, generation=generation):
+            # The task could not be sent or its result could not be pickled
+            done_queue.put((index, generation, (ex, repr(ex), None)))
+        kw = {'error_callback': _error_callback} if six.PY3 else {}
+        pool[0].apply_async(task_func, (args_of[index],), callback=_callback,
+                            **kw)
+
+    def _fill():
+        while (not exhausted[0] and
+               len(args_of) < max_in_flight):
+            try:
+                index, args = six.next(args_iter)
+            except StopIteration:
+                exhausted[0] = True
+                break
+            args_of[index] = args
+            _submit(index)
+
+    def _record(index, out):
+        error, tb, result = out
+        attempts = attempts_of[index]
+        if error is not None and attempts <= retries:
+            delay = retry_backoff * 2 ** (attempts - 1)
+            heapq.heappush(retry_heap, (default_timer() + delay, index))
+            return
+        del args_of[index]
+        try:
+            finished[index] = (False, _finish(index, error, tb, result,
+                                              attempts))
+        except Exception as ex:
+            finished[index] = (True, ex)
+
+    def _check_timeouts():
+        now = default_timer()
+        expired = [index for index, (gen, start) in running.items()
+                   if gen == pool[1] and now - start > timeout]
+        if not expired:
+            return
+        if VERBOSE_PARALLEL or not quiet:
+            print('[util_parallel] tasks %r timed out. Restarting pool' % (
+                expired,))
+        _terminate_pool_tree(pool[0])
+        pool[0], pool[1] = _new_pool(), pool[1] + 1
+        lost = [index for index in running if index not in expired]
+        running.clear()
+        for index in expired:
+            error = TaskTimeoutError('task %d ran longer than %rs' % (
+                index, timeout))
+            _record(index, (error, 'TaskTimeoutError: %s' % (error,), None))
+        for index in lost:
+            # interrupted by the restart, does not count as an attempt
+            attempts_of[index] -= 1
+            _submit(index)
+
+    try:
+        _fill()
+        while args_of or finished:
+            # hand back everything that can be yielded
+            if ordered:
+                ready = []
+                while next_index[0] in finished:
+                    ready.append(finished.pop(next_index[0]))
+                    next_index[0] += 1
+            else:
+                ready = [finished.pop(index) for index in list(finished)]
+            for raised, item in ready:
+                if raised:
+                    raise item
+                yield item
+            _fill()
+            if not args_of:
+                continue
+            now = default_timer()
+            while retry_heap and retry_heap[0][0] <= now:
+                _submit(heapq.heappop(retry_heap)[1])
+            wait = 1.0
+            if retry_heap:
+                wait = min(wait, max(0, retry_heap[0][0] - now))
+            if timeout is not None:
+                wait = min(wait, timeout / 4.0)
+            try:
+                index, generation, out = done_queue.get(timeout=wait)
+            except queue.Empty:
+                pass
+            else:
+                if generation == pool[1] and index in running:
+                    del running[index]
+                    _record(index, out)
+            if timeout is not None:
+                _check_timeouts()
+    finally:
+        if is_shared:
+            _release_pool(pool[0], True, quiet=quiet, broken=bool(args_of))
+        elif args_of:
+            _terminate_pool_tree(pool[0])
+        else:
+            pool[0].close()
+            pool[0].join()
+
+
+def choose_backend(cpu_time, wall_time, num_probed, nTasks):
+    """
+    Picks a generate backend from a serial probe of the first tasks.
+
+    Args:
+        cpu_time (float): process cpu seconds spent by the probed tasks
+        wall_time (float): wall clock seconds spent by the probed tasks
+        num_probed (int): number of tasks probed
+        nTasks (int): number of tasks that remain
+
+    Returns:
+        str: 'serial' when the remaining work is too small to amortize
+            parallel overhead, 'thread' when tasks mostly wait (I/O), and
+            'process' otherwise
+
+    CommandLine:
+        python -m utool.util_parallel --test-choose_backend
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> tiny = choose_backend(1E-6, 1E-6, 3, 100)
+        >>> io_bound = choose_backend(.001, .3, 3, 100)
+        >>> cpu_bound = choose_backend(.3, .3, 3, 100)
+        >>> result = (tiny, io_bound, cpu_bound)
+        >>> print(result)
+        ('serial', 'thread', 'process')
+    """
+    mean_wall = wall_time / max(num_probed, 1)
+    if mean_wall * nTasks < AUTO_SERIAL_TIME:
+        return 'serial'
+    cpu_ratio = cpu_time / wall_time if wall_time > 0 else 1.0
+    if cpu_ratio < AUTO_THREAD_CPU_RATIO:
+        return 'thread'
+    return 'process'
+
+
+def _generate_auto(func, args_list, nTasks=None, verbose=True, costs=None,
+                   **kwargs):
+    """
+    Runs the first tasks in serial to measure their cpu / wall time, then
+    generates the rest with the backend picked by choose_backend. The probe
+    results are yielded first, so ordered semantics are kept.
+    """
+    import time
+    from timeit import default_timer
+    cpu_timer = getattr(time, 'process_time', None) or time.clock
+    args_iter = iter(args_list)
+    probe_results = []
+    cpu_time = wall_time = 0.0
+    for args in itertools.islice(args_iter, min(AUTO_PROBE_TASKS, nTasks)):
+        cpu_start, wall_start = cpu_timer(), default_timer()
+        probe_results.append(func(args))
+        cpu_time += cpu_timer() - cpu_start
+        wall_time += default_timer() - wall_start
+        if wall_time > AUTO_PROBE_TIME:
+            break
+    num_probed = len(probe_results)
+    num_left = nTasks - num_probed
+    backend = choose_backend(cpu_time, wall_time, num_probed, num_left)
+    if verbose or VERBOSE_PARALLEL:
+        print('[util_parallel.generate] auto backend=%r (cpu=%.3fs wall=%.3fs '
+              'over %d tasks)' % (backend, cpu_time, wall_time, num_probed))
+    for result in probe_results:
+        yield result
+    del probe_results
+    if num_left > 0:
+        if costs is not None:
+            costs = costs[num_probed:]
+        for result in generate(func, args_iter, nTasks=num_left,
+                               verbose=verbose, backend=backend, costs=costs,
+                               **kwargs):
+            yield result
+
+
 def _generate_serial(func, args_list, prog=True, verbose=True, nTasks=None,
                      quiet=QUIET, **kwargs):
     """ internal serial generator  """
-    if nTasks is None:
+    if nTasks is None and hasattr(args_list, '__len__'):
         nTasks = len(args_list)
     if verbose and not quiet:
-        print('[util_parallel._generate_serial] executing %d %s tasks in serial' %
-                (nTasks, get_funcname(func)))
-    prog = prog and verbose and nTasks > 1
+        print('[util_parallel._generate_serial] executing %s %s tasks in serial' %
+                ('?' if nTasks is None else nTasks, get_funcname(func)))
+    prog = prog and verbose and (nTasks is None or nTasks > 1)
     # Get iterator with or without progress
     verbose = verbose or not quiet
     lbl = '(sergen) %s: ' % (get_funcname(func),)
@@ -389,7 +1424,9 @@ def ensure_pool(warn=False, quiet=QUIET):
 
 def generate(func, args_list, ordered=True, force_serial=None,
              chunksize=None, prog=True, verbose=True, quiet=QUIET, nTasks=None,
-             freq=None, **kwargs):
+             freq=None, use_shared_memory=None, shared_arena=None,
+             backend=None, on_error=None, retries=0, retry_backoff=.1,
+             timeout=None, costs=None, cost_func=None, broker=None, **kwargs):
     """
     Provides an interfaces to python's multiprocessing module.
     Esentially maps ``args_list`` onto ``func`` using pool.imap.
@@ -406,6 +1443,38 @@ def generate(func, args_list, ordered=True, force_serial=None,
         prog (bool):
         verbose (bool):
         nTasks (int): optional (must be specified if args_list is an iterator)
+        use_shared_memory (bool): pass ndarray arguments of at least
+            SHARED_MEMORY_MIN_BYTES to the workers through shared memory
+            instead of pickling them. Off by default because /dev/shm may be
+            small. Requires python 3.8.
+        shared_arena (SharedArrayArena): arena to share arrays with (implies
+            use_shared_memory). Arrays allocated by ``shared_arena.empty``
+            are passed without any copy.
+        backend (str): 'process' (default), 'thread' for I/O bound work,
+            'serial', or 'auto' to run the first tasks in serial and pick a
+            backend from their cpu time / wall time ratio
+            (see choose_backend).
+        on_error (str): 'raise' or 'capture'. With 'capture' a TaskResult
+            holding the result or the exception and traceback is yielded for
+            every task instead of stopping at the first failure.
+        retries (int): number of times a failed task is rerun
+        retry_backoff (float): seconds to wait before the first retry. The
+            wait doubles with every further attempt.
+        timeout (float): seconds after which a task is killed (by restarting
+            the worker processes) and counted as failed with
+            TaskTimeoutError. The tasks always run in worker processes
+            then, even for the serial and thread backends. chunksize and
+            shared memory are not supported together with on_error,
+            retries, or timeout.
+        costs (list): estimated cost of each task (e.g. image sizes). Tasks
+            are then scheduled longest first, one at a time, so a few huge
+            tasks do not leave the other workers idle at the end. Results
+            still come back in order if ordered=True.
+        cost_func (function): computes the cost of a task from its args
+            when costs is not given
+        broker (TaskBroker): run the tasks on remote workers connected to
+            this broker instead of a local pool. Cannot be combined with
+            on_error, retries, timeout, costs or cost_func.
 
     Returns:
         generator which yeilds result of applying func to args in args_list
@@ -417,6 +1486,10 @@ def generate(func, args_list, ordered=True, force_serial=None,
         python -m utool.util_parallel --test-generate:1
         python -m utool.util_parallel --test-generate:2
         python -m utool.util_parallel --test-generate:3
+        python -m utool.util_parallel --test-generate:4
+        python -m utool.util_parallel --test-generate:5
+        python -m utool.util_parallel --test-generate:6
+        python -m utool.util_parallel --test-generate:7
         python -m utool.util_parallel --test-generate --verbose
 
         python -c "import multiprocessing; print(multiprocessing.__version__)"
@@ -522,9 +1595,81 @@ def generate(func, args_list, ordered=True, force_serial=None,
     #    >>> import time
     #    >>> time.sleep(10)
 
+    Example4:
+        >>> # ENABLE_DOCTEST
+        >>> # Large arrays are passed to the workers through shared memory
+        >>> import utool as ut
+        >>> import numpy as np
+        >>> from utool.util_parallel import SharedArrayArena, _fill_shared_task
+        >>> arrs = [np.full((64, 256), i, dtype=np.float64) for i in range(8)]
+        >>> sums = list(ut.generate(np.sum, arrs, use_shared_memory=True,
+        >>>                         verbose=False))
+        >>> assert sums == [arr.sum() for arr in arrs]
+        >>> # Workers can write into arrays allocated by an arena
+        >>> with SharedArrayArena() as arena:
+        >>>     out = arena.empty((8, 64, 256), dtype=np.float64)
+        >>>     args_list = [(out[i], i) for i in range(8)]
+        >>>     list(ut.generate(_fill_shared_task, args_list,
+        >>>                      shared_arena=arena, verbose=False))
+        >>>     result = out.sum(axis=(1, 2)).tolist()
+        >>> print(result)
+        [0.0, 16384.0, 32768.0, 49152.0, 65536.0, 81920.0, 98304.0, 114688.0]
+
+    Example5:
+        >>> # ENABLE_DOCTEST
+        >>> # I/O bound work runs on threads, 'auto' detects it
+        >>> import utool as ut
+        >>> import time
+        >>> args_list = [.01] * 16
+        >>> threaded = list(ut.generate(time.sleep, args_list, backend='thread',
+        >>>                             verbose=False))
+        >>> auto = list(ut.generate(time.sleep, args_list, backend='auto',
+        >>>                         verbose=False))
+        >>> serial = list(ut.generate(time.sleep, args_list, backend='serial',
+        >>>                           verbose=False))
+        >>> assert threaded == auto == serial == [None] * 16
+
+    Example6:
+        >>> # ENABLE_DOCTEST
+        >>> # Failures are captured per task instead of aborting the batch
+        >>> import utool as ut
+        >>> from utool.util_parallel import _flaky_task
+        >>> args_list = [1, 2, 'x', 4, -1, 6]
+        >>> records = list(ut.generate(_flaky_task, args_list,
+        >>>                            on_error='capture', retries=1,
+        >>>                            retry_backoff=0, timeout=1,
+        >>>                            verbose=False))
+        >>> assert [rec.index for rec in records] == list(range(6))
+        >>> failed = [rec for rec in records if not rec.ok]
+        >>> assert 'TypeError' in failed[0].traceback
+        >>> assert isinstance(failed[1].error, ut.TaskTimeoutError)
+        >>> result = ([rec.result for rec in records],
+        >>>           [rec.attempts for rec in records])
+        >>> print(result)
+        ([2, 4, None, 8, None, 12], [1, 1, 2, 1, 2, 1])
+
+    Example7:
+        >>> # ENABLE_DOCTEST
+        >>> # Uneven tasks are scheduled longest first but yielded in order
+        >>> import utool as ut
+        >>> from utool.util_parallel import _benchmark_task
+        >>> durations = [.001] * 20 + [.05] + [.001] * 20 + [.03]
+        >>> ordered = list(ut.generate(_benchmark_task, durations,
+        >>>                            cost_func=lambda d: d, verbose=False))
+        >>> assert ordered == durations
+        >>> unordered = list(ut.generate(_benchmark_task, durations,
+        >>>                              costs=durations, ordered=False,
+        >>>                              backend='thread', verbose=False))
+        >>> assert sorted(unordered) == sorted(durations)
     """
     if force_serial is None:
         force_serial = __FORCE_SERIAL__
+    if backend is None:
+        backend = 'process'
+    if backend not in BACKENDS:
+        raise ValueError('backend=%r must be one of %r' % (backend, BACKENDS))
+    if backend == 'serial':
+        force_serial = True
     if nTasks is None:
         nTasks = len(args_list)
     if nTasks == 1 or nTasks < MIN_PARALLEL_TASKS:
@@ -536,6 +1681,58 @@ def generate(func, args_list, ordered=True, force_serial=None,
     if VERYVERBOSE_PARALLEL:
         print('[util_parallel.generate] ordered=%r' % ordered)
         print('[util_parallel.generate] force_serial=%r' % force_serial)
+        print('[util_parallel.generate] backend=%r' % backend)
+    if broker is not None:
+        unsupported = [key for key, val in [
+            ('on_error', on_error), ('retries', retries),
+            ('timeout', timeout), ('costs', costs), ('cost_func', cost_func)]
+            if val]
+        if unsupported:
+            raise ValueError('%s not supported with broker' % (
+                ', '.join(unsupported),))
+        return broker.generate(func, args_list, ordered=ordered,
+                               nTasks=nTasks, prog=prog, verbose=verbose,
+                               quiet=quiet, freq=freq, **kwargs)
+    if cost_func is not None and costs is None:
+        args_list = list(args_list)
+        costs = [cost_func(args) for args in args_list]
+    if on_error is not None or retries or timeout is not None:
+        if chunksize is not None or use_shared_memory or shared_arena:
+            raise ValueError('chunksize, use_shared_memory and shared_arena '
+                             'are not supported with on_error, retries or '
+                             'timeout')
+        if force_serial:
+            backend = 'serial'
+        elif backend == 'auto':
+            backend = 'process'
+        if VERBOSE_PARALLEL or verbose:
+            print('[util_parallel.generate] generate_tolerant backend=%r '
+                  'retries=%r timeout=%r' % (backend, retries, timeout))
+        result_generator = _generate_tolerant(
+            func, args_list, ordered=ordered, on_error=on_error or 'raise',
+            retries=retries, retry_backoff=retry_backoff, timeout=timeout,
+            backend=backend, costs=costs, quiet=quiet)
+        if prog and verbose:
+            lbl = '(pargen) %s: ' % (get_funcname(func),)
+            result_generator = util_progress.ProgressIter(
+                result_generator, nTotal=nTasks, lbl=lbl, freq=freq,
+                adjust=kwargs.get('adjust', False), verbose=not quiet)
+        return result_generator
+    if backend == 'auto' and not force_serial:
+        return _generate_auto(func, args_list, ordered=ordered,
+                              chunksize=chunksize, prog=prog,
+                              verbose=verbose, quiet=quiet, nTasks=nTasks,
+                              freq=freq, use_shared_memory=use_shared_memory,
+                              shared_arena=shared_arena, costs=costs,
+                              **kwargs)
+    if backend == 'thread' and not force_serial:
+        if VERBOSE_PARALLEL or verbose:
+            print('[util_parallel.generate] generate_threaded')
+        return _generate_parallel(func, args_list, ordered=ordered,
+                                  chunksize=chunksize, prog=prog,
+                                  verbose=verbose, quiet=quiet, nTasks=nTasks,
+                                  freq=freq, backend='thread', costs=costs,
+                                  **kwargs)
     # Check conditions under which we force serial
     if USE_GLOBAL_POOL:
         if not force_serial:
@@ -551,17 +1748,117 @@ def generate(func, args_list, ordered=True, force_serial=None,
         return _generate_parallel(func, args_list, ordered=ordered,
                                   chunksize=chunksize, prog=prog,
                                   verbose=verbose, quiet=quiet, nTasks=nTasks,
-                                  freq=freq, **kwargs)
+                                  freq=freq,
+                                  use_shared_memory=use_shared_memory,
+                                  shared_arena=shared_arena, costs=costs,
+                                  **kwargs)
+
+
+def _stream_futures(executor, func, args_iter, max_in_flight, ordered=True):
+    """
+    Submits func(args) for each args in args_iter with at most max_in_flight
+    tasks pending at a time and yields the results in submission order or as
+    they complete. Tasks that were not started are cancelled if the consumer
+    stops early or a task raises.
+    """
+    from concurrent import futures
+    import collections
+    args_iter = iter(args_iter)
+    max_in_flight = max(1, max_in_flight)
+
+    def _submit_next(num):
+        return [executor.submit(func, args)
+                for args in itertools.islice(args_iter, num)]
+
+    if ordered:
+        pending = collections.deque(_submit_next(max_in_flight))
+    else:
+        pending = set(_submit_next(max_in_flight))
+    try:
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                result = fut.result()
+                # Refill before yielding so workers stay busy while the
+                # consumer handles the result
+                if ordered:
+                    pending.extend(_submit_next(1))
+                else:
+                    pending.update(_submit_next(1))
+                yield result
+    finally:
+        for fut in pending:
+            fut.cancel()
 
 
 def futures_generate(worker, args_gen, nTasks=None, freq=10, ordered=True,
                      force_serial=False, quiet=QUIET, verbose=None, prog=True,
+                     max_in_flight=None, num_procs=None, backend='process',
+                     on_error=None, retries=0, retry_backoff=.1, timeout=None,
                      **kwargs):
-    from utool import util_resources
+    """
+    Streaming version of generate built on concurrent.futures.
+
+    Arguments are pulled from ``args_gen`` lazily and at most
+    ``max_in_flight`` tasks are submitted at any time, so memory use stays
+    bounded no matter how long (or infinite) ``args_gen`` is.
+
+    Args:
+        worker (function): function to apply to each argument
+        args_gen (iter): iterable of arguments. It is only consumed as
+            workers become free.
+        nTasks (int): number of tasks (only used for progress). Defaults to
+            len(args_gen) if it has a length.
+        ordered (bool): if False results are yielded as they complete
+        max_in_flight (int): maximum number of submitted but unconsumed
+            tasks. Defaults to twice the number of processes.
+        num_procs (int): defaults to get_default_numprocs(), or to
+            get_default_numthreads() for the thread backend
+        backend (str): 'process', 'thread' or 'serial'
+        on_error, retries, retry_backoff, timeout: error policy, see generate
+
+    Returns:
+        generator which yields worker(args) for args in args_gen
+
+    CommandLine:
+        python -m utool.util_parallel --test-futures_generate
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> import utool as ut
+        >>> from utool.util_parallel import *  # NOQA
+        >>> num_pulled = [0]
+        >>> def args_gen(num):
+        >>>     for x in range(num):
+        >>>         num_pulled[0] += 1
+        >>>         yield x
+        >>> gen = futures_generate(ut.is_prime, args_gen(100), max_in_flight=4,
+        >>>                        num_procs=2, verbose=False)
+        >>> first = next(gen)
+        >>> assert num_pulled[0] <= 5, 'args_gen should be consumed lazily'
+        >>> flags = [first] + list(gen)
+        >>> assert flags == list(map(ut.is_prime, range(100)))
+        >>> unordered = futures_generate(ut.is_prime, range(100), ordered=False,
+        >>>                              num_procs=2, verbose=False)
+        >>> assert sorted(unordered) == sorted(flags)
+        >>> result = sum(flags)
+        >>> print(result)
+        25
+    """
     # Check conditions under which we force serial
     if force_serial is None:
         force_serial = __FORCE_SERIAL__
-    if nTasks == 1 or nTasks < MIN_PARALLEL_TASKS:
+    if backend not in ('process', 'thread', 'serial'):
+        raise ValueError('backend=%r is not supported' % (backend,))
+    if backend == 'serial':
+        force_serial = True
+    if nTasks is None and hasattr(args_gen, '__len__'):
+        nTasks = len(args_gen)
+    if nTasks is not None and (nTasks == 1 or nTasks < MIN_PARALLEL_TASKS):
         force_serial = True
     if verbose is None:
         verbose = True
@@ -569,64 +1866,286 @@ def futures_generate(worker, args_gen, nTasks=None, freq=10, ordered=True,
         verbose = 1
     if VERYVERBOSE_PARALLEL:
         verbose = 2
-    if force_serial is None:
-        force_serial = __FORCE_SERIAL__
-    if nTasks is None:
-        nTasks = len(args_gen)
     if nTasks == 0:
         if verbose:
-            print('[util_parallel.generate] submitted 0 tasks')
-        raise StopIteration
+            print('[util_parallel.futures_generate] submitted 0 tasks')
+        return
     if verbose > 1:
-        print('[util_parallel.generate] ordered=%r' % ordered)
-        print('[util_parallel.generate] force_serial=%r' % force_serial)
-
-    nprocs = max(1, util_resources.num_cpus() - 1)
+        print('[util_parallel.futures_generate] ordered=%r' % ordered)
+        print('[util_parallel.futures_generate] force_serial=%r' % force_serial)
 
-    if force_serial:
+    if num_procs is None:
+        if backend == 'thread':
+            num_procs = get_default_numthreads()
+        else:
+            num_procs = get_default_numprocs()
+    if max_in_flight is None:
+        max_in_flight = 2 * num_procs
+
+    if on_error is not None or retries or timeout is not None:
+        result_generator = _generate_tolerant(
+            worker, args_gen, ordered=ordered, on_error=on_error or 'raise',
+            retries=retries, retry_backoff=retry_backoff, timeout=timeout,
+            backend='serial' if force_serial else backend,
+            num_procs=num_procs, max_in_flight=max_in_flight, quiet=quiet)
+        if prog and verbose:
+            lbl = '(futgen) %s: ' % (get_funcname(worker),)
+            result_generator = util_progress.ProgressIter(
+                result_generator, nTotal=nTasks, lbl=lbl, freq=freq,
+                adjust=kwargs.get('adjust', False), verbose=not quiet)
+        for result in result_generator:
+            yield result
+    elif force_serial:
         if VERBOSE_PARALLEL or verbose:
-            print('[util_parallel.generate] generate_serial')
+            print('[util_parallel.futures_generate] generate_serial')
         for result in _generate_serial(worker, args_gen, prog=prog,
-                                       quiet=quiet, nTasks=nTasks, freq=freq,
-                                       **kwargs):
+                                       verbose=verbose, quiet=quiet,
+                                       nTasks=nTasks, freq=freq, **kwargs):
             yield result
     else:
         from concurrent import futures
-
-        func = worker
-
         prog = prog and verbose
         if verbose or VERBOSE_PARALLEL:
-            prefix = '[util_parallel._generate_parallel]'
+            prefix = '[util_parallel.futures_generate]'
             fmtstr = (prefix +
-                      'executing %d %s tasks using %d processes')
-            print(fmtstr % (nTasks, get_funcname(func), nprocs))
-
-        if prog:
-            lbl = '(pargen) %s: ' % (get_funcname(func),)
-            args_gen = util_progress.ProgIter(
-                args_gen, nTotal=nTasks, lbl='submitting process',
-                freq=kwargs.get('freq', None), bs=kwargs.get('bs', True),
-                adjust=kwargs.get('adjust', False)
-            )
-        # executor = futures.ProcessPoolExecutor(nprocs)
-        # try:
-        with futures.ProcessPoolExecutor(nprocs) as executor:
-            fs_chunk = [executor.submit(worker, args) for args in args_gen]
+                      'executing %s %s tasks using %d %s with '
+                      'max_in_flight=%d')
+            print(fmtstr % ('?' if nTasks is None else nTasks,
+                            get_funcname(worker), num_procs,
+                            'threads' if backend == 'thread' else 'processes',
+                            max_in_flight))
+        if backend == 'thread':
+            Executor = futures.ThreadPoolExecutor
+        else:
+            Executor = futures.ProcessPoolExecutor
+        with Executor(num_procs) as executor:
+            result_generator = _stream_futures(executor, worker, args_gen,
+                                               max_in_flight, ordered)
             if prog:
-                fs_chunk = util_progress.ProgIter(
-                    fs_chunk, nTotal=nTasks, lbl=lbl,
-                    freq=kwargs.get('freq', None), bs=kwargs.get('bs', True),
-                    adjust=kwargs.get('adjust', False)
-                )
-            for fs in fs_chunk:
-                yield fs.result()
-        # except Exception:
-        #     raise
-        # finally:
-        #     print('pool shutdown')
-        #     executor.shutdown(wait=True)
-        print('EXECUTOR SHUTDOWN')
+                lbl = '(futgen) %s: ' % (get_funcname(worker),)
+                result_generator = util_progress.ProgressIter(
+                    result_generator, nTotal=nTasks, lbl=lbl, freq=freq,
+                    backspace=kwargs.get('backspace', True),
+                    adjust=kwargs.get('adjust', False), verbose=not quiet)
+            for result in result_generator:
+                yield result
+
+
+class _AsyncTaskStream(object):
+    """
+    Async iterator behind async_generate. Written with plain futures and
+    callbacks (no async syntax) so this module still imports on python 2.
+    """
+    def __init__(self, func, args_gen, concurrency, ordered, timeout,
+                 return_exceptions, prog_iter):
+        self.func = func
+        self.args_iter = enumerate(args_gen)
+        self.concurrency = max(1, concurrency)
+        self.ordered = ordered
+        self.timeout = timeout
+        self.return_exceptions = return_exceptions
+        self.prog_iter = prog_iter
+        self.exhausted = False
+        self.inflight = set()
+        self.ready = {}
+        self.next_index = 0
+        self.waiters = []
+        self.failed = False
+
+    def __aiter__(self):
+        return self
+
+    def _start(self, index, args):
+        import asyncio
+        if asyncio.iscoroutinefunction(self.func):
+            awaitable = self.func(args)
+        else:
+            # plain functions (e.g. util_cplat.cmd) run in the default
+            # executor
+            loop = asyncio.get_event_loop()
+            awaitable = loop.run_in_executor(None, self.func, args)
+        if self.timeout is not None:
+            awaitable = asyncio.wait_for(awaitable, self.timeout)
+        task = asyncio.ensure_future(awaitable)
+        task.add_done_callback(
+            lambda task, index=index: self._on_done(index, task))
+        self.inflight.add(task)
+
+    def _fill(self):
+        while (not self.exhausted and not self.failed and
+               len(self.inflight) < self.concurrency):
+            try:
+                index, args = six.next(self.args_iter)
+            except StopIteration:
+                self.exhausted = True
+            else:
+                self._start(index, args)
+
+    def _on_done(self, index, task):
+        self.inflight.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None and not self.return_exceptions:
+            self.failed = True
+            self.cancel()
+        self.ready[index] = (error, None if error else task.result())
+        if self.prog_iter is not None:
+            six.next(self.prog_iter, None)
+        self._fill()
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.waiters:
+            if self.ordered:
+                if self.next_index not in self.ready:
+                    # a failure that is out of order is reported now. Once
+                    # it has been reported none may be left.
+                    error_idxs = ([index for index, (error, _) in
+                                   self.ready.items() if error]
+                                  if self.failed else [])
+                    out = (self.ready.pop(min(error_idxs)) if error_idxs
+                           else None)
+                else:
+                    out = self.ready.pop(self.next_index)
+                    self.next_index += 1
+            else:
+                out = (self.ready.pop(next(iter(self.ready)))
+                       if self.ready else None)
+            if out is None:
+                if self.exhausted and not self.inflight:
+                    if self.prog_iter is not None:
+                        # exhaust the progress iterator so it reports the end
+                        six.next(self.prog_iter, None)
+                        self.prog_iter = None
+                    waiter = self.waiters.pop(0)
+                    if not waiter.done():
+                        waiter.set_exception(StopAsyncIteration())
+                    continue
+                return
+            waiter = self.waiters.pop(0)
+            if waiter.done():
+                continue
+            error, result = out
+            if error is not None and not self.return_exceptions:
+                self.exhausted = True
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(result if error is None else error)
+
+    def __anext__(self):
+        import asyncio
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        self._fill()
+        self._dispatch()
+        return waiter
+
+    def cancel(self):
+        """ cancels all running tasks and stops pulling arguments """
+        self.exhausted = True
+        for task in list(self.inflight):
+            task.cancel()
+        self.inflight.clear()
+
+
+def async_generate(func, args_gen, concurrency=8, ordered=True, timeout=None,
+                   return_exceptions=False, nTasks=None, prog=True,
+                   verbose=True, freq=None):
+    r"""
+    Maps a coroutine function over args_gen on the running asyncio loop.
+
+    At most ``concurrency`` calls run at once (a semaphore without the
+    overhead of creating every task up front) and arguments are pulled
+    lazily. Use with ``async for``. See async_generate_sync for callers
+    that are not async.
+
+    Args:
+        func (function): coroutine function (or a plain function, which is
+            run in the loop's default executor) called as func(args)
+        args_gen (iter): arguments of each call
+        concurrency (int): maximum number of calls in flight (default = 8)
+        ordered (bool): if False results are yielded as they complete
+        timeout (float): seconds before a call fails with
+            asyncio.TimeoutError
+        return_exceptions (bool): yield exceptions as results instead of
+            raising the first one (like asyncio.gather)
+        nTasks (int): number of tasks for progress reporting
+
+    Returns:
+        async iterator of results
+
+    CommandLine:
+        python -m utool.util_parallel --test-async_generate
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> import asyncio
+        >>> async def fetch(x):
+        >>>     await asyncio.sleep(.01 * (x % 3))
+        >>>     if x == 7:
+        >>>         await asyncio.sleep(10)
+        >>>     return x * 2
+        >>> async def main():
+        >>>     ordered = [r async for r in async_generate(
+        >>>         fetch, range(7), concurrency=3, verbose=False)]
+        >>>     unordered = [r async for r in async_generate(
+        >>>         fetch, range(7), ordered=False, verbose=False)]
+        >>>     return ordered, sorted(unordered)
+        >>> ordered, unordered = asyncio.run(main())
+        >>> assert ordered == unordered
+        >>> # the sync wrapper, with a timeout captured as a result
+        >>> results = list(async_generate_sync(fetch, range(6, 9), timeout=.5,
+        >>>                                    return_exceptions=True,
+        >>>                                    verbose=False))
+        >>> result = 'ordered=%r\ntimeout=%r' % (
+        >>>     ordered, [type(r).__name__ for r in results])
+        >>> print(result)
+        ordered=[0, 2, 4, 6, 8, 10, 12]
+        timeout=['int', 'TimeoutError', 'int']
+    """
+    if nTasks is None and hasattr(args_gen, '__len__'):
+        nTasks = len(args_gen)
+    prog_iter = None
+    if prog and verbose:
+        lbl = '(asyncgen) %s: ' % (get_funcname(func),)
+        prog_iter = iter(util_progress.ProgressIter(
+            range(nTasks) if nTasks is not None else itertools.count(),
+            nTotal=nTasks, lbl=lbl, freq=freq, adjust=True))
+    return _AsyncTaskStream(func, args_gen, concurrency, ordered, timeout,
+                            return_exceptions, prog_iter)
+
+
+def async_generate_sync(func, args_gen, **kwargs):
+    """
+    Runs async_generate on a private event loop and yields its results
+    like ut.generate. Takes the same arguments as async_generate.
+    """
+    import asyncio
+    loop = asyncio.new_event_loop()
+    stream = None
+    try:
+        asyncio.set_event_loop(loop)
+        stream = async_generate(func, args_gen, **kwargs)
+        while True:
+            try:
+                result = loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+            yield result
+    finally:
+        if stream is not None:
+            stream.cancel()
+            # let cancelled tasks finish unwinding
+            pending = [task for task in asyncio.all_tasks(loop)
+                       if not task.done()] if hasattr(
+                           asyncio, 'all_tasks') else []
+            if pending:
+                loop.run_until_complete(asyncio.gather(
+                    *pending, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
 
 
 # def futures_generate_(worker, args_gen):
@@ -639,6 +2158,21 @@ def futures_generate(worker, args_gen, nTasks=None, freq=10, ordered=True,
 #             yield fs.result()
 
 
+def _flaky_task(x):
+    """ doubles x, hangs if x is negative (used in tests) """
+    if x < 0:
+        import time
+        time.sleep(60)
+    return x * 2
+
+
+def _fill_shared_task(tup):
+    """ writes into an array owned by the caller (used in tests) """
+    out, value = tup
+    out[...] = value
+    return out.shape
+
+
 def __testwarp(tup):
     # THIS DOES NOT CAUSE A PROBLEM FOR SOME FREAKING REASON
     import cv2
@@ -1050,7 +2584,7 @@ def buffered_generator(source_gen, buffer_size=2, use_multiprocessing=False):
         #output = buffer_.get(timeout=1.0)
         output = buffer_.get()
         if output is sentinal:
-            raise StopIteration
+            return
         yield output
 
     #_iter = iter(buffer_.get, sentinal)
@@ -1060,6 +2594,307 @@ def buffered_generator(source_gen, buffer_size=2, use_multiprocessing=False):
     #    yield data
 
 
+# sequence number that marks the end of a pipeline stream
+_PIPE_STOP = -1
+
+
+def _pipeline_get(in_q, stop):
+    """ blocking get that gives up (returns None) once stop is set """
+    while True:
+        try:
+            return in_q.get(timeout=.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+
+def _pipeline_put(out_q, item, stop):
+    """ blocking put that gives up (returns False) once stop is set """
+    while True:
+        try:
+            out_q.put(item, timeout=.1)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+
+def _pipeline_qsize(in_q):
+    try:
+        return in_q.qsize()
+    except NotImplementedError:
+        # multiprocessing queues on OSX
+        return 0
+
+
+def _pipeline_feed(source, out_q, stop):
+    """ runs the source iterable like buffered_generator's producer thread """
+    seq = 0
+    try:
+        for seq, item in enumerate(source):
+            if not _pipeline_put(out_q, (seq, False, item), stop):
+                return
+        seq += 1
+    except Exception as ex:
+        import traceback
+        _pipeline_put(out_q, (seq, True, (ex, traceback.format_exc(),
+                                          'source')), stop)
+    _pipeline_put(out_q, (_PIPE_STOP, False, None), stop)
+
+
+def _pipeline_worker(func, in_q, out_q, stop, stats, done_count, num_workers,
+                     name):
+    """
+    Worker loop of one pipeline stage (run in a thread or a process).
+    Items are (seq, is_error, value) tuples. Errors pass through the
+    remaining stages untouched. The last worker of a stage to see the end
+    marker forwards it, the others put it back for their siblings.
+    """
+    task = _CapturedTask(func)
+    from timeit import default_timer
+    while True:
+        item = _pipeline_get(in_q, stop)
+        if item is None:
+            return
+        seq, is_error, value = item
+        if seq == _PIPE_STOP:
+            with done_count.get_lock():
+                done_count.value += 1
+                is_last = done_count.value == num_workers
+            if is_last:
+                _pipeline_put(out_q, item, stop)
+            else:
+                _pipeline_put(in_q, item, stop)
+            return
+        occupancy = _pipeline_qsize(in_q)
+        busy = 0.0
+        if not is_error:
+            start = default_timer()
+            error, tb, value = task(value)
+            busy = default_timer() - start
+            if error is not None:
+                is_error, value = True, (error, tb, name)
+        with stats.get_lock():
+            stats[0] += 1
+            stats[1] += busy
+            stats[2] += occupancy
+            stats[3] = max(stats[3], occupancy)
+        if not _pipeline_put(out_q, (seq, is_error, value), stop):
+            return
+
+
+class Pipeline(object):
+    r"""
+    Streams items through a chain of stages, e.g. read -> decode -> compute
+    -> write.
+
+    Each stage has its own number of workers, run as threads (I/O bound
+    stages) or processes (cpu bound stages, func must be picklable), and
+    stages are connected by bounded queues so a slow stage applies back
+    pressure instead of letting memory grow. The source is consumed in a
+    feeder thread like buffered_generator does. The first exception raised
+    by the source or any stage stops every worker and is re-raised from
+    ``run`` with the failing stage's traceback printed. Closing the
+    generator returned by ``run`` also shuts the pipeline down.
+
+    After (or during) a run ``stats`` reports per-stage throughput, how busy
+    the workers were, and how full the input queue was, which shows where
+    the bottleneck is.
+
+    Args:
+        maxsize (int): default capacity of the queue in front of each stage
+
+    CommandLine:
+        python -m utool.util_parallel --test-Pipeline
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> import utool as ut
+        >>> pipe = Pipeline(maxsize=4)
+        >>> pipe = pipe.add_stage(lambda x: x * 3, num_workers=2, name='read')
+        >>> pipe = pipe.add_stage(ut.is_prime, num_workers=2, backend='process',
+        >>>                       name='compute')
+        >>> pipe = pipe.add_stage(int, name='write')
+        >>> flags = list(pipe.run(range(100)))
+        >>> assert flags == [int(ut.is_prime(x * 3)) for x in range(100)]
+        >>> stats = pipe.stats()
+        >>> assert [s['items'] for s in stats] == [100, 100, 100]
+        >>> # errors stop the pipeline and are raised by run
+        >>> bad = Pipeline().add_stage(lambda x: 1 / x, num_workers=3)
+        >>> try:
+        >>>     list(bad.run([1, 2, 0, 4]))
+        >>> except ZeroDivisionError:
+        >>>     caught = True
+        >>> result = ('names=%r, caught=%r' % ([s['name'] for s in stats], caught))
+        >>> print(result)
+        names=['read', 'compute', 'write'], caught=True
+    """
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.stages = []
+        self._wall_time = None
+
+    def add_stage(self, func, num_workers=1, backend='thread', maxsize=None,
+                  name=None):
+        """
+        Args:
+            func (function): applied to every item
+            num_workers (int): number of threads or processes
+            backend (str): 'thread' or 'process'
+            maxsize (int): capacity of the queue in front of this stage
+
+        Returns:
+            Pipeline: self, so calls can be chained
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError('backend=%r must be thread or process' % (
+                backend,))
+        if name is None:
+            name = '%d_%s' % (len(self.stages), get_funcname(func))
+        self.stages.append(dict(
+            func=func, num_workers=max(1, num_workers), backend=backend,
+            maxsize=self.maxsize if maxsize is None else maxsize, name=name,
+            stats=None))
+        return self
+
+    def run(self, source, ordered=True):
+        """
+        Args:
+            source (iterable): items fed to the first stage
+            ordered (bool): yield outputs in source order (default = True)
+
+        Yields:
+            output of the last stage for each item
+        """
+        from timeit import default_timer
+        if not self.stages:
+            raise ValueError('pipeline has no stages')
+        use_mp = any(stage['backend'] == 'process' for stage in self.stages)
+        stop = multiprocessing.Event() if use_mp else threading.Event()
+        # queue i feeds stage i; the last queue feeds the caller
+        queues = []
+        for index in range(len(self.stages) + 1):
+            before = self.stages[index - 1] if index > 0 else None
+            after = self.stages[index] if index < len(self.stages) else None
+            maxsize = after['maxsize'] if after else self.maxsize
+            crosses = any(stage is not None and stage['backend'] == 'process'
+                          for stage in (before, after))
+            queues.append(multiprocessing.Queue(maxsize) if crosses else
+                          queue.Queue(maxsize))
+        workers = []
+        for index, stage in enumerate(self.stages):
+            stage['stats'] = multiprocessing.Array('d', 4)
+            done_count = multiprocessing.Value('i', 0)
+            Worker = (multiprocessing.Process if stage['backend'] == 'process'
+                      else threading.Thread)
+            for _ in range(stage['num_workers']):
+                worker = Worker(target=_pipeline_worker, args=(
+                    stage['func'], queues[index], queues[index + 1], stop,
+                    stage['stats'], done_count, stage['num_workers'],
+                    stage['name']))
+                worker.daemon = True
+                workers.append(worker)
+        # start processes before any thread so they do not fork running
+        # threads
+        workers.sort(key=lambda w: not isinstance(w, multiprocessing.Process))
+        for worker in workers:
+            worker.start()
+        feeder = threading.Thread(target=_pipeline_feed,
+                                  args=(iter(source), queues[0], stop))
+        feeder.daemon = True
+        feeder.start()
+        start = default_timer()
+        self._wall_time = None
+        self._start_time = start
+        finished = False
+        try:
+            out_q = queues[-1]
+            buffer_ = {}
+            next_seq = 0
+            while True:
+                try:
+                    item = out_q.get(timeout=1.0)
+                except queue.Empty:
+                    crashed = [w for w in workers if
+                               isinstance(w, multiprocessing.Process) and
+                               w.exitcode not in (None, 0)]
+                    if crashed:
+                        raise RuntimeError('pipeline worker %s died with '
+                                           'exitcode %r' % (
+                                               crashed[0].name,
+                                               crashed[0].exitcode))
+                    continue
+                seq, is_error, value = item
+                if seq == _PIPE_STOP:
+                    break
+                if is_error:
+                    error, tb, name = value
+                    print('[util_parallel.Pipeline] stage %s failed:\n%s' % (
+                        name, tb))
+                    raise error
+                if ordered:
+                    buffer_[seq] = value
+                    while next_seq in buffer_:
+                        yield buffer_.pop(next_seq)
+                        next_seq += 1
+                else:
+                    yield value
+            finished = True
+        finally:
+            if not finished:
+                stop.set()
+            feeder.join(1.0)
+            for worker in workers:
+                worker.join(None if finished else 1.0)
+                if isinstance(worker, multiprocessing.Process) and (
+                        worker.is_alive()):
+                    worker.terminate()
+            # measured after the join so work drained on shutdown counts
+            self._wall_time = default_timer() - start
+
+    def stats(self):
+        """
+        Returns:
+            list: one dict per stage with the number of items processed,
+                throughput (items per second of pipeline wall time), busy
+                (fraction of worker time spent in func) and the mean and max
+                number of items waiting in the stage's input queue.
+        """
+        from timeit import default_timer
+        wall_time = self._wall_time
+        if wall_time is None:
+            wall_time = default_timer() - getattr(self, '_start_time',
+                                                  default_timer())
+        stats_list = []
+        for stage in self.stages:
+            items, busy, occ_sum, occ_max = (
+                list(stage['stats']) if stage['stats'] is not None else
+                [0, 0, 0, 0])
+            stats_list.append({
+                'name': stage['name'],
+                'backend': stage['backend'],
+                'num_workers': stage['num_workers'],
+                'items': int(items),
+                'throughput': items / wall_time if wall_time else 0.0,
+                'busy': (busy / (wall_time * stage['num_workers'])
+                         if wall_time else 0.0),
+                'queue_mean': occ_sum / items if items else 0.0,
+                'queue_max': int(occ_max),
+                'queue_size': stage['maxsize'],
+            })
+        return stats_list
+
+    def print_stats(self):
+        for s in self.stats():
+            print('[pipeline] %s (%d %s): %d items %.1f/s busy=%.0f%% '
+                  'queue mean=%.1f max=%d/%d' % (
+                      s['name'], s['num_workers'],
+                      'threads' if s['backend'] == 'thread' else 'processes',
+                      s['items'], s['throughput'], 100 * s['busy'],
+                      s['queue_mean'], s['queue_max'], s['queue_size']))
+
+
 def _buffered_generation_thread(source_gen, buffer_, sentinal):
     """ helper for buffered_generator """
     for data in source_gen:
@@ -1080,7 +2915,7 @@ def _buffered_generation_process(source_gen, buffer_, sentinal):
 
 
 def process(func, args_list, args_dict={}, force_serial=None,
-            nTasks=None, quiet=QUIET):
+            nTasks=None, quiet=QUIET, use_shared_memory=None):
     """
     Use ut.generate rather than ut.process
 
@@ -1089,6 +2924,7 @@ def process(func, args_list, args_dict={}, force_serial=None,
         args_list (list or iter):
         args_dict (dict):
         force_serial (bool):
+        use_shared_memory (bool): see generate
 
     Returns:
         result of parallel map(func, args_list)
@@ -1122,17 +2958,31 @@ def process(func, args_list, args_dict={}, force_serial=None,
         result_list = _process_serial(func, args_list, args_dict, nTasks=nTasks,
                                       quiet=quiet)
     else:
-        if __POOL__ is None:
-            pool = new_pool(num_procs=get_default_numprocs(),
-                            init_worker=init_worker,
-                            maxtasksperchild=None)
+        use_shm = _wants_shared_memory(use_shared_memory)
+        if __POOL__ is not None:
+            # a pool from init_pool is used as is and left open
+            pool, is_shared = __POOL__, True
         else:
-            pool = __POOL__
+            pool, is_shared = _get_pool(func=func)
+        arena = None
+        if use_shm:
+            arena = SharedArrayArena()
+            args_list = [arena.share_args(args) for args in args_list]
+            args_dict = arena.share_args(args_dict)
+            func = _SharedMemFunc(func)
         if not quiet:
             print('[util_parallel] executing %d %s tasks using %d processes' %
                   (nTasks, get_funcname(func), pool._processes))
-        result_list = _process_parallel(func, args_list, args_dict, nTasks=nTasks,
-                                        quiet=quiet, pool=pool)
+        finished = False
+        try:
+            result_list = _process_parallel(func, args_list, args_dict,
+                                            nTasks=nTasks, quiet=quiet,
+                                            pool=pool)
+            finished = True
+        finally:
+            _release_pool(pool, is_shared, quiet=quiet, broken=not finished)
+            if arena is not None:
+                arena.close()
     return result_list
 
 
@@ -1298,6 +3148,102 @@ def _spawn_background_thread0(func, *args, **kwargs):
     return thread_id
 
 
+def _benchmark_task(duration):
+    """ busy waits for duration seconds (helper for benchmarks) """
+    from timeit import default_timer
+    end = default_timer() + duration
+    while default_timer() < end:
+        pass
+    return duration
+
+
+def time_generate_throughput(num_tasks=4000, num_repeat=3):
+    """
+    Compares the throughput of generate using a new pool and the fixed
+    chunksize formula against the persistent pool and adaptive chunksize for
+    several task duration distributions.
+
+    CommandLine:
+        python -m utool.util_parallel --exec-time_generate_throughput
+        python -m utool.util_parallel --exec-time_generate_throughput --num-tasks=20000
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> import utool as ut
+        >>> num_tasks = ut.get_argval('--num-tasks', type_=int, default=4000)
+        >>> time_generate_throughput(num_tasks)
+    """
+    global USE_PERSISTENT_POOL
+    import numpy as np
+    import utool as ut
+    rng = np.random.RandomState(0)
+    distributions = [
+        ('microsecond', np.full(num_tasks, 1E-6)),
+        ('100us', np.full(num_tasks, 1E-4)),
+        ('uneven(lognormal 100us)', rng.lognormal(np.log(1E-4), 1.5,
+                                                  num_tasks)),
+        ('few slow(5ms)', np.full(max(num_tasks // 100, 8), 5E-3)),
+    ]
+    prev_flag = USE_PERSISTENT_POOL
+    try:
+        for name, durations in distributions:
+            args_list = durations.tolist()
+            nTasks = len(args_list)
+            serial_time = durations.sum()
+            print('--- %s: %d tasks, %.3fs of work ---' % (name, nTasks,
+                                                          serial_time))
+            num_procs = get_default_numprocs()
+            fixed = max(min(4, nTasks), min(8, nTasks // (num_procs ** 2)))
+            USE_PERSISTENT_POOL = False
+            for timer in ut.Timerit(num_repeat, 'new pool, chunksize=%d' % (
+                    fixed,)):
+                with timer:
+                    list(generate(_benchmark_task, args_list, chunksize=fixed,
+                                  verbose=False, quiet=True, prog=False))
+            USE_PERSISTENT_POOL = True
+            __TASK_TIME_ESTIMATES__.pop(_task_time_key(_benchmark_task), None)
+            for timer in ut.Timerit(num_repeat, 'persistent pool, adaptive'):
+                with timer:
+                    list(generate(_benchmark_task, args_list, verbose=False,
+                                  quiet=True, prog=False))
+            print('task time (mean, cv) = %r' % (
+                __TASK_TIME_ESTIMATES__.get(_task_time_key(_benchmark_task)),))
+    finally:
+        USE_PERSISTENT_POOL = prev_flag
+
+
+def time_cost_scheduling(num_tasks=400, num_repeat=3):
+    """
+    Compares the default imap scheduling with longest processing time first
+    scheduling on tasks whose durations are heavy tailed.
+
+    CommandLine:
+        python -m utool.util_parallel --exec-time_cost_scheduling
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> time_cost_scheduling()
+    """
+    import numpy as np
+    import utool as ut
+    rng = np.random.RandomState(0)
+    durations = rng.pareto(1.5, num_tasks) * 1E-3
+    # the giant items come last, the worst case for in order dispatch
+    durations = np.sort(durations).tolist()
+    print('%d tasks, %.3fs of work, longest=%.3fs' % (
+        num_tasks, sum(durations), max(durations)))
+    for timer in ut.Timerit(num_repeat, 'in order, adaptive chunksize'):
+        with timer:
+            list(generate(_benchmark_task, durations, verbose=False,
+                          quiet=True, prog=False))
+    for timer in ut.Timerit(num_repeat, 'longest first'):
+        with timer:
+            list(generate(_benchmark_task, durations, costs=durations,
+                          verbose=False, quiet=True, prog=False))
+
+
 def futures_map(func, args_list):
     # Requries python2.7
     # pip install futures
@@ -1307,6 +3253,395 @@ def futures_map(func, args_list):
     return result_generator
 
 
+def _is_loopback_host(host):
+    return (host in ('localhost', '::1') or
+            six.text_type(host).startswith('127.'))
+
+
+def _broker_authkey(authkey, host=None):
+    """
+    Returns the authkey given or in $UTOOL_BROKER_AUTHKEY. A broker on a
+    loopback host gets a random key if there is neither. Everywhere else
+    the key must be given explicitly because it protects workers and the
+    broker from running pickles sent by anyone.
+    """
+    import os
+    if authkey is None:
+        authkey = os.environ.get('UTOOL_BROKER_AUTHKEY', None)
+    if authkey is None:
+        if host is None or not _is_loopback_host(host):
+            raise ValueError(
+                'An authkey (or $UTOOL_BROKER_AUTHKEY) is required to '
+                'connect to or listen on %s' % (
+                    'a broker' if host is None else host,))
+        authkey = os.urandom(32)
+    if isinstance(authkey, six.text_type):
+        authkey = authkey.encode('utf8')
+    return authkey
+
+
+def _func_import_path(func):
+    """
+    Returns:
+        str: 'module:qualname' path a remote worker can import func from
+    """
+    module = getattr(func, '__module__', None)
+    name = getattr(func, '__qualname__', None) or get_funcname(func)
+    if module is None or module == '__main__' or '<' in name:
+        raise ValueError(
+            'Tasks sent to a TaskBroker must be importable module level '
+            'functions. Cannot send %r' % (func,))
+    return '%s:%s' % (module, name)
+
+
+def _import_func(func_path):
+    import importlib
+    modname, name = func_path.split(':')
+    obj = importlib.import_module(modname)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class TaskBroker(object):
+    r"""
+    Distributes generate style tasks to workers on other machines over TCP.
+
+    Workers connect with ``python -m utool.util_parallel worker --connect
+    host:port`` (or run_worker) and pull one task at a time. Functions are
+    sent by import path, so they must be importable on the workers, and
+    arguments and results are pickled. Connections are authenticated with
+    an HMAC challenge using ``authkey`` (default: $UTOOL_BROKER_AUTHKEY)
+    before anything is unpickled. A broker listening on a loopback host
+    without a key makes a random one, available as ``broker.authkey``.
+    Workers send heartbeats. A worker that disconnects or is silent for
+    ``heartbeat_timeout`` seconds is dropped and its tasks are requeued.
+
+    Warning:
+        Anyone who knows the authkey can run code on the workers and send
+        pickles to the broker. Only listen on trusted networks.
+
+    Args:
+        host (str): interface to listen on (default = '127.0.0.1')
+        port (int): 0 picks a free port (see ``address``)
+        authkey (str): shared secret, required unless host is a loopback
+            address
+        heartbeat_timeout (float): seconds of silence before a worker is
+            considered dead
+
+    CommandLine:
+        python -m utool.util_parallel --test-TaskBroker
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from utool.util_parallel import *  # NOQA
+        >>> import utool as ut
+        >>> from utool.util_parallel import _benchmark_task
+        >>> broker = TaskBroker(port=0)
+        >>> workers = [multiprocessing.Process(target=run_worker,
+        >>>                                    args=(broker.address,
+        >>>                                          broker.authkey))
+        >>>            for _ in range(2)]
+        >>> for proc in workers:
+        >>>     proc.start()
+        >>> flags = list(broker.generate(ut.is_prime, range(50), verbose=False))
+        >>> assert flags == [ut.is_prime(x) for x in range(50)]
+        >>> # Kill a worker while it holds a task; the task is requeued
+        >>> gen = ut.generate(_benchmark_task, [.05] * 20, broker=broker,
+        >>>                   verbose=False)
+        >>> first = next(gen)
+        >>> workers[0].terminate()
+        >>> durations = [first] + list(gen)
+        >>> broker.close()
+        >>> for proc in workers:
+        >>>     proc.join()
+        >>> result = 'num_results=%r' % (len(durations),)
+        >>> print(result)
+        num_results=20
+    """
+    def __init__(self, host='127.0.0.1', port=0, authkey=None,
+                 heartbeat_timeout=10.0):
+        import collections
+        from multiprocessing.connection import Listener
+        self.heartbeat_timeout = heartbeat_timeout
+        self.authkey = _broker_authkey(authkey, host)
+        self._listener = Listener((host, port), authkey=self.authkey)
+        self.address = self._listener.address
+        self._cond = threading.Condition()
+        self._pending = collections.deque()  # task ids waiting for a worker
+        self._tasks = {}       # task id -> (func_path, args, result queue)
+        self._next_task_id = 0
+        self._num_connections = 0
+        self._closed = False
+        self.workers = {}      # worker name -> set of assigned task ids
+        self.num_requeued = 0
+        self._accept_thread = threading.Thread(target=self._accept_loop)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                # closed listener or a client that failed authentication
+                if self._closed:
+                    return
+                continue
+            thread = threading.Thread(target=self._serve_worker,
+                                      args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_worker(self, conn):
+        assigned = set()
+        with self._cond:
+            self._num_connections += 1
+            name = 'connection-%d' % (self._num_connections,)
+        try:
+            msg = conn.recv()
+            if msg[0] == 'hello':
+                name = '%s:%s (%s)' % (msg[1], msg[2], name)
+                msg = None
+            with self._cond:
+                self.workers[name] = assigned
+            if VERBOSE_PARALLEL:
+                print('[broker] worker %s connected' % (name,))
+            while True:
+                if msg is None:
+                    if not conn.poll(self.heartbeat_timeout):
+                        print('[broker] worker %s missed its heartbeat' % (
+                            name,))
+                        break
+                    msg = conn.recv()
+                msg, prev = None, msg
+                if prev[0] == 'get':
+                    conn.send(self._next_task(assigned))
+                elif prev[0] == 'result':
+                    _, task_id, error, tb, result = prev
+                    with self._cond:
+                        assigned.discard(task_id)
+                        task = self._tasks.pop(task_id, None)
+                    if task is not None:
+                        task[2].put((task_id, error, tb, result))
+        except (EOFError, IOError, OSError):
+            if VERBOSE_PARALLEL:
+                print('[broker] worker %s disconnected' % (name,))
+        finally:
+            with self._cond:
+                self.workers.pop(name, None)
+                requeue = [task_id for task_id in assigned
+                           if task_id in self._tasks]
+                self._pending.extendleft(sorted(requeue, reverse=True))
+                self.num_requeued += len(requeue)
+                self._cond.notify_all()
+            if requeue:
+                print('[broker] requeued %d tasks of worker %s' % (
+                    len(requeue), name))
+            conn.close()
+
+    def _next_task(self, assigned):
+        with self._cond:
+            if not self._pending and not self._closed:
+                self._cond.wait(1.0)
+            if self._closed:
+                return ('shutdown',)
+            while self._pending:
+                task_id = self._pending.popleft()
+                if task_id in self._tasks:
+                    assigned.add(task_id)
+                    func_path, args, _ = self._tasks[task_id]
+                    return ('task', task_id, func_path, args)
+            return ('wait',)
+
+    def _submit(self, func_path, args, result_queue):
+        with self._cond:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._tasks[task_id] = (func_path, args, result_queue)
+            self._pending.append(task_id)
+            self._cond.notify()
+        return task_id
+
+    def _cancel(self, task_ids):
+        with self._cond:
+            for task_id in task_ids:
+                self._tasks.pop(task_id, None)
+
+    def generate(self, func, args_list, ordered=True, nTasks=None, prog=True,
+                 verbose=True, quiet=QUIET, freq=None, max_pending=1000,
+                 **kwargs):
+        """
+        Like ut.generate, but runs the tasks on the connected workers.
+
+        Args:
+            max_pending (int): maximum number of submitted tasks whose
+                results have not been yielded yet
+        """
+        func_path = _func_import_path(func)
+        if nTasks is None and hasattr(args_list, '__len__'):
+            nTasks = len(args_list)
+        if verbose or VERBOSE_PARALLEL:
+            print('[util_parallel.TaskBroker] executing %s %s tasks on %d '
+                  'workers' % ('?' if nTasks is None else nTasks,
+                               func_path, len(self.workers)))
+        raw_generator = self._generate(func_path, args_list, ordered,
+                                       max_pending)
+        if prog and verbose:
+            lbl = '(brokergen) %s: ' % (get_funcname(func),)
+            raw_generator = util_progress.ProgressIter(
+                raw_generator, nTotal=nTasks, lbl=lbl, freq=freq,
+                adjust=kwargs.get('adjust', False), verbose=not quiet)
+        return raw_generator
+
+    def _generate(self, func_path, args_list, ordered, max_pending):
+        result_queue = queue.Queue()
+        index_of = {}
+        buffer_ = {}
+        next_index = 0
+        args_iter = enumerate(args_list)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(index_of) < max_pending:
+                    try:
+                        index, args = six.next(args_iter)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        task_id = self._submit(func_path, args, result_queue)
+                        index_of[task_id] = index
+                if not index_of:
+                    break
+                task_id, error, tb, result = result_queue.get()
+                index = index_of.pop(task_id)
+                if error is not None:
+                    print('[util_parallel.TaskBroker] task %d failed:\n%s' % (
+                        index, tb))
+                    raise error
+                if not ordered:
+                    yield result
+                    continue
+                buffer_[index] = result
+                while next_index in buffer_:
+                    yield buffer_.pop(next_index)
+                    next_index += 1
+        finally:
+            self._cancel(list(index_of.keys()))
+
+    def close(self):
+        """ stops accepting workers and tells connected workers to exit """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            self._listener.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, trace):
+        self.close()
+
+
+def run_worker(address, authkey=None, heartbeat=2.0, verbose=False):
+    """
+    Connects to a TaskBroker and runs tasks until the broker shuts down or
+    the connection is lost.
+
+    Args:
+        address (tuple or str): (host, port) or 'host:port'
+        authkey (str): shared secret of the broker (default:
+            $UTOOL_BROKER_AUTHKEY)
+        heartbeat (float): seconds between heartbeats
+    """
+    import os
+    import socket
+    from multiprocessing.connection import Client
+    if isinstance(address, six.string_types):
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    conn = Client(tuple(address), authkey=_broker_authkey(authkey))
+    send_lock = threading.Lock()
+    stop = threading.Event()
+
+    def _send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    def _heartbeat_loop():
+        while not stop.wait(heartbeat):
+            try:
+                _send(('heartbeat',))
+            except (IOError, OSError):
+                return
+
+    _send(('hello', socket.gethostname(), os.getpid()))
+    heartbeat_thread = threading.Thread(target=_heartbeat_loop)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+    func_cache = {}
+    num_done = 0
+    try:
+        while True:
+            _send(('get',))
+            msg = conn.recv()
+            if msg[0] == 'shutdown':
+                break
+            elif msg[0] == 'wait':
+                continue
+            _, task_id, func_path, args = msg
+            task = func_cache.get(func_path, None)
+            if task is None:
+                task = func_cache[func_path] = _CapturedTask(
+                    _import_func(func_path))
+            error, tb, result = task(args)
+            _send(('result', task_id, error, tb, result))
+            num_done += 1
+    except (EOFError, IOError, OSError):
+        pass
+    finally:
+        stop.set()
+        conn.close()
+    if verbose:
+        print('[worker] finished %d tasks' % (num_done,))
+    return num_done
+
+
+def worker_main(argv=None):
+    """
+    Command line entry point for TaskBroker workers.
+
+    CommandLine:
+        python -m utool.util_parallel worker --connect localhost:5555 --procs 4
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m utool.util_parallel worker',
+        description='Run tasks for a utool TaskBroker')
+    parser.add_argument('--connect', required=True, help='broker host:port')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='number of worker processes (default 1)')
+    parser.add_argument('--authkey', default=None,
+                        help='shared secret (default $UTOOL_BROKER_AUTHKEY)')
+    parser.add_argument('--heartbeat', type=float, default=2.0)
+    args = parser.parse_args(argv)
+    kwargs = dict(authkey=args.authkey, heartbeat=args.heartbeat,
+                  verbose=True)
+    if args.procs == 1:
+        run_worker(args.connect, **kwargs)
+    else:
+        procs = [multiprocessing.Process(target=run_worker,
+                                         args=(args.connect,), kwargs=kwargs)
+                 for _ in range(args.procs)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+
 if __name__ == '__main__':
     """
     Ignore:
@@ -1318,6 +3653,7 @@ if __name__ == '__main__':
 
     CommandLine:
         python -m utool.util_parallel
+        python -m utool.util_parallel worker --connect localhost:5555
         python -m utool.util_parallel --allexamples --testslow
         coverage run -m utool.util_parallel --allexamples
         coverage run -m utool.util_parallel --allexamples --testslow
@@ -1327,5 +3663,9 @@ if __name__ == '__main__':
     """
     #import multiprocessing
     multiprocessing.freeze_support()  # for win32
-    import utool  # NOQA
-    utool.doctest_funcs()
+    import sys
+    if sys.argv[1:2] == ['worker']:
+        worker_main(sys.argv[2:])
+    else:
+        import utool  # NOQA
+        utool.doctest_funcs()
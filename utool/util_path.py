@@ -862,6 +862,22 @@ def move_list(src_list, dst_list, lbl='Moving'):
     return success_list
 
 
+def replace_file(src, dst):
+    """
+    Renames src to dst, overwriting dst. On the same filesystem this is atomic
+    so readers of dst see either the old or the new file, never a partial one.
+    """
+    if six.PY3:
+        os.replace(src, dst)
+    elif sys.platform.startswith('win32'):
+        # python2 on windows cannot rename over an existing file
+        if exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+    else:
+        os.rename(src, dst)
+
+
 def file_bytes(fpath):
     r"""
     Args: